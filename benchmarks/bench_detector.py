@@ -0,0 +1,95 @@
+"""
+Micro-benchmark of $$ detection on paragraph text: the shared FormulaDetector
+against the per-call regex it replaced, plus DOM text assembly by join versus
+repeated concatenation.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_detector --paragraphs 200000
+"""
+import argparse
+import random
+import re
+import time
+import xml.etree.ElementTree as ET
+
+from src.docx_formula_mover.detector import DETECTOR
+from src.docx_formula_mover.scanner import NAMESPACES, W_P, W_R, W_T
+
+def regex_matches(text, paragraph_index, source_name):
+    """The detection loop as it was before detector.py."""
+    matches = []
+    dollar_indices = [m.start() for m in re.finditer(r'(?<!\\)\$\$', text)]
+    if len(dollar_indices) < 2:
+        return matches
+    idx = 0
+    while idx < len(dollar_indices) - 1:
+        start_pos = dollar_indices[idx]
+        end_pos = dollar_indices[idx + 1]
+        matches.append({"text": text[start_pos:end_pos + 2], "paragraph_index": paragraph_index,
+                        "offset": start_pos, "source": source_name})
+        idx += 2
+    return matches
+
+def make_paragraphs(count, seed=0):
+    """Mostly plain prose; some prices, escapes and display math, like real documents."""
+    rng = random.Random(seed)
+    words = ["the", "value", "of", "costs", "$5", "formula", "is", "\\$$", "and", "x"]
+    paragraphs = []
+    for i in range(count):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(5, 40)))
+        if i % 20 == 0:
+            text += " $$a^2 + b^2 = c^2$$ follows"
+        paragraphs.append(text)
+    return paragraphs
+
+def time_detection(find, paragraphs):
+    start = time.perf_counter()
+    found = [find(text, i, "word/document.xml") for i, text in enumerate(paragraphs)]
+    return time.perf_counter() - start, found
+
+def time_text_assembly(root):
+    start = time.perf_counter()
+    concatenated = []
+    for p in root.iter(W_P):
+        text = ""
+        for r in p.iter(W_R):
+            for t in r.iter(W_T):
+                if t.text:
+                    text += t.text
+        concatenated.append(text)
+    concat_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    joined = ["".join([t.text for r in p.iter(W_R) for t in r.iter(W_T) if t.text]) for p in root.iter(W_P)]
+    join_s = time.perf_counter() - start
+    assert joined == concatenated
+    return concat_s, join_s
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark $$ detection and paragraph text assembly.")
+    parser.add_argument('--paragraphs', type=int, default=100000, help='Paragraphs of generated text')
+    parser.add_argument('--runs-per-paragraph', type=int, default=8, help='Runs each paragraph is split into')
+    args = parser.parse_args()
+
+    paragraphs = make_paragraphs(args.paragraphs)
+    regex_s, regex_found = time_detection(regex_matches, paragraphs)
+    detector_s, detector_found = time_detection(DETECTOR.find_matches, paragraphs)
+    assert [[m.to_dict() for m in found] for found in detector_found] == regex_found
+    print(f"detection, {args.paragraphs} paragraphs ({sum(map(len, detector_found))} matches):")
+    print(f"  regex    {regex_s * 1000:8.1f} ms")
+    print(f"  detector {detector_s * 1000:8.1f} ms  ({regex_s / detector_s:.2f}x)")
+
+    body = []
+    for text in paragraphs:
+        step = max(1, len(text) // args.runs_per_paragraph)
+        runs = "".join(f'<w:r><w:t xml:space="preserve">{text[i:i + step]}</w:t></w:r>'
+                       for i in range(0, len(text), step))
+        body.append(f'<w:p>{runs}</w:p>')
+    root = ET.fromstring(f'<w:document xmlns:w="{NAMESPACES["w"]}"><w:body>{"".join(body)}</w:body></w:document>')
+    concat_s, join_s = time_text_assembly(root)
+    print(f"text assembly, {args.runs_per_paragraph} runs per paragraph:")
+    print(f"  +=       {concat_s * 1000:8.1f} ms")
+    print(f"  join     {join_s * 1000:8.1f} ms  ({concat_s / join_s:.2f}x)")
+
+if __name__ == "__main__":
+    main()
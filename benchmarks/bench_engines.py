@@ -0,0 +1,65 @@
+"""
+Compares the 'dom' and 'stream' scan engines on one large generated document.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_engines --paragraphs 200000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from src.docx_formula_mover.scanner import DocxScanner, ENGINES, NAMESPACES
+
+def write_large_docx(path, paragraphs, runs_per_paragraph=4, table_every=50):
+    """Writes a .docx whose document.xml holds `paragraphs` paragraphs, with tables mixed in."""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        with zf.open('word/document.xml', 'w', force_zip64=True) as out:
+            out.write(f'<w:document xmlns:w="{NAMESPACES["w"]}"><w:body>'.encode('utf-8'))
+            for i in range(paragraphs):
+                runs = "".join(f'<w:r><w:t xml:space="preserve">run {j} of paragraph {i} </w:t></w:r>'
+                               for j in range(runs_per_paragraph))
+                if i % 1000 == 0:
+                    runs += '<w:r><w:t>$$x^2$$</w:t></w:r>'
+                p = f'<w:p>{runs}</w:p>'
+                if table_every and i % table_every == 0:
+                    p = f'<w:tbl><w:tr><w:tc>{p}</w:tc></w:tr></w:tbl>'
+                out.write(p.encode('utf-8'))
+            out.write(b'</w:body></w:document>')
+
+def measure(engine, path):
+    scanner = DocxScanner(engine=engine)
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = scanner.scan_file(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dom vs stream scan engines.")
+    parser.add_argument('--paragraphs', type=int, default=100000, help='Paragraphs in the generated document')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "large.docx")
+        write_large_docx(path, args.paragraphs)
+        with zipfile.ZipFile(path) as zf:
+            xml_size = zf.getinfo('word/document.xml').file_size
+        print(f"document.xml: {xml_size / 1e6:.1f} MB, {args.paragraphs} paragraphs")
+        print("(timings include tracemalloc overhead)")
+
+        results = {}
+        for engine in ENGINES:
+            result, elapsed, peak = measure(engine, path)
+            results[engine] = result.matches
+            print(f"{engine:>6}: {elapsed:7.2f} s  peak {peak / 1e6:8.1f} MB  matches {len(result.matches)}")
+
+        if results['dom'] != results['stream']:
+            print("WARNING: engines disagree")
+
+if __name__ == "__main__":
+    main()
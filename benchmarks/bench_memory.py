@@ -0,0 +1,81 @@
+"""
+Measures the memory held per scan result: the former representation (a
+plain object with a list of match dicts) against the slotted ScanResult with
+Match tuples. Results are pickled and unpickled first, as they are when they
+come back from pool workers.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_memory --results 100000 --error-rate 0.2
+"""
+import argparse
+import pickle
+import random
+import tracemalloc
+
+from src.docx_formula_mover.detector import Match
+from src.docx_formula_mover.scanner import ScanResult
+
+SOURCES = ["word/document.xml", "word/header1.xml", "word/footnotes.xml"]
+
+class LegacyScanResult:
+    """ScanResult as it was before __slots__ and Match."""
+    def __init__(self, file_path, is_error, matches, skipped=False, parts_scanned=0, parts_prefiltered=0,
+                 truncated=False, profile=None):
+        self.file_path = file_path
+        self.is_error = is_error
+        self.matches = matches
+        self.skipped = skipped
+        self.truncated = truncated
+        self.parts_scanned = parts_scanned
+        self.parts_prefiltered = parts_prefiltered
+        self.profile = profile
+
+def make_specs(count, error_rate, seed=0):
+    """(file_path, [(text, paragraph_index, offset, source), ...]) per result."""
+    rng = random.Random(seed)
+    specs = []
+    for i in range(count):
+        matches = []
+        if rng.random() < error_rate:
+            for _ in range(rng.randint(1, 6)):
+                matches.append(("$$x_%d^2$$" % rng.randint(0, 99), rng.randint(0, 500), rng.randint(0, 80),
+                                rng.choice(SOURCES)))
+        specs.append((f"/data/corpus/batch_{i // 1000:04d}/document_{i:07d}.docx", matches))
+    return specs
+
+def legacy_result(file_path, matches):
+    return LegacyScanResult(file_path, bool(matches), [
+        {"text": text, "paragraph_index": p, "offset": offset, "source": source}
+        for text, p, offset, source in matches], parts_scanned=1)
+
+def compact_result(file_path, matches):
+    return ScanResult(file_path, bool(matches), [Match(*m) for m in matches], parts_scanned=1)
+
+def measure(build, specs):
+    """Bytes allocated per result for results built by build(), after a pickle round trip each."""
+    payloads = [pickle.dumps(build(file_path, matches)) for file_path, matches in specs]
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    results = [pickle.loads(payload) for payload in payloads]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / len(results), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory held per scan result.")
+    parser.add_argument('--results', type=int, default=100000, help='Scan results to hold')
+    parser.add_argument('--error-rate', type=float, default=0.2, help='Fraction of results with matches')
+    args = parser.parse_args()
+
+    specs = make_specs(args.results, args.error_rate)
+    match_count = sum(len(matches) for _, matches in specs)
+    legacy_bytes, legacy = measure(legacy_result, specs)
+    compact_bytes, compact = measure(compact_result, specs)
+    assert [[dict(m) for m in r.matches] for r in legacy] == [[m.to_dict() for m in r.matches] for r in compact]
+
+    print(f"{args.results} results, {match_count} matches:")
+    print(f"  legacy  {legacy_bytes:8.1f} bytes/result")
+    print(f"  compact {compact_bytes:8.1f} bytes/result  ({legacy_bytes / compact_bytes:.2f}x smaller)")
+
+if __name__ == "__main__":
+    main()
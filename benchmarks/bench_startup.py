@@ -0,0 +1,72 @@
+"""
+Measures cold-start time of the CLI and the web server: each target runs in
+a fresh interpreter and the wall time is compared with a bare interpreter.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_startup --runs 20 --top 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+# name -> interpreter arguments
+TARGETS = {
+    "python": ["-c", "pass"],
+    "cli --help": ["-m", "docx_formula_mover", "--help"],
+    "cli import": ["-c", "import docx_formula_mover.cli"],
+    "server import": ["-c", "import server"],
+}
+
+def run_once(args, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def slowest_imports(args, env, top):
+    """(cumulative_us, module) of the slowest modules imported by the target's own imports."""
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + args, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Modules imported directly by a top-level import (nested two spaces)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI and server startup time.")
+    parser.add_argument('--runs', type=int, default=10, help='Interpreter launches per target')
+    parser.add_argument('--top', type=int, default=0, help='Also list the N slowest imports of each target')
+    args = parser.parse_args()
+
+    # Bytecode caches are written, as for an installed package; the first
+    # launch of each target creates them and warms the OS file cache
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    for target in TARGETS.values():
+        run_once(target, env)
+
+    baseline = None
+    for name, target in TARGETS.items():
+        times = [run_once(target, env) for _ in range(args.runs)]
+        median = statistics.median(times)
+        if baseline is None:
+            baseline = median
+            print(f"{name:>14}: median {median * 1000:6.1f} ms  min {min(times) * 1000:6.1f} ms")
+            continue
+        print(f"{name:>14}: median {median * 1000:6.1f} ms  min {min(times) * 1000:6.1f} ms"
+              f"  (+{(median - baseline) * 1000:.1f} ms over python)")
+        if args.top:
+            for cumulative, module in slowest_imports(target, env, args.top):
+                print(f"{'':>16}{cumulative / 1000:7.1f} ms  {module}")
+
+if __name__ == "__main__":
+    main()
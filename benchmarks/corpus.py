@@ -0,0 +1,160 @@
+"""
+Reproducible synthetic .docx corpora for benchmarks.
+
+Usage (from the repository root):
+    python -m benchmarks.corpus OUT_DIR --files 500 --paragraphs 300 --match-density 0.01
+"""
+import argparse
+import json
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+from src.docx_formula_mover.scanner import NAMESPACES
+
+W_NS = NAMESPACES['w']
+# Members are stamped with a constant time so output is byte-for-byte reproducible
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+WORDS = ("report quarterly revenue interest principal rate formula total balance "
+         "account period growth value table figure section annual summary").split()
+
+DEFAULTS = {
+    "files": 200,
+    "paragraphs": 200,
+    "runs_per_paragraph": 3,
+    "split_runs": 0.5,
+    "headers": 1,
+    "footers": 1,
+    "footnotes": True,
+    "match_density": 0.002,
+    "seed": 0,
+}
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def _runs(rng, text, runs_per_paragraph):
+    """Splits text into runs at random points, like Word does after edits."""
+    if runs_per_paragraph <= 1 or len(text) < runs_per_paragraph:
+        return [text]
+    cuts = sorted(rng.sample(range(1, len(text)), runs_per_paragraph - 1))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+def _paragraph(rng, params, with_match):
+    text = _sentence(rng)
+    if with_match:
+        pos = rng.randrange(len(text) + 1)
+        text = text[:pos] + " $$x^2 + y^2$$ " + text[pos:]
+    runs = _runs(rng, text, params["runs_per_paragraph"])
+    if with_match and rng.random() < params["split_runs"]:
+        # Put every '$' in a run of its own, as in the split_runs_display fixture
+        split = []
+        for run in runs:
+            for piece in run.replace("$", "\0$\0").split("\0"):
+                if piece:
+                    split.append(piece)
+        runs = split
+    body = "".join(f'<w:r><w:t xml:space="preserve">{escape(r)}</w:t></w:r>' for r in runs)
+    return f"<w:p>{body}</w:p>"
+
+def _part(root_tag, paragraphs):
+    return (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<w:{root_tag} xmlns:w="{W_NS}" xmlns:r="{REL_NS}">{paragraphs}</w:{root_tag}>').encode('utf-8')
+
+def _content_type(part_name):
+    stem = os.path.splitext(os.path.basename(part_name))[0].rstrip("0123456789")
+    return "document.main" if stem == "document" else stem
+
+def write_docx(path, rng, params):
+    """Writes one synthetic document; returns the number of paragraphs holding a match."""
+    density = params["match_density"]
+    matched = 0
+
+    def paragraphs(count):
+        nonlocal matched
+        out = []
+        for _ in range(count):
+            with_match = rng.random() < density
+            matched += with_match
+            out.append(_paragraph(rng, params, with_match))
+        return "".join(out)
+
+    parts = {"word/document.xml": _part("document", f"<w:body>{paragraphs(params['paragraphs'])}</w:body>")}
+    for i in range(1, params["headers"] + 1):
+        parts[f"word/header{i}.xml"] = _part("hdr", paragraphs(2))
+    for i in range(1, params["footers"] + 1):
+        parts[f"word/footer{i}.xml"] = _part("ftr", paragraphs(2))
+    if params["footnotes"]:
+        parts["word/footnotes.xml"] = _part("footnotes", f"<w:footnote>{paragraphs(3)}</w:footnote>")
+
+    overrides = "".join(
+        f'<Override PartName="/{name}" ContentType="application/vnd.openxmlformats-officedocument.'
+        f'wordprocessingml.{_content_type(name)}+xml"/>'
+        for name in parts)
+    content_types = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                     '<Default Extension="xml" ContentType="application/xml"/>'
+                     f'{overrides}</Types>')
+    rels = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+            '</Relationships>')
+
+    members = {"[Content_Types].xml": content_types, "_rels/.rels": rels, **parts}
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            # Fixed timestamp: writestr(name) would stamp the current time
+            zf.writestr(zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME), data,
+                        compress_type=zipfile.ZIP_DEFLATED)
+    return matched
+
+def generate_corpus(out_dir, **params):
+    """
+    Writes params["files"] documents to out_dir and a corpus.json describing them.
+    The same parameters (including seed) always produce the same documents.
+    """
+    params = dict(DEFAULTS, **params)
+    rng = random.Random(params["seed"])
+    os.makedirs(out_dir, exist_ok=True)
+    error_files = 0
+    total_bytes = 0
+    for i in range(params["files"]):
+        path = os.path.join(out_dir, f"doc_{i:06d}.docx")
+        if write_docx(path, rng, params):
+            error_files += 1
+        total_bytes += os.path.getsize(path)
+
+    info = {"params": params, "error_files": error_files, "total_bytes": total_bytes}
+    with open(os.path.join(out_dir, "corpus.json"), 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=2)
+    return info
+
+def add_corpus_arguments(parser):
+    parser.add_argument('--files', type=int, default=DEFAULTS["files"], help='Number of documents')
+    parser.add_argument('--paragraphs', type=int, default=DEFAULTS["paragraphs"], help='Body paragraphs per document')
+    parser.add_argument('--runs-per-paragraph', type=int, default=DEFAULTS["runs_per_paragraph"], help='Run fragmentation')
+    parser.add_argument('--split-runs', type=float, default=DEFAULTS["split_runs"], help='Share of matches whose $ are split across runs')
+    parser.add_argument('--headers', type=int, default=DEFAULTS["headers"], help='Header parts per document')
+    parser.add_argument('--footers', type=int, default=DEFAULTS["footers"], help='Footer parts per document')
+    parser.add_argument('--footnotes', action=argparse.BooleanOptionalAction, default=DEFAULTS["footnotes"], help='Include a footnotes part')
+    parser.add_argument('--match-density', type=float, default=DEFAULTS["match_density"], help='Probability that a paragraph holds $$...$$')
+    parser.add_argument('--seed', type=int, default=DEFAULTS["seed"], help='Random seed')
+
+def corpus_params(args):
+    return {key: getattr(args, key) for key in DEFAULTS}
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic .docx corpus.")
+    parser.add_argument('out_dir', help='Directory to write the documents to')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+    info = generate_corpus(args.out_dir, **corpus_params(args))
+    print(f"Wrote {info['params']['files']} documents ({info['total_bytes'] / 1e6:.1f} MB, "
+          f"{info['error_files']} with matches) to {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
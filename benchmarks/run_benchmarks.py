@@ -0,0 +1,219 @@
+"""
+Scanner throughput benchmarks on a synthetic corpus.
+
+Runs each stage in a fresh process and reports files/sec, MB/sec,
+p50/p99 per-file latency and peak RSS as JSON, so results can be compared
+between commits.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --files 500 --output bench.json
+    python -m benchmarks.run_benchmarks --files 500 --compare bench.json
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from queue import Empty
+
+from benchmarks.corpus import add_corpus_arguments, corpus_params, generate_corpus
+
+STAGES = ("scan_file", "cli", "cli_warm", "server")
+# server.py imports the package as docx_formula_mover, as when it is run from src/
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def corpus_files(corpus_dir):
+    return sorted(os.path.join(corpus_dir, f) for f in os.listdir(corpus_dir) if f.endswith('.docx'))
+
+def cli_args(corpus_dir, out_dir, workers, cache):
+    return argparse.Namespace(
+        command='scan', input_path=corpus_dir, out=out_dir, recursive=True, dry_run=True,
+        verbose=False, placement='copy', engine='dom', prefilter=True, workers=workers,
+        classify_only=False, max_matches=None, cache=cache, cache_path=None, cache_size_mb=512,
+        incremental=False, resume=False, profile=None, include=None, exclude=[], min_size=None,
+        max_size=None, skip_hidden=True, prefetch=0, shard=None)
+
+def stage_scan_file(corpus_dir, work_dir, workers):
+    from src.docx_formula_mover.scanner import DocxScanner
+    scanner = DocxScanner()
+    latencies = []
+    for path in corpus_files(corpus_dir):
+        start = time.perf_counter()
+        scanner.scan_file(path)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def stage_cli(corpus_dir, work_dir, workers, warm=False):
+    from src.docx_formula_mover import cli
+    out_dir = os.path.join(work_dir, "cli_out")
+    if warm:
+        # Fill the scan cache first; only the second run is timed
+        cli.run_scan(cli_args(corpus_dir, out_dir, workers, cache=True))
+    return cli.run_scan, (cli_args(corpus_dir, out_dir, workers, cache=warm),)
+
+def stage_server(corpus_dir, work_dir, workers):
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    import server
+    from docx_formula_mover.jobs import JobManager
+    server.OUTPUT_ROOT = os.path.join(work_dir, "server_out")
+    # A job as left by the upload endpoints; it is run directly, not queued
+    jobs = JobManager(os.path.join(server.OUTPUT_ROOT, "jobs"), server.run_scan_job)
+    job = jobs.create()
+    upload_dir = os.path.join(jobs.job_dir(job["id"]), "uploads")
+    os.makedirs(upload_dir)
+    for path in corpus_files(corpus_dir):
+        shutil.copy(path, upload_dir)
+    return server.run_scan_job, (job, jobs)
+
+def _run_stage(stage, corpus_dir, workers, queue):
+    # The scan paths print progress; keep benchmark output readable
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        try:
+            if stage == "scan_file":
+                start = time.perf_counter()
+                latencies = stage_scan_file(corpus_dir, work_dir, workers)
+                elapsed = time.perf_counter() - start
+            else:
+                if stage == "server":
+                    func, args = stage_server(corpus_dir, work_dir, workers)
+                else:
+                    func, args = stage_cli(corpus_dir, work_dir, workers, warm=(stage == "cli_warm"))
+                latencies = []
+                start = time.perf_counter()
+                func(*args)
+                elapsed = time.perf_counter() - start
+        except ImportError as e:
+            queue.put({"skipped": f"missing dependency: {e}"})
+            return
+        except Exception as e:
+            queue.put({"error": f"{type(e).__name__}: {e}"})
+            return
+    queue.put({"elapsed_s": elapsed, "latencies": latencies, "peak_rss_bytes": peak_rss_bytes()})
+
+def run_stage(stage, corpus_dir, workers, total_bytes, files):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_stage, args=(stage, corpus_dir, workers, queue))
+    proc.start()
+    # The child always reports; if it dies without doing so, do not wait forever
+    raw = None
+    while raw is None:
+        try:
+            raw = queue.get(timeout=1.0)
+        except Empty:
+            if not proc.is_alive():
+                # A result put just before exiting may still be in the pipe
+                try:
+                    raw = queue.get(timeout=1.0)
+                except Empty:
+                    raw = {"error": f"stage process exited with code {proc.exitcode}"}
+    proc.join()
+    if "skipped" in raw or "error" in raw:
+        return raw
+    elapsed = raw["elapsed_s"]
+    latencies = raw["latencies"]
+    return {
+        "elapsed_s": round(elapsed, 4),
+        "files_per_s": round(files / elapsed, 2) if elapsed else None,
+        "mb_per_s": round(total_bytes / 1e6 / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        "peak_rss_mb": round(raw["peak_rss_bytes"] / 1e6, 1) if raw["peak_rss_bytes"] else None,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    for stage, metrics in results["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if not old or any(k in m for k in ("skipped", "error") for m in (metrics, old)):
+            continue
+        changes = []
+        for key in ("files_per_s", "p99_ms", "peak_rss_mb"):
+            if metrics.get(key) and old.get(key):
+                changes.append(f"{key} {100.0 * (metrics[key] - old[key]) / old[key]:+.1f}%")
+        print(f"  {stage:>10}: " + ", ".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scanner on a synthetic corpus.")
+    add_corpus_arguments(parser)
+    parser.add_argument('--workers', type=int, default=1, help='Workers for the cli stages')
+    parser.add_argument('--stages', default=",".join(STAGES), help=f'Comma-separated subset of {", ".join(STAGES)}')
+    parser.add_argument('--corpus-dir', default=None, help='Write the corpus here and keep it (default: temporary)')
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file')
+    parser.add_argument('--compare', default=None, help='Baseline JSON from an earlier run')
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(",") if s]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"unknown stage: {stage}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = args.corpus_dir or os.path.join(tmp, "corpus")
+        info = generate_corpus(corpus_dir, **corpus_params(args))
+        files = info["params"]["files"]
+        print(f"Corpus: {files} files, {info['total_bytes'] / 1e6:.1f} MB, {info['error_files']} with matches")
+
+        results = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workers": args.workers,
+            "corpus": info,
+            "stages": {},
+        }
+        for stage in stages:
+            metrics = run_stage(stage, corpus_dir, args.workers, info["total_bytes"], files)
+            results["stages"][stage] = metrics
+            if "skipped" in metrics:
+                print(f"{stage:>10}: skipped ({metrics['skipped']})")
+            elif "error" in metrics:
+                print(f"{stage:>10}: failed ({metrics['error']})")
+            else:
+                latency = (f", p50 {metrics['p50_ms']} ms, p99 {metrics['p99_ms']} ms"
+                           if metrics['p50_ms'] is not None else "")
+                print(f"{stage:>10}: {metrics['files_per_s']} files/s, {metrics['mb_per_s']} MB/s"
+                      f"{latency}, peak RSS {metrics['peak_rss_mb']} MB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
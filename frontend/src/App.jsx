@@ -2,13 +2,45 @@ import { useState, useRef } from 'react'
 import './App.css'
 import './styles/adobe-theme.css'
 
+// Report rows fetched per page
+const PAGE_SIZE = 100
+
+// SHA-256 of a file, the key of the server's upload store. null where
+// crypto.subtle is unavailable (insecure origins): the file is just sent.
+const sha256Hex = async (file) => {
+  if (!window.crypto?.subtle) return null
+  const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('')
+}
+
+// Files of a chunk the server does not hold yet; the others are added to the
+// job by content hash without being uploaded again
+const filesToSend = async (job, chunk) => {
+  const hashes = await Promise.all(chunk.map(sha256Hex))
+  if (hashes.includes(null)) return chunk
+  const res = await fetch('http://localhost:5000/api/upload_check', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ job, files: chunk.map((file, i) => ({ name: file.name, sha256: hashes[i] })) }),
+  })
+  if (!res.ok) return chunk
+  const missing = new Set((await res.json()).missing)
+  return chunk.filter(file => missing.has(file.name))
+}
+
 function App() {
   const [reportData, setReportData] = useState([])
+  // One page of the report, plus its filters and the job's summary counts.
+  // cursors[i] is the server's cursor for page i + 2, from the page before it
+  const [reportQuery, setReportQuery] = useState({ page: 1, label: '', q: '', cursors: [] })
+  const [reportTotal, setReportTotal] = useState(0)
+  const [summary, setSummary] = useState({ total: 0, labels: {} })
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState(null)
   const [hasScanned, setHasScanned] = useState(false)
   const [isDragging, setIsDragging] = useState(false)
   const [downloading, setDownloading] = useState(false)
+  const [jobId, setJobId] = useState(null)
 
   const folderInputRef = useRef(null)
   const fileInputRef = useRef(null)
@@ -22,7 +54,7 @@ function App() {
       const response = await fetch('http://localhost:5000/api/clear', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ type }),
+        body: JSON.stringify({ type, job: jobId }),
       })
       const data = await response.json()
       if (response.ok) {
@@ -46,11 +78,22 @@ function App() {
     setError(null)
     setHasScanned(false)
     setReportData([])
-    setProgress({ current: 0, total: files.length, status: 'uploading' })
+    setProgress({ current: 0, total: files.length, uploaded: 0, status: 'uploading' })
 
     try {
-      // 1. Start Session
-      await fetch('http://localhost:5000/api/session/start', { method: 'POST' })
+      // 1. Start Session (each session is a scan job on the server).
+      // Pipelined: the server scans every chunk as soon as it lands.
+      const sessionRes = await fetch('http://localhost:5000/api/session/start', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ pipeline: true, total: files.length }),
+      })
+      if (!sessionRes.ok) throw new Error("Failed to start session")
+      const { job_id: job } = await sessionRes.json()
+      setJobId(job)
+
+      // Progress covers both phases from the start
+      followProgress(job)
 
       // 2. Chunk Upload
       const CHUNK_SIZE = 50
@@ -59,34 +102,36 @@ function App() {
 
       for (let i = 0; i < totalFiles; i += CHUNK_SIZE) {
         const chunk = Array.from(files).slice(i, i + CHUNK_SIZE)
-        const formData = new FormData()
-        chunk.forEach(file => formData.append('files', file))
+        const toSend = await filesToSend(job, chunk)
+
+        if (toSend.length > 0) {
+          const formData = new FormData()
+          formData.append('job', job)
+          toSend.forEach(file => formData.append('files', file))
 
-        const res = await fetch('http://localhost:5000/api/upload_chunk', {
-          method: 'POST',
-          body: formData,
-        })
+          const res = await fetch('http://localhost:5000/api/upload_chunk', {
+            method: 'POST',
+            body: formData,
+          })
 
-        if (!res.ok) {
-          const text = await res.text()
-          throw new Error(`Upload failed at chunk ${i}: ${text}`)
+          if (!res.ok) {
+            const text = await res.text()
+            throw new Error(`Upload failed at chunk ${i}: ${text}`)
+          }
         }
 
         uploadedCount += chunk.length
-        setProgress({
-          current: uploadedCount,
-          total: totalFiles,
-          status: 'uploading'
-        })
+        setProgress(prev => ({ ...prev, uploaded: Math.max(prev.uploaded || 0, uploadedCount) }))
       }
 
-      // 3. Start Scan trigger
-      const startRes = await fetch('http://localhost:5000/api/scan_start', { method: 'POST' })
+      // 3. Upload complete: the scan finishes after the last file
+      const startRes = await fetch('http://localhost:5000/api/scan_start', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ job }),
+      })
       if (!startRes.ok) throw new Error("Failed to start scan")
 
-      // 4. Start polling
-      startPolling()
-
     } catch (err) {
       console.error(err)
       setError(err.message)
@@ -170,23 +215,76 @@ function App() {
     }
   }
 
-  const startPolling = () => {
+  const finishScan = async (job) => {
+    await fetchReport(job)
+    setHasScanned(true)
+    setLoading(false)
+  }
+
+  const followProgress = (job) => {
+    if (!window.EventSource) {
+      startPolling(job)
+      return
+    }
+    const events = new EventSource(`http://localhost:5000/api/events/${job}`)
+    let finished = false
+
+    events.addEventListener('status', async (e) => {
+      const data = JSON.parse(e.data)
+      setProgress(prev => ({
+        ...prev,
+        current: data.progress,
+        total: data.total || prev.total,
+        uploaded: Math.max(prev.uploaded || 0, data.uploaded || 0),
+        status: data.status
+      }))
+      if (data.status === 'completed') {
+        finished = true
+        events.close()
+        await finishScan(job)
+      } else if (data.status === 'error') {
+        finished = true
+        events.close()
+        setError(data.message)
+        setLoading(false)
+      }
+    })
+
+    // One event per classified file, as it happens
+    events.addEventListener('file', (e) => {
+      const entry = JSON.parse(e.data)
+      setProgress(prev => ({
+        ...prev,
+        issues: (prev.issues || 0) + (entry.label === 'formula_error' ? 1 : 0)
+      }))
+    })
+
+    events.onerror = () => {
+      // The server ends long streams; the browser reconnects by itself
+      if (finished || events.readyState === EventSource.CONNECTING) return
+      // Stream refused (too many streams, proxy): poll instead
+      events.close()
+      startPolling(job)
+    }
+  }
+
+  const startPolling = (job) => {
     const interval = setInterval(async () => {
       try {
-        const res = await fetch('http://localhost:5000/api/status')
+        const res = await fetch(`http://localhost:5000/api/status/${job}`)
         const data = await res.json()
 
-        setProgress({
+        setProgress(prev => ({
+          ...prev,
           current: data.progress,
-          total: data.total,
+          total: data.total || prev.total,
+          uploaded: Math.max(prev.uploaded || 0, data.uploaded || 0),
           status: data.status
-        })
+        }))
 
         if (data.status === 'completed') {
           clearInterval(interval)
-          await fetchReport()
-          setHasScanned(true)
-          setLoading(false)
+          await finishScan(job)
         } else if (data.status === 'error') {
           clearInterval(interval)
           setError(data.message)
@@ -198,15 +296,26 @@ function App() {
     }, 1000)
   }
 
-  const fetchReport = async () => {
+  const fetchReport = async (job, query = { page: 1, label: '', q: '', cursors: [] }) => {
     try {
-      const response = await fetch('http://localhost:5000/api/report')
+      const params = new URLSearchParams({ page: query.page, per_page: PAGE_SIZE })
+      // Pages reached with Next resume after the previous page instead of skipping entries
+      const after = query.cursors[query.page - 2]
+      if (after) params.set('after', after)
+      if (query.label) params.set('label', query.label)
+      if (query.q) params.set('q', query.q)
+      const response = await fetch(`http://localhost:5000/api/report/${job}?${params}`)
       if (!response.ok) {
         const errText = await response.text()
         throw new Error(`Server Error (${response.status}): ${errText}`)
       }
       const data = await response.json()
-      setReportData(data)
+      const cursors = query.cursors.slice(0, query.page - 1)
+      cursors[query.page - 1] = data.next
+      setReportQuery({ ...query, cursors })
+      setReportData(data.entries)
+      setReportTotal(data.total)
+      setSummary(data.summary)
     } catch (err) {
       console.error(err)
       setError(err.message)
@@ -216,7 +325,10 @@ function App() {
   const handleDownload = (type) => {
     setDownloading(true)
     // Use window.open for large file downloads - more reliable than fetch
-    const downloadWindow = window.open(`http://localhost:5000/api/download/${type}`, '_blank')
+    // The archive is streamed as it is built; the name filter of the table applies
+    const params = new URLSearchParams({ job: jobId })
+    if (reportQuery.q) params.set('q', reportQuery.q)
+    const downloadWindow = window.open(`http://localhost:5000/api/download/${type}?${params}`, '_blank')
 
     // Hide toast after a delay (download starts immediately)
     setTimeout(() => {
@@ -224,11 +336,12 @@ function App() {
     }, 3000)
   }
 
-  // Calculate stats
-  const totalFiles = reportData.length
-  const errorFiles = reportData.filter(item => item.label === 'formula_error').length
-  const cleanFiles = reportData.filter(item => item.label === 'no_error').length
-  const skippedFiles = reportData.filter(item => item.label === 'skipped').length
+  // Stats come from the server's summary, not from the loaded page
+  const totalFiles = summary.total
+  const errorFiles = summary.labels.formula_error || 0
+  const cleanFiles = summary.labels.no_error || 0
+  const skippedFiles = summary.labels.skipped || 0
+  const pageCount = Math.max(1, Math.ceil(reportTotal / PAGE_SIZE))
 
   return (
     <div className="adobe-page-bg">
@@ -242,7 +355,7 @@ function App() {
       {downloading && (
         <div className="download-toast">
           <div className="toast-spinner"></div>
-          <span>Please wait, preparing your zip file...</span>
+          <span>Your zip file download is starting...</span>
         </div>
       )}
 
@@ -281,9 +394,14 @@ function App() {
             {loading && (
               <div className="adobe-loading">
                 <div className="adobe-spinner"></div>
-                <p>{progress.status === 'uploading' ? 'Uploading...' : `Scanning ${progress.current}/${progress.total}`}</p>
+                <p>
+                  {progress.uploaded < progress.total && `Uploaded ${progress.uploaded}/${progress.total} · `}
+                  {progress.status === 'queued' ? 'Waiting for a free scanner...' : `Scanned ${progress.current}/${progress.total}`}
+                  {progress.issues ? ` (${progress.issues} with issues)` : ''}
+                </p>
                 <div className="adobe-progress">
-                  <div className="fill" style={{ width: `${(progress.current / progress.total) * 100}%` }}></div>
+                  {/* Upload and scan overlap; the bar covers both */}
+                  <div className="fill" style={{ width: `${((progress.uploaded + progress.current) / (2 * progress.total)) * 100}%` }}></div>
                 </div>
               </div>
             )}
@@ -336,6 +454,41 @@ function App() {
               </div>
             </div>
 
+            <div className="report-filters">
+              <select
+                value={reportQuery.label}
+                onChange={(e) => fetchReport(jobId, { ...reportQuery, page: 1, cursors: [], label: e.target.value })}
+              >
+                <option value="">All files</option>
+                <option value="formula_error">Errors</option>
+                <option value="no_error">Clean</option>
+                <option value="skipped">Skipped</option>
+              </select>
+              <input
+                type="search"
+                placeholder="Filter by file name"
+                defaultValue={reportQuery.q}
+                onKeyDown={(e) => {
+                  if (e.key === 'Enter') fetchReport(jobId, { ...reportQuery, page: 1, cursors: [], q: e.target.value })
+                }}
+              />
+              <span className="page-info">{reportTotal} files, page {reportQuery.page} of {pageCount}</span>
+              <button
+                className="adobe-secondary-btn"
+                disabled={reportQuery.page <= 1}
+                onClick={() => fetchReport(jobId, { ...reportQuery, page: reportQuery.page - 1 })}
+              >
+                Previous
+              </button>
+              <button
+                className="adobe-secondary-btn"
+                disabled={reportQuery.page >= pageCount}
+                onClick={() => fetchReport(jobId, { ...reportQuery, page: reportQuery.page + 1 })}
+              >
+                Next
+              </button>
+            </div>
+
             <div className="adobe-table-card">
               <table>
                 <thead>
@@ -0,0 +1,60 @@
+import os
+import zipfile
+
+# Bytes read from each file per step; output is yielded as it is produced
+CHUNK_SIZE = 1024 * 1024
+# Already-compressed formats are stored as-is rather than deflated again
+STORED_EXTENSIONS = ('.docx', '.zip', '.png', '.jpg', '.jpeg')
+
+class _Sink:
+    """Write-only file object collecting zipfile output until it is drained."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip(members):
+    """
+    Yields a zip archive of members, an iterable of (arcname, file_path), as
+    it is built: nothing is written to disk and at most about CHUNK_SIZE of
+    output is held in memory. The sink is not seekable, so zipfile writes
+    sizes and CRCs in data descriptors after each member.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w') as zf:
+        for arcname, file_path in members:
+            info = zipfile.ZipInfo.from_file(file_path, arcname)
+            stored = file_path.lower().endswith(STORED_EXTENSIONS)
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            with open(file_path, 'rb') as src, zf.open(info, 'w') as dest:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    data = sink.drain()
+    if data:
+        yield data
+
+def folder_members(folder):
+    """(arcname, path) for every file under folder, in sorted order."""
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, folder).replace(os.sep, "/"), path
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+# Same digest as the scan cache (cache.file_digest), so a stored upload's
+# hash is also the key of its cached classification
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+CHUNK_SIZE = 1024 * 1024
+
+class BlobStore:
+    """
+    Content-addressed storage for uploads: each distinct file is kept once,
+    as root/<first two hex digits>/<sha256>, and linked under its logical
+    names. A file the store already holds never has to be sent again.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return bool(DIGEST_RE.match(digest)) and os.path.exists(self.path(digest))
+
+    def put_stream(self, stream):
+        """Stores the bytes read from stream (hashing as it goes); returns their digest."""
+        os.makedirs(self.root, exist_ok=True)
+        h = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+                    f.write(chunk)
+            digest = h.hexdigest()
+            self._adopt(tmp_path, digest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def temp_file(self):
+        """
+        A new named temporary file inside the store. Once written, put_file()
+        turns it into a blob by renaming it, without copying the bytes.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.root, suffix=".part", delete=False)
+
+    def put_file(self, f):
+        """Stores (and closes) a file from temp_file(); returns its digest."""
+        f.close()
+        try:
+            h = hashlib.sha256()
+            with open(f.name, 'rb') as written:
+                for chunk in iter(lambda: written.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            self._adopt(f.name, digest)
+        except BaseException:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+            raise
+        return digest
+
+    def _adopt(self, tmp_path, digest):
+        """Moves a finished temporary file to its blob path, or drops it if the content is already held."""
+        blob_path = self.path(digest)
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+
+    def link(self, digest, dest_path):
+        """Makes dest_path a hard link to the stored file (a copy across filesystems)."""
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(self.path(digest), dest_path)
+        except OSError:
+            shutil.copy2(self.path(digest), dest_path)
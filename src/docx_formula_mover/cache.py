@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from .scanner import Match, ScanResult
+
+DEFAULT_CACHE_NAME = ".scan_cache.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+# Writes are buffered and committed in batches of COMMIT_EVERY or every
+# COMMIT_INTERVAL seconds; eviction runs every EVICT_EVERY stores
+COMMIT_EVERY = 500
+COMMIT_INTERVAL = 1.0
+EVICT_EVERY = 1000
+# Seconds to wait for another process's transaction before giving up
+LOCK_TIMEOUT = 5
+
+def file_digest(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ScanCache:
+    """
+    Persistent scan result cache backed by SQLite.
+
+    Results are keyed by content hash plus the scanner rules signature, so a
+    detection change never serves stale results. A (path, size, mtime) table
+    maps known files to their hash, which makes a warm rescan stat-only; when
+    the stat data changed the file is re-hashed and an identical document
+    (touched, copied or re-uploaded) is still a hit.
+    Stored matches are evicted least-recently-used beyond max_bytes.
+
+    Several processes may share one cache file (e.g. concurrent server
+    jobs): lookups only read, and writes are buffered and flushed in one
+    short transaction every COMMIT_EVERY writes or COMMIT_INTERVAL seconds.
+    The cache is best-effort: when the database is locked a lookup is a
+    miss and a flush is dropped, the scan itself never fails.
+    """
+
+    def __init__(self, path, rules, max_bytes=DEFAULT_MAX_BYTES, readonly=False):
+        self.path = path
+        self.rules = rules
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._stores = 0
+        # Unflushed writes
+        self._paths = {}    # path -> (size, mtime_ns, digest)
+        self._results = {}  # digest -> (is_error, skipped, matches, nbytes, truncated)
+        self._touched = set()
+        self._last_flush = time.monotonic()
+        # Read-only views serve scan workers (see parallel._hash_and_scan);
+        # they never write, not even last_used
+        self.readonly = readonly
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True, timeout=LOCK_TIMEOUT)
+            return
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS paths ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " digest TEXT, rules TEXT, is_error INTEGER, skipped INTEGER, matches TEXT,"
+            " nbytes INTEGER, last_used REAL, truncated INTEGER DEFAULT 0, PRIMARY KEY (digest, rules))")
+        # Caches created before results carried the truncated flag
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(results)")]
+        if "truncated" not in columns:
+            self.conn.execute("ALTER TABLE results ADD COLUMN truncated INTEGER DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.conn.commit()
+
+    def lookup(self, file_path, st=None):
+        """
+        Stat-only lookup; the file is not read. Returns (result, key, st):
+        result is a cached ScanResult or None on a miss, key the content hash
+        to pass to store() after scanning. key is None when the file has no
+        stat record: the caller hashes it (see parallel._hash_and_scan) and
+        reports back with record(). key and st are both None if the file
+        could not be read (such results are not cached).
+        """
+        try:
+            if st is None:
+                st = os.stat(file_path)
+        except OSError:
+            self.misses += 1
+            return None, None, None
+        digest = self._known_digest(file_path, st)
+        if digest is None:
+            return None, None, st
+        result = self.get(digest, file_path)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result, digest, st
+
+    def _known_digest(self, file_path, st):
+        pending = self._paths.get(file_path)
+        if pending is not None:
+            size, mtime_ns, digest = pending
+            return digest if (size, mtime_ns) == (st.st_size, st.st_mtime_ns) else None
+        try:
+            row = self.conn.execute(
+                "SELECT digest FROM paths WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (file_path, st.st_size, st.st_mtime_ns)).fetchone()
+        except sqlite3.OperationalError as e:
+            print(f"Scan cache unavailable: {e}")
+            return None
+        return row[0] if row else None
+
+    def record(self, file_path, st, digest, hit):
+        """Records the content hash of a file lookup() had no stat record of, and whether it was a hit."""
+        self._paths[file_path] = (st.st_size, st.st_mtime_ns, digest)
+        if hit:
+            self.hits += 1
+            self._touched.add(digest)
+        else:
+            self.misses += 1
+        self._wrote()
+
+    def get(self, digest, file_path, touch=True):
+        """Returns the cached ScanResult for a content hash, reported under file_path."""
+        row = self._results.get(digest)
+        if row is None:
+            try:
+                row = self.conn.execute(
+                    "SELECT is_error, skipped, matches, nbytes, truncated FROM results"
+                    " WHERE digest = ? AND rules = ?", (digest, self.rules)).fetchone()
+            except sqlite3.OperationalError as e:
+                print(f"Scan cache unavailable: {e}")
+                return None
+            if not row:
+                return None
+            if touch and not self.readonly:
+                self._touched.add(digest)
+                self._wrote()
+        is_error, skipped, matches, _, truncated = row
+        # Stored as [text, paragraph_index, offset, source] lists; caches
+        # written before Match existed hold dicts
+        matches = [Match(**m) if isinstance(m, dict) else Match(*m) for m in json.loads(matches)]
+        return ScanResult(file_path, bool(is_error), matches, skipped=bool(skipped), truncated=bool(truncated))
+
+    def store(self, key, result):
+        # Failures that are not the document's fault (I/O errors, memory)
+        # may not happen next time
+        if key is None or result.error is not None:
+            return
+        matches = json.dumps(result.matches)
+        self._results[key] = (int(result.is_error), int(result.skipped), matches, len(matches) + len(key),
+                              int(result.truncated))
+        self._wrote()
+        self._stores += 1
+        if self._stores % EVICT_EVERY == 0:
+            self.evict()
+
+    def flush(self):
+        """Writes the buffered paths, results and last_used updates in one transaction."""
+        self._last_flush = time.monotonic()
+        if not (self._paths or self._results or self._touched):
+            return
+        now = time.time()
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO paths (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                    [(path,) + row for path, row in self._paths.items()])
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO results"
+                    " (digest, rules, is_error, skipped, matches, nbytes, truncated, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(digest, self.rules) + row + (now,) for digest, row in self._results.items()])
+                self.conn.executemany(
+                    "UPDATE results SET last_used = ? WHERE digest = ? AND rules = ?",
+                    [(now, digest, self.rules) for digest in self._touched])
+        except sqlite3.OperationalError as e:
+            # Another process held the lock too long; these files are simply scanned again next time
+            print(f"Scan cache: dropped {len(self._paths) + len(self._results)} pending writes ({e})")
+        self._paths.clear()
+        self._results.clear()
+        self._touched.clear()
+
+    def evict(self):
+        """Drops least-recently-used results until the cache fits in max_bytes."""
+        self.flush()
+        try:
+            total = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM results").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            # Trim a little below the limit so eviction does not run on every store
+            excess = total - int(self.max_bytes * 0.9)
+            freed = 0
+            victims = []
+            for digest, rules, nbytes in self.conn.execute(
+                    "SELECT digest, rules, nbytes FROM results ORDER BY last_used, rowid"):
+                victims.append((digest, rules))
+                freed += nbytes
+                if freed >= excess:
+                    break
+            with self.conn:
+                self.conn.executemany("DELETE FROM results WHERE digest = ? AND rules = ?", victims)
+                self.conn.execute("DELETE FROM paths WHERE digest NOT IN (SELECT digest FROM results)")
+        except sqlite3.OperationalError as e:
+            print(f"Scan cache: eviction skipped ({e})")
+
+    def summary(self):
+        return f"Cache: {self.hits} hits, {self.misses} misses"
+
+    def close(self):
+        if not self.readonly:
+            self.evict()
+        self.conn.close()
+
+    def _wrote(self):
+        pending = len(self._paths) + len(self._results) + len(self._touched)
+        if pending >= COMMIT_EVERY or time.monotonic() - self._last_flush >= COMMIT_INTERVAL:
+            self.flush()
@@ -1,25 +1,84 @@
 import argparse
+import heapq
 import os
 import sys
-from .scanner import DocxScanner
+from .scanner import DocxScanner, ENGINES, PROFILE_STAGES, PROFILE_COUNTERS
+from .cache import ScanCache, DEFAULT_CACHE_NAME, DEFAULT_MAX_BYTES
+from . import discovery
+from . import manifest
+from . import parallel
 from . import utils
+from .watch import POLL_INTERVAL, SETTLE_SECONDS
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+def shard_spec(value):
+    """Parses K/N (shard K of N, counted from 1)."""
+    try:
+        shard, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N, got {value!r}")
+    if not 1 <= shard <= count:
+        raise argparse.ArgumentTypeError(f"shard must be between 1 and {max(count, 1)}, got {value}")
+    return shard, count
 
 def main():
     parser = argparse.ArgumentParser(description="docx-formula-mover: Scan and move docx files based on $$ matching.")
     
     subparsers = parser.add_subparsers(dest='command', required=True)
     
-    scan_parser = subparsers.add_parser('scan', help='Scan a file or directory')
+    # Options shared by scan and watch
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--out', required=True, help='Output root directory')
+    common.add_argument('--recursive', action=argparse.BooleanOptionalAction, default=True, help='Recursively scan directories')
+    common.add_argument('--verbose', action='store_true', help='Verbose output')
+    common.add_argument('--placement', choices=utils.PLACEMENTS, default='copy', help='How classified files are placed: copy, move, hardlink or reflink (falls back to copy where unsupported)')
+    common.add_argument('--workers', type=int, default=parallel.default_workers(), help='Number of scan processes (default: CPU count)')
+    common.add_argument('--prefilter', action=argparse.BooleanOptionalAction, default=True, help='Skip XML parsing for parts whose bytes cannot contain $$')
+    common.add_argument('--classify-only', action='store_true', help='Stop at the first $$ match in each file (enough to sort it)')
+    common.add_argument('--max-matches', type=positive_int, default=None, help='Collect at most N matches per file')
+    common.add_argument('--engine', choices=ENGINES, default='dom', help='XML engine: dom (full parse) or stream (incremental, flat memory)')
+    common.add_argument('--include', action='append', default=None, metavar='GLOB', help='Only scan files whose name or relative path matches (repeatable, default *.docx)')
+    common.add_argument('--exclude', action='append', default=[], metavar='GLOB', help='Skip files and directories whose name or relative path matches (repeatable)')
+    common.add_argument('--min-size', type=int, default=None, metavar='BYTES', help='Skip files smaller than this')
+    common.add_argument('--max-size', type=int, default=None, metavar='BYTES', help='Skip files larger than this')
+    common.add_argument('--skip-hidden', action=argparse.BooleanOptionalAction, default=True, help='Skip hidden files and directories and Word lock files (~$name.docx)')
+
+    scan_parser = subparsers.add_parser('scan', parents=[common], help='Scan a file or directory')
     scan_parser.add_argument('input_path', help='Input file or directory path')
-    scan_parser.add_argument('--out', required=True, help='Output root directory')
-    scan_parser.add_argument('--recursive', action=argparse.BooleanOptionalAction, default=True, help='Recursively scan directories')
     scan_parser.add_argument('--dry-run', action='store_true', help='Do not move files, just report')
-    scan_parser.add_argument('--verbose', action='store_true', help='Verbose output')
+    progress_group = scan_parser.add_mutually_exclusive_group()
+    progress_group.add_argument('--incremental', action='store_true', help='Only scan files added or modified since the last run and merge them into the report')
+    progress_group.add_argument('--resume', action='store_true', help='Continue an interrupted scan from the partial report in the output root')
+    scan_parser.add_argument('--cache', action=argparse.BooleanOptionalAction, default=True, help='Reuse results for unchanged documents')
+    scan_parser.add_argument('--cache-path', default=None, help=f'Scan cache file (default: <out>/{DEFAULT_CACHE_NAME})')
+    scan_parser.add_argument('--cache-size-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='Evict cached results beyond this size')
+    scan_parser.add_argument('--prefetch', type=int, default=0, metavar='THREADS', help='Read files ahead of the scanner on this many threads (helps on network shares)')
+    scan_parser.add_argument('--profile', type=int, nargs='?', const=10, default=None, metavar='N', help='Time each scan stage, add the breakdown to report.json/report.csv and list the N slowest files (default 10)')
+    scan_parser.add_argument('--shard', type=shard_spec, default=None, metavar='K/N', help='Only scan shard K of N (a stable hash of each relative path); run every shard into its own --out and combine them with merge-reports')
+
+    watch_parser = subparsers.add_parser('watch', parents=[common], help='Keep classifying new and modified files in a directory until interrupted')
+    watch_parser.add_argument('input_path', help='Directory to watch')
+    watch_parser.add_argument('--settle', type=float, default=SETTLE_SECONDS, metavar='SECONDS', help='Scan a file once its size and mtime have been unchanged this long')
+    watch_parser.add_argument('--poll', action='store_true', help='Poll for changes even where inotify is available')
+    watch_parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, metavar='SECONDS', help='Time between directory walks when polling')
+
+    merge_parser = subparsers.add_parser('merge-reports', help='Combine the reports of shard runs')
+    merge_parser.add_argument('shard_outputs', nargs='+', help='Output roots of the shard runs')
+    merge_parser.add_argument('--out', required=True, help='Output root for the combined report')
     
     args = parser.parse_args()
     
     if args.command == 'scan':
         run_scan(args)
+    elif args.command == 'watch':
+        run_watch(args)
+    elif args.command == 'merge-reports':
+        run_merge_reports(args)
 
 def run_scan(args):
     input_path = os.path.abspath(args.input_path)
@@ -33,71 +92,303 @@ def run_scan(args):
         print(f"Output to: {output_root}")
         print(f"Recursive: {recursive}")
         print(f"Dry run: {dry_run}")
+        print(f"Placement: {args.placement}")
+        print(f"Engine: {args.engine}")
+        print(f"Prefilter: {args.prefilter}")
+        print(f"Classify only: {args.classify_only}")
+        print(f"Max matches: {args.max_matches}")
+        print(f"Workers: {args.workers}")
+        print(f"Incremental: {args.incremental}")
+        print(f"Resume: {args.resume}")
+        print(f"Profile: {args.profile}")
+        print(f"Include: {args.include or list(discovery.DEFAULT_INCLUDE)}")
+        print(f"Exclude: {args.exclude}")
+        print(f"Prefetch: {args.prefetch}")
+        print(f"Shard: {args.shard}")
 
-    scanner = DocxScanner()
-    files_to_process = []
+    profiling = args.profile is not None
+    scanner_options = {"engine": args.engine, "prefilter": args.prefilter,
+                       "classify_only": args.classify_only, "max_matches": args.max_matches,
+                       "profile": profiling}
+    rules = DocxScanner(**scanner_options).rules_signature()
 
     if os.path.isfile(input_path):
-        files_to_process.append(input_path)
+        candidates = [(input_path, None)]
     elif os.path.isdir(input_path):
-        if recursive:
-            for root, dirs, files in os.walk(input_path):
-                for f in files:
-                    if f.lower().endswith('.docx'):
-                        files_to_process.append(os.path.join(root, f))
-        else:
-             for f in os.listdir(input_path):
-                 if f.lower().endswith('.docx'):
-                     files_to_process.append(os.path.join(input_path, f))
+        # Files are scanned as the walk finds them (sorted, so the report
+        # order does not depend on the filesystem)
+        candidates = discovery.discover(input_path, recursive, include=args.include or discovery.DEFAULT_INCLUDE,
+                                        exclude=args.exclude, min_size=args.min_size, max_size=args.max_size,
+                                        skip_hidden=args.skip_hidden)
     else:
         print(f"Error: Path not found: {input_path}")
         sys.exit(1)
+    if args.shard:
+        shard_root = input_path if os.path.isdir(input_path) else os.path.dirname(input_path)
+        candidates = discovery.in_shard(candidates, shard_root, *args.shard)
+    # Stat data from the walk, used by the manifest and the cache
+    stats = {}
+    files_to_process = discovery.keep_stats(candidates, stats)
+    if args.incremental or args.resume:
+        # Both compare the whole input set with the previous run first
+        files_to_process = list(files_to_process)
+
+    incremental = False
+    if args.incremental:
+        # Compare against the manifest of the previous run; unchanged files
+        # keep their report entries and are not scanned again.
+        previous = manifest.load_manifest(output_root)
+        current_files = {}
+        for file_path in files_to_process:
+            try:
+                current_files[file_path] = manifest.stat_key(file_path, stats.get(file_path))
+            except OSError as e:
+                print(f"Error reading {file_path}: {e}")
+        # A shard's manifest only covers its slice of the input
+        manifest_rules = rules if not args.shard else f"{rules}-shard{args.shard[0]}of{args.shard[1]}"
+        next_manifest = manifest.new_manifest(input_path, recursive, manifest_rules)
+
+        if manifest.is_compatible(previous, input_path, recursive, manifest_rules):
+            incremental = True
+            changed, deleted = manifest.diff_manifest(previous, current_files)
+            changed = set(changed)
+            files_to_process = [f for f in files_to_process if f in changed]
+            next_manifest["files"] = {p: k for p, k in current_files.items() if p not in changed}
+            # Inputs an earlier run moved away are missing from the walk but
+            # not deleted: keep their entries and their manifest records
+            moved = utils.moved_inputs(output_root, deleted)
+            deleted = [p for p in deleted if p not in moved]
+            for p in moved:
+                next_manifest["files"][p] = previous["files"][p]
+            print(f"Incremental: {len(files_to_process)} new or modified, {len(deleted)} deleted, "
+                  f"{len(next_manifest['files'])} unchanged")
+        else:
+            print("Incremental: no previous run for this input, scanning everything")
+
+    cache = None
+    if args.cache:
+        cache_path = args.cache_path or os.path.join(output_root, DEFAULT_CACHE_NAME)
+        cache = ScanCache(cache_path, rules, max_bytes=args.cache_size_mb * 1024 * 1024)
+
+    # Entries are written as they are produced, not collected in memory
+    if incremental:
+        # A dry run leaves the copies of deleted inputs, like everything else, in place
+        writer = utils.open_report_merge(output_root, changed | set(deleted), profile=profiling,
+                                         deleted_paths=set() if dry_run else set(deleted))
+    elif args.resume:
+        writer, done_paths = utils.open_report_resume(output_root, set(files_to_process), dry_run=dry_run,
+                                                      profile=profiling)
+        files_to_process = [f for f in files_to_process if f not in done_paths]
+        print(f"Resume: {len(done_paths)} already done, {len(files_to_process)} remaining")
+    else:
+        writer = utils.ReportWriter(output_root, profile=profiling)
+    if args.shard:
+        # merge-reports orders entries by their path under the shard root
+        utils.save_shard_info(output_root, shard_root, args.shard)
 
-    results_info = []
-    
     ensure_dirs = set()
+    parts_scanned = 0
+    parts_prefiltered = 0
+    profile_totals = dict.fromkeys(("total_s",) + PROFILE_STAGES + PROFILE_COUNTERS, 0)
+    profiled_files = 0
+    slowest = []  # min-heap of (total_s, file_path, profile)
     
-    for file_path in files_to_process:
+    # Scanning runs on the worker pool; classification and copies stay in
+    # this process, in input order.
+    workers = args.workers
+    if isinstance(files_to_process, list):
+        # No pool is started for a single file (nor more processes than files)
+        workers = min(workers, len(files_to_process))
+    if args.prefetch > 0:
+        files_to_process = discovery.prefetch(files_to_process, args.prefetch)
+    for result in parallel.scan_files(files_to_process, workers, scanner_options, cache=cache, stats=stats):
+        file_path = result.file_path
         if verbose:
             print(f"Processing: {file_path}")
             
-        result = scanner.scan_file(file_path)
+        parts_scanned += result.parts_scanned
+        parts_prefiltered += result.parts_prefiltered
+        # Cache hits and skipped files carry no profile
+        if result.profile is not None:
+            profiled_files += 1
+            for key in profile_totals:
+                profile_totals[key] += result.profile[key]
+            if args.profile > 0:
+                entry = (result.profile["total_s"], file_path, result.profile)
+                if len(slowest) < args.profile:
+                    heapq.heappush(slowest, entry)
+                else:
+                    heapq.heappushpop(slowest, entry)
         
-        # Classification
-        if result.skipped:
-            label = "skipped"
-            dest_folder = None
-        elif result.is_error:
-            label = "formula_error"
-            dest_folder = os.path.join(output_root, "formula_error")
-        else:
-            label = "no_error"
-            dest_folder = os.path.join(output_root, "no_error")
+        label, dest_folder = classify(result, output_root)
             
         # Move logic
         output_path = ""
+        placement = ""
         if dest_folder:
             # If dry run, show where it would go
-            output_path = utils.move_file(file_path, dest_folder, dry_run=dry_run)
+            output_path, placement = utils.place_file(file_path, dest_folder, args.placement, dry_run=dry_run)
             
             if verbose:
                 print(f"  -> Detected: {label}")
                 if dry_run:
                     print(f"  -> Would move to: {output_path}")
                 else:
-                    print(f"  -> Moved to: {output_path}")
+                    print(f"  -> Moved to: {output_path} ({placement})")
             
-        results_info.append({
+        writer.write({
             "input_path": file_path,
             "output_path": output_path,
             "label": label,
-            "matches": [m for m in result.matches], # Ensure serializable
-            "skipped": result.skipped
+            "matches": result.matches,
+            "skipped": result.skipped,
+            "placement": placement,
+            "truncated": result.truncated,
+            "profile": result.profile
         })
+        if args.incremental and file_path in current_files:
+            # Skipped files are recorded without stat data so the next run
+            # retries them (and still notices if they are deleted)
+            next_manifest["files"][file_path] = None if result.skipped else current_files[file_path]
+
+    if cache:
+        cache.close()
+        print(cache.summary())
 
-    # Generate report
-    utils.generate_reports(results_info, output_root)
+    # Finalize report
+    writer.close()
+    # A dry run copies nothing, so it must not mark files as done
+    if args.incremental and not dry_run:
+        manifest.save_manifest(output_root, next_manifest)
+    if args.prefilter:
+        print(f"Prefilter: skipped XML parsing for {parts_prefiltered} of {parts_scanned} parts")
+    if profiling:
+        print_profile(profile_totals, profiled_files, sorted(slowest, reverse=True))
     print("Done.")
 
+def classify(result, output_root):
+    """(label, destination folder) of a scan result; skipped files have no folder."""
+    if result.skipped:
+        return "skipped", None
+    label = "formula_error" if result.is_error else "no_error"
+    return label, os.path.join(output_root, label)
+
+def run_watch(args):
+    import glob
+    import signal
+    import time
+    from . import watch
+
+    input_path = os.path.abspath(args.input_path)
+    output_root = os.path.abspath(args.out)
+    if not os.path.isdir(input_path):
+        print(f"Error: Not a directory: {input_path}")
+        sys.exit(1)
+    # Placed copies must not be picked up again when the output root is
+    # inside the watched directory
+    exclude = list(args.exclude)
+    for label in ("formula_error", "no_error"):
+        relpath = os.path.relpath(os.path.join(output_root, label), input_path)
+        if not relpath.startswith(os.pardir):
+            exclude.append(glob.escape(relpath.replace(os.sep, '/')))
+
+    scanner_options = {"engine": args.engine, "prefilter": args.prefilter,
+                       "classify_only": args.classify_only, "max_matches": args.max_matches}
+    # The manifest records the stat data of every reported file. Files from
+    # earlier runs are not scanned again on startup unless they changed
+    # while the watch was down.
+    manifest_rules = f"{DocxScanner(**scanner_options).rules_signature()}-watch"
+    previous = manifest.load_manifest(output_root)
+    state = manifest.new_manifest(input_path, args.recursive, manifest_rules)
+    if manifest.is_compatible(previous, input_path, args.recursive, manifest_rules):
+        state["files"] = previous["files"]
+    # Shared with the watch, which adds every file it submits
+    scanned = {path: key for path, key in state["files"].items() if key is not None}
+    writer = utils.ReportWriter(output_root, append=True)
+    placed = {}  # input_path -> output_path of files placed by this watch
+    saved = time.monotonic()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    results = watch.watch(input_path, args.recursive, args.workers, scanner_options, settle=args.settle,
+                          poll=args.poll, poll_interval=args.poll_interval, scanned=scanned,
+                          include=args.include, exclude=exclude, min_size=args.min_size,
+                          max_size=args.max_size, skip_hidden=args.skip_hidden)
+    try:
+        for result in results:
+            file_path = result.file_path
+            label, dest_folder = classify(result, output_root)
+            output_path = ""
+            placement = ""
+            if dest_folder:
+                try:
+                    output_path, placement = utils.place_file(file_path, dest_folder, args.placement)
+                except OSError as e:
+                    print(f"Error placing {file_path}: {e}")
+                    label = "skipped"
+            # A modified file that changed label leaves its old folder
+            previous = placed.pop(file_path, None)
+            if previous and previous != output_path and args.placement != 'move' and os.path.exists(previous):
+                os.remove(previous)
+            if output_path:
+                placed[file_path] = output_path
+            # Re-scanned files get another entry; the last one is current
+            writer.write({
+                "input_path": file_path,
+                "output_path": output_path,
+                "label": label,
+                "matches": result.matches,
+                "skipped": result.skipped,
+                "placement": placement,
+                "truncated": result.truncated
+            })
+            writer.flush()
+            # Skipped files are recorded without stat data so a restart retries them
+            state["files"][file_path] = None if result.skipped else scanned.get(file_path)
+            if time.monotonic() - saved >= utils.FLUSH_INTERVAL:
+                manifest.save_manifest(output_root, state)
+                saved = time.monotonic()
+            print(f"{label}: {file_path}" + (f" ({len(result.matches)} matches)" if args.verbose else ""))
+    except KeyboardInterrupt:
+        print("Stopping watch.")
+    finally:
+        results.close()
+        writer.close()
+        # Files reported since the last save are scanned again after a crash
+        manifest.save_manifest(output_root, state)
+
+def run_merge_reports(args):
+    shard_roots = [os.path.abspath(root) for root in args.shard_outputs]
+    for root in shard_roots:
+        if not os.path.exists(os.path.join(root, "report.jsonl")) and not os.path.exists(os.path.join(root, "report.json")):
+            print(f"Error: No report found in {root}")
+            sys.exit(1)
+    if utils.same_path(args.out, *shard_roots):
+        # The combined report would overwrite the shard report it is read from
+        print(f"Error: --out must not be one of the shard outputs: {os.path.abspath(args.out)}")
+        sys.exit(1)
+    summary = utils.merge_shard_reports(shard_roots, os.path.abspath(args.out))
+    for root, count in summary["shards"].items():
+        print(f"  {count:8d}  {root}")
+    labels = ", ".join(f"{label}: {count}" for label, count in sorted(summary["labels"].items()))
+    print(f"Merged {summary['total']} entries from {len(shard_roots)} shards ({labels})")
+
+def print_profile(totals, files, slowest):
+    """Prints the stage breakdown summed over all scanned files, then the slowest files."""
+    print(f"Profile: {files} files scanned in {totals['total_s']:.3f}s (worker time)")
+    if not files:
+        return
+    for stage in PROFILE_STAGES:
+        share = 100.0 * totals[stage] / totals["total_s"] if totals["total_s"] else 0.0
+        print(f"  {stage[:-2]:>10}: {totals[stage]:9.3f}s {share:5.1f}%")
+    print("  " + ", ".join(f"{key}={totals[key]}" for key in PROFILE_COUNTERS))
+    if slowest:
+        print(f"Slowest {len(slowest)} files:")
+        for total_s, file_path, profile in slowest:
+            stages = " ".join(f"{stage[:-2]}={profile[stage] * 1000:.1f}ms" for stage in PROFILE_STAGES)
+            print(f"  {total_s * 1000:8.1f}ms {file_path} ({stages})")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,79 @@
+import re
+import sys
+from collections import namedtuple
+
+# Parts scanned besides word/document.xml (matched from the start of the name)
+PART_RE = re.compile(r'word/(header|footer|footnotes|endnotes)\d*\.xml')
+DELIMITER = '$$'
+ESCAPE = '\\'
+
+class Match(namedtuple('Match', 'text paragraph_index offset source')):
+    """
+    One $$...$$ span. A plain tuple, so millions of them stay small; source
+    (the part name) is interned, also when a result is unpickled from a
+    worker, so all matches of a part share one string. Reports get the dict
+    form from to_dict(); m["text"] still works as with the former dicts.
+    """
+    __slots__ = ()
+
+    def __new__(cls, text, paragraph_index, offset, source):
+        return super().__new__(cls, text, paragraph_index, offset, sys.intern(source))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def to_dict(self):
+        return {"text": self.text, "paragraph_index": self.paragraph_index, "offset": self.offset,
+                "source": self.source}
+
+class FormulaDetector:
+    """
+    Finds unescaped $$...$$ display math in paragraph text.
+
+    A "$$" preceded by a backslash is escaped. Unescaped delimiters are
+    found left to right without overlapping ("$$$" holds one) and paired in
+    order: the first opens a span, the next one closes it, and a trailing
+    unpaired delimiter is ignored. Nothing else (e.g. "{{ $x }}" or "${var}"
+    templates, which use a single '$') is treated specially.
+
+    Holds only compiled, read-only state, so one instance can be shared by
+    every scan and thread.
+    """
+
+    part_re = PART_RE
+
+    def is_target_part(self, name):
+        """True for the zip members holding visible text: body, headers, footers and notes."""
+        return name == 'word/document.xml' or self.part_re.match(name) is not None
+
+    def delimiters(self, text):
+        """Yields the offset of every unescaped "$$" in text, in a single pass."""
+        find = text.find
+        pos = find(DELIMITER)
+        while pos != -1:
+            if pos and text[pos - 1] == ESCAPE:
+                # Escaped: the second '$' may still start a delimiter
+                pos = find(DELIMITER, pos + 1)
+            else:
+                yield pos
+                pos = find(DELIMITER, pos + 2)
+
+    def spans(self, text):
+        """Yields (start, end) of every $$...$$ span, end exclusive."""
+        start = None
+        for pos in self.delimiters(text):
+            if start is None:
+                start = pos
+            else:
+                yield start, pos + 2
+                start = None
+
+    def find_matches(self, text, paragraph_index, source_name):
+        if DELIMITER not in text:
+            return []
+        return [Match(text[start:end], paragraph_index, start, source_name) for start, end in self.spans(text)]
+
+# Shared by every DocxScanner
+DETECTOR = FormulaDetector()
@@ -0,0 +1,168 @@
+import fnmatch
+import hashlib
+import os
+import stat
+from collections import deque
+
+DEFAULT_INCLUDE = ('*.docx',)
+# Word writes "~$name.docx" owner files next to documents it has open
+LOCK_PREFIX = '~$'
+PREFETCH_CHUNK_SIZE = 1024 * 1024
+# Files read ahead of the scanner per prefetch thread
+PREFETCH_PER_THREAD = 4
+
+def discover(root, recursive=True, include=DEFAULT_INCLUDE, exclude=(), min_size=None, max_size=None,
+             skip_hidden=True):
+    """
+    Walks root with os.scandir and yields (path, stat_result) for every
+    matching file as soon as its directory has been read, so scanning starts
+    before the walk is done. Order matches a sorted os.walk: a directory's
+    files by name, then its subdirectories by name.
+
+    include and exclude are glob patterns matched case-insensitively against
+    the file name and the path relative to root (with '/' separators);
+    include=None takes every file. Excluded directories are not entered.
+    Sizes are in bytes. skip_hidden drops dot files and directories, files
+    with the Windows hidden attribute and Word lock files ("~$...").
+
+    The stat data comes from the directory entries (free on Windows, one
+    stat per candidate elsewhere) and is meant to be handed on, e.g. to
+    ScanCache.lookup(st=...).
+    """
+    include = None if include is None else [p.lower() for p in include]
+    exclude = [p.lower() for p in exclude or ()]
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"Error reading {directory}: {e}")
+            continue
+        subdirs = []
+        for entry in entries:
+            if skip_hidden and _is_hidden(entry):
+                continue
+            relpath = os.path.relpath(entry.path, root).replace(os.sep, '/')
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and not _matches(entry.name, relpath, exclude):
+                        subdirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+                if include is not None and not _matches(entry.name, relpath, include):
+                    continue
+                if _matches(entry.name, relpath, exclude):
+                    continue
+                st = entry.stat()
+            except OSError as e:
+                print(f"Error reading {entry.path}: {e}")
+                continue
+            if min_size is not None and st.st_size < min_size:
+                continue
+            if max_size is not None and st.st_size > max_size:
+                continue
+            yield entry.path, st
+        # Popped from the end: reversed so the first subdirectory comes next
+        pending.extend(reversed(subdirs))
+
+def path_matches(root, path, include=DEFAULT_INCLUDE, exclude=(), skip_hidden=True):
+    """
+    Applies discover()'s name filters to a single path under root, e.g. one
+    reported by a file system watcher: neither the path nor any directory
+    between it and root may be excluded or hidden, and the path itself must
+    be included (include=None takes any name, which also suits directories).
+    Sizes and the Windows hidden attribute are not checked.
+    """
+    relpath = os.path.relpath(path, root).replace(os.sep, '/')
+    if relpath == '.' or relpath.startswith('../'):
+        return False
+    exclude = [p.lower() for p in exclude or ()]
+    parts = relpath.split('/')
+    for i, name in enumerate(parts):
+        if skip_hidden and (name.startswith('.') or name.startswith(LOCK_PREFIX)):
+            return False
+        if _matches(name, '/'.join(parts[:i + 1]), exclude):
+            return False
+    return include is None or _matches(parts[-1], relpath, [p.lower() for p in include])
+
+def _matches(name, relpath, patterns):
+    name = name.lower()
+    relpath = relpath.lower()
+    return any(fnmatch.fnmatchcase(name, p) or fnmatch.fnmatchcase(relpath, p) for p in patterns)
+
+def _is_hidden(entry):
+    if entry.name.startswith('.') or entry.name.startswith(LOCK_PREFIX):
+        return True
+    if os.name != 'nt':
+        return False
+    # Part of the directory listing on Windows, so this costs no extra call
+    try:
+        return bool(entry.stat(follow_symlinks=False).st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN)
+    except OSError:
+        return False
+
+def keep_stats(candidates, stats):
+    """Yields the paths of (path, stat_result) candidates, recording their stat data in stats."""
+    for path, st in candidates:
+        if st is not None:
+            stats[path] = st
+        yield path
+
+def prefetch(paths, threads):
+    """
+    Yields paths in their original order, each once a thread pool has read
+    it through, up to threads * PREFETCH_PER_THREAD files ahead. On slow
+    (network) storage this overlaps the reads with scanning: the scanner and
+    the cache find the data in the OS cache.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for path in paths:
+            pending.append((path, pool.submit(_read_through, path)))
+            if len(pending) >= threads * PREFETCH_PER_THREAD:
+                path, future = pending.popleft()
+                future.result()
+                yield path
+        while pending:
+            path, future = pending.popleft()
+            future.result()
+            yield path
+
+def _read_through(path):
+    # Errors are left for the scanner to report
+    try:
+        with open(path, 'rb') as f:
+            while f.read(PREFETCH_CHUNK_SIZE):
+                pass
+    except OSError:
+        pass
+
+def shard_of(relpath, count):
+    """
+    Shard (1..count) of a path relative to the scanned root. Stable across
+    processes, machines and mount points: a hash of the '/'-separated
+    relative path, not Python's randomized hash().
+    """
+    digest = hashlib.blake2b(relpath.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count + 1
+
+def in_shard(candidates, root, shard, count):
+    """Keeps the (path, stat_result) candidates under root that belong to shard of count."""
+    for path, st in candidates:
+        relpath = os.path.relpath(path, root).replace(os.sep, '/')
+        if shard_of(relpath, count) == shard:
+            yield path, st
+
+def walk_order_key(path):
+    """
+    Sort key reproducing discover()'s order for paths under a common root:
+    a directory's files by name, then its subdirectories. Used to merge
+    shard reports back into the order of an unsharded run.
+    """
+    parts = path.replace('\\', '/').split('/')
+    return [(1, part) for part in parts[:-1]] + [(0, parts[-1])]
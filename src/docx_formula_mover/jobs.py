@@ -0,0 +1,289 @@
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+JOB_FILE = "job.json"
+# uploading: receiving files; queued: waiting for a worker; processing: scanning
+JOB_STATES = ('uploading', 'queued', 'processing', 'completed', 'error')
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_MAX_QUEUED = 64
+# Progress is published at most this often per job (seconds)
+PROGRESS_INTERVAL = 0.25
+# Events buffered per subscriber; a client that falls further behind misses
+# its oldest events, and catches up with the next status event
+SUBSCRIBER_BUFFER = 1000
+# A pipelined job fails once no file has arrived for this long (seconds), so
+# an abandoned upload does not hold a worker forever
+DEFAULT_FEED_TIMEOUT = 600
+
+class QueueFull(Exception):
+    """Raised by JobManager.submit when the job queue is at capacity."""
+
+class FeedTimeout(Exception):
+    """Raised by JobManager.iter_feed when a pipelined upload has gone idle."""
+
+class JobManager:
+    """
+    Scan jobs for the web server. Every upload session is a job with its own
+    directory under root (uploads, placed files and report) and a job.json
+    holding its state. Submitted jobs wait in a bounded queue served by a
+    pool of worker threads that call run_job(job, manager).
+
+    State is persisted whenever a job changes status, so jobs survive a
+    restart: start() reloads them and puts queued and interrupted jobs back
+    on the queue (job["attempts"] tells run_job it is a retry).
+
+    Clients can subscribe() to a job to receive ("status", job) events on
+    every state change and ("file", entry) events published by run_job.
+
+    A job created with pipeline=True is scanned while it is uploaded: it is
+    submitted straight away, the upload handler feed()s every stored file
+    and close_feed() marks the upload complete; run_job reads the files
+    with iter_feed(). A pipelined job holds a worker while it uploads, so
+    one that receives no file for feed_timeout seconds fails.
+    """
+
+    def __init__(self, root, run_job, workers=DEFAULT_JOB_WORKERS, max_queued=DEFAULT_MAX_QUEUED,
+                 feed_timeout=DEFAULT_FEED_TIMEOUT):
+        self.root = root
+        self.run_job = run_job
+        self.workers = workers
+        self.max_queued = max_queued
+        self.feed_timeout = feed_timeout
+        self.jobs = {}
+        self.lock = threading.Lock()
+        # Bounded in submit(); jobs resumed by start() are always taken back
+        self.queue = queue.Queue()
+        self.threads = []
+        self.subscribers = {}
+        self.feeds = {}
+        self._last_progress = {}
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        requeue = []
+        for job_id in sorted(os.listdir(self.root)):
+            if job_id in self.jobs:
+                continue
+            job = self._load(job_id)
+            if job is None:
+                continue
+            self.jobs[job_id] = job
+            if self.accepts_uploads(job) and job["options"].get("pipeline"):
+                # Uploads stored before the restart are on disk; new ones are fed
+                self.feeds[job_id] = queue.Queue()
+            if job["status"] in ('queued', 'processing'):
+                requeue.append(job)
+        # Oldest first, like the original submission order
+        for job in sorted(requeue, key=lambda j: j["created"]):
+            self._set(job, status='queued', message="Queued (resumed after restart)")
+            self.queue.put(job["id"])
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Lets the workers finish their current job, then stops them."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def create(self, **options):
+        job_id = uuid.uuid4().hex
+        job = {"id": job_id, "status": "uploading", "progress": 0, "total": 0, "message": "",
+               "created": time.time(), "attempts": 0, "options": options}
+        os.makedirs(self.job_dir(job_id))
+        with self.lock:
+            self.jobs[job_id] = job
+            if options.get("pipeline"):
+                self.feeds[job_id] = queue.Queue()
+            self._save(job)
+        return dict(job)
+
+    def accepts_uploads(self, job):
+        """Files can be added while uploading, and to a pipelined job until close_feed()."""
+        if job["options"].get("pipeline"):
+            return (not job.get("upload_done") and job["status"] in ('uploading', 'queued', 'processing')
+                    and job["id"] in self.feeds)
+        return job["status"] == 'uploading'
+
+    def feed(self, job_id, file_path):
+        """Hands a stored upload of a pipelined job to its scan (if it has not expired meanwhile)."""
+        feed = self.feeds.get(job_id)
+        if feed is not None:
+            feed.put(file_path)
+
+    def close_feed(self, job_id):
+        """Marks the upload of a pipelined job complete; its scan finishes after the last file."""
+        with self.lock:
+            job = self.jobs[job_id]
+            job["upload_done"] = True
+            self._save(job)
+            feed = self.feeds.get(job_id)
+        if feed is not None:
+            feed.put(None)
+
+    def iter_feed(self, job_id):
+        """
+        Yields the files fed to a pipelined job until its upload is complete.
+        Raises FeedTimeout if none arrives for feed_timeout seconds; the job
+        then takes no more uploads.
+        """
+        feed = self.feeds.get(job_id)
+        if feed is None:
+            return
+        try:
+            while True:
+                try:
+                    file_path = feed.get(timeout=self.feed_timeout)
+                except queue.Empty:
+                    raise FeedTimeout(f"Upload abandoned: no file received for {self.feed_timeout} seconds")
+                if file_path is None:
+                    break
+                yield file_path
+        finally:
+            self.feeds.pop(job_id, None)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def latest(self):
+        """The most recently created job, for the single-session legacy endpoints."""
+        with self.lock:
+            if not self.jobs:
+                return None
+            return dict(max(self.jobs.values(), key=lambda j: j["created"]))
+
+    def job_dir(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def submit(self, job_id, **options):
+        """
+        Queues an uploaded job for scanning. Raises KeyError for an unknown
+        job, ValueError if it is already queued or running and QueueFull when
+        the queue is at capacity.
+        """
+        with self.lock:
+            job = self.jobs[job_id]
+            if job["status"] in ('queued', 'processing'):
+                raise ValueError(f"Job {job_id} is already {job['status']}")
+            if self.queue.qsize() >= self.max_queued:
+                raise QueueFull(f"Job queue is full ({self.max_queued} jobs)")
+            self.queue.put(job_id)
+            job["options"].update(options)
+            self._set(job, status='queued', progress=0, total=0, message="Queued")
+
+    def update(self, job_id, **fields):
+        """Updates a job; the state file is only rewritten when the status changes."""
+        with self.lock:
+            self._set(self.jobs[job_id], **fields)
+
+    def count_uploads(self, job_id, count):
+        with self.lock:
+            job = self.jobs[job_id]
+            self._set(job, uploaded=job.get("uploaded", 0) + count)
+
+    def progress(self, job_id, progress, message=""):
+        """
+        Reports scan progress. run_job calls this for every file, so shared
+        state is only touched (and subscribers notified) every
+        PROGRESS_INTERVAL seconds.
+        """
+        now = time.monotonic()
+        if now - self._last_progress.get(job_id, 0.0) < PROGRESS_INTERVAL:
+            return
+        self._last_progress[job_id] = now
+        self.update(job_id, progress=progress, message=message)
+
+    def subscribe(self, job_id):
+        """
+        Returns a queue of (event, data) tuples for a job, starting with its
+        current status. Pass it to unsubscribe() when done.
+        """
+        events = queue.Queue(maxsize=SUBSCRIBER_BUFFER)
+        with self.lock:
+            events.put(("status", dict(self.jobs[job_id])))
+            self.subscribers.setdefault(job_id, []).append(events)
+        return events
+
+    def unsubscribe(self, job_id, events):
+        with self.lock:
+            subscribers = self.subscribers.get(job_id, [])
+            if events in subscribers:
+                subscribers.remove(events)
+            if not subscribers:
+                self.subscribers.pop(job_id, None)
+
+    def publish(self, job_id, event, data):
+        # Checked without the lock so an unwatched scan never contends for it
+        if not self.subscribers.get(job_id):
+            return
+        with self.lock:
+            self._publish(job_id, event, data)
+
+    def _publish(self, job_id, event, data):
+        for events in self.subscribers.get(job_id, ()):
+            try:
+                events.put_nowait((event, data))
+            except queue.Full:
+                if event != "status":
+                    continue
+                # Status events are always delivered (the last one ends the
+                # client's stream): make room by dropping the oldest event
+                try:
+                    events.get_nowait()
+                except queue.Empty:
+                    pass
+                events.put_nowait((event, data))
+
+    def _set(self, job, **fields):
+        status_changed = "status" in fields and fields["status"] != job["status"]
+        job.update(fields)
+        if status_changed:
+            self._save(job)
+        self._publish(job["id"], "status", dict(job))
+
+    def _work(self):
+        while True:
+            job_id = self.queue.get()
+            if job_id is None:
+                return
+            with self.lock:
+                job = self.jobs[job_id]
+                job["attempts"] += 1
+                self._set(job, status='processing', message="Scanning...")
+                snapshot = dict(job)
+            try:
+                self.run_job(snapshot, self)
+                self._last_progress.pop(job_id, None)
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                self.update(job_id, status='error', message=str(e))
+            else:
+                with self.lock:
+                    job = self.jobs[job_id]
+                    if job["status"] == 'processing':
+                        self._set(job, status='completed', progress=job["total"])
+
+    def _load(self, job_id):
+        path = os.path.join(self.job_dir(job_id), JOB_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, job):
+        path = os.path.join(self.job_dir(job["id"]), JOB_FILE)
+        tmp_path = path + ".part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,53 @@
+import json
+import os
+
+MANIFEST_NAME = ".scan_manifest.json"
+MANIFEST_VERSION = 1
+
+def stat_key(file_path, st=None):
+    """(size, mtime_ns) of a file, as recorded in the manifest; st saves the stat call."""
+    if st is None:
+        st = os.stat(file_path)
+    return [st.st_size, st.st_mtime_ns]
+
+def load_manifest(output_root):
+    """Returns the manifest of the previous run in output_root, or None."""
+    path = os.path.join(output_root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {path}: {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(output_root, manifest):
+    path = os.path.join(output_root, MANIFEST_NAME)
+    tmp_path = path + ".part"
+    manifest = dict(manifest, version=MANIFEST_VERSION)
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def new_manifest(input_path, recursive, rules):
+    return {"input_path": input_path, "recursive": recursive, "rules": rules, "files": {}}
+
+def is_compatible(manifest, input_path, recursive, rules):
+    """A manifest only applies to the same input, walk mode and scanner rules."""
+    return (manifest is not None and manifest.get("input_path") == input_path
+            and manifest.get("recursive") == recursive and manifest.get("rules") == rules)
+
+def diff_manifest(manifest, current_files):
+    """
+    Compares the files found now ({path: stat_key}) with a previous manifest.
+    Returns (changed, deleted): paths that are new or modified, and paths
+    that disappeared.
+    """
+    previous = manifest["files"]
+    changed = [p for p, key in current_files.items() if previous.get(p) != key]
+    deleted = [p for p in previous if p not in current_files]
+    return changed, deleted
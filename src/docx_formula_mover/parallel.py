@@ -0,0 +1,348 @@
+import hashlib
+import os
+import signal
+from collections import deque
+
+from .scanner import DocxScanner, ScanResult
+
+# Files in flight per worker. Keeps the pool busy while bounding how many
+# results can pile up ahead of the (ordered) consumer.
+PENDING_PER_WORKER = 4
+# Files up to this size are read once for both hashing and scanning
+HASH_IN_MEMORY_LIMIT = 64 * 1024 * 1024
+
+_worker_scanner = None
+_worker_cache = None
+
+def _init_worker(scanner_options, cache_spec=None):
+    global _worker_scanner, _worker_cache
+    # Forked workers inherit the parent's handlers (e.g. watch turns SIGTERM
+    # into KeyboardInterrupt). The parent handles both signals and shuts the
+    # pool down; a worker just ignores Ctrl-C and is terminated by SIGTERM.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_scanner = DocxScanner(**scanner_options)
+    if cache_spec is not None:
+        import sqlite3
+        from .cache import ScanCache
+        path, rules = cache_spec
+        try:
+            _worker_cache = ScanCache(path, rules, readonly=True)
+        except sqlite3.Error as e:
+            # Content hits are then found by the parent on the next run
+            print(f"Scan cache unavailable in worker: {e}")
+
+def _scan_in_worker(file_path):
+    return _worker_scanner.scan_file(file_path)
+
+def _hash_and_scan_in_worker(file_path):
+    return _hash_and_scan(_worker_scanner, _worker_cache, file_path)
+
+def _hash_and_scan(scanner, cache, file_path):
+    """
+    Scans a file the cache has no stat record of. The content hash is taken
+    here, in the worker, so hashing runs in parallel, and a document the
+    cache already knows by content (copied, touched, re-uploaded) is served
+    from it. Files up to HASH_IN_MEMORY_LIMIT are read from disk only once.
+    Returns (result, digest, hit); digest is None if the file is unreadable.
+    """
+    from .cache import file_digest
+
+    data = None
+    try:
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size <= HASH_IN_MEMORY_LIMIT:
+                data = f.read()
+        digest = hashlib.sha256(data).hexdigest() if data is not None else file_digest(file_path)
+    except OSError:
+        # The scan reports the error
+        return scanner.scan_file(file_path), None, False
+    cached = cache.get(digest, file_path, touch=False) if cache is not None else None
+    if cached is not None:
+        return cached, digest, True
+    if data is not None:
+        return scanner.scan_bytes(data, file_path), digest, False
+    return scanner.scan_file(file_path), digest, False
+
+def _scan_item(scanner, item):
+    """Scans a scan_many() item: a path, or a (name, data) pair of in-memory bytes."""
+    if isinstance(item, tuple):
+        name, data = item
+        return scanner.scan_bytes(data, name)
+    return scanner.scan_file(os.fspath(item))
+
+def _scan_item_in_worker(item):
+    return _scan_item(_worker_scanner, item)
+
+def _picklable(item):
+    # Views and mappings cannot be sent to a worker process as they are
+    if isinstance(item, tuple) and not isinstance(item[1], (bytes, bytearray)):
+        return item[0], bytes(item[1])
+    return item
+
+def _item_name(item):
+    return item[0] if isinstance(item, tuple) else os.fspath(item)
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def scan_files(paths, workers=1, scanner_options=None, cache=None, mp_context=None, stats=None):
+    """
+    Scans every path and yields a ScanResult per path, in input order.
+    With workers > 1 the scans run on a process pool; at most
+    workers * PENDING_PER_WORKER files are in flight at any time.
+    A worker crash becomes a skipped result for the file that caused it.
+    If a ScanCache is given, cached results are served without scanning
+    and fresh results are stored back; files the cache has no stat record
+    of are hashed by the workers, not here. stats optionally maps paths to
+    the stat data discovery already has (entries are used up as paths are
+    looked up), which saves the cache a stat per file.
+    """
+    scanner_options = scanner_options or {}
+
+    if workers <= 1:
+        scanner = DocxScanner(**scanner_options)
+        for file_path in paths:
+            result, key, st = _lookup(cache, file_path, stats)
+            if result is None:
+                if key is None and st is not None:
+                    result = _finish(cache, file_path, st, None, _hash_and_scan(scanner, cache, file_path))
+                else:
+                    result = scanner.scan_file(file_path)
+                    _store(cache, key, result)
+            yield result
+        return
+
+    # Imported here: multiprocessing is a large share of startup time, and
+    # single-process runs never need it
+    from concurrent.futures.process import BrokenProcessPool
+
+    max_pending = workers * PENDING_PER_WORKER
+    paths = iter(paths)
+    pending = deque()
+    cache_spec = (cache.path, cache.rules) if cache is not None else None
+    executor = _new_pool(workers, scanner_options, mp_context, cache_spec)
+    try:
+        while True:
+            while len(pending) < max_pending:
+                file_path = next(paths, None)
+                if file_path is None:
+                    break
+                result, key, st = _lookup(cache, file_path, stats)
+                if result is None:
+                    if key is None and st is not None:
+                        result = executor.submit(_hash_and_scan_in_worker, file_path)
+                    else:
+                        result = executor.submit(_scan_in_worker, file_path)
+                pending.append((file_path, key, st, result))
+            if not pending:
+                break
+
+            file_path, key, st, future = pending.popleft()
+            if isinstance(future, ScanResult):
+                yield future
+                continue
+            try:
+                yield _finish(cache, file_path, st, key, future.result())
+            except BrokenProcessPool:
+                # Every future of a broken pool fails, not just the culprit.
+                # Retry the affected files one by one so only the crashing
+                # file ends up skipped, then carry on with a fresh pool.
+                executor.shutdown(wait=False, cancel_futures=True)
+                retry = [(file_path, key, st, future)] + list(pending)
+                pending.clear()
+                for retry_path, retry_key, _, retry_future in retry:
+                    if isinstance(retry_future, ScanResult):
+                        yield retry_future
+                        continue
+                    result = _scan_isolated(retry_path, scanner_options, mp_context)
+                    if result is not None:
+                        _store(cache, retry_key, result)
+                        yield result
+                    else:
+                        yield ScanResult(retry_path, False, [], skipped=True)
+                executor = _new_pool(workers, scanner_options, mp_context, cache_spec)
+            except Exception as e:
+                print(f"Error processing {file_path}: {e}")
+                yield ScanResult(file_path, False, [], skipped=True, error=str(e))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def scan_many(items, workers=1, scanner_options=None, mp_context=None):
+    """
+    Scans items and yields a ScanResult per item as soon as it is ready, in
+    completion order (use scan_files for input order and the cache). Items
+    are paths or (name, data) pairs, data being a .docx in memory (bytes,
+    bytearray, memoryview, mmap) reported under name. With workers > 1 the scans
+    run on a process pool with at most workers * PENDING_PER_WORKER items in
+    flight, so a large or endless iterable is consumed as it goes; in-memory
+    data is then pickled to the workers. An item whose scan fails, worker
+    crashes included, comes back as a skipped result.
+    """
+    scanner_options = scanner_options or {}
+
+    if workers <= 1:
+        scanner = DocxScanner(**scanner_options)
+        for item in items:
+            yield _scan_item(scanner, item)
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    max_pending = workers * PENDING_PER_WORKER
+    items = iter(items)
+    pending = {}
+    executor = _new_pool(workers, scanner_options, mp_context)
+    try:
+        while True:
+            while len(pending) < max_pending:
+                item = next(items, None)
+                if item is None:
+                    break
+                pending[executor.submit(_scan_item_in_worker, _picklable(item))] = item
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    yield future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    pending[future] = item
+                except Exception as e:
+                    print(f"Error processing {_item_name(item)}: {e}")
+                    yield ScanResult(_item_name(item), False, [], skipped=True)
+            if broken:
+                # As in scan_files: retry everything in flight one by one so
+                # only the crashing item is lost, then carry on with a new pool
+                executor.shutdown(wait=False, cancel_futures=True)
+                retry = list(pending.values())
+                pending.clear()
+                for item in retry:
+                    result = _scan_isolated(_picklable(item), scanner_options, mp_context, _scan_item_in_worker)
+                    yield result if result is not None else ScanResult(_item_name(item), False, [], skipped=True)
+                executor = _new_pool(workers, scanner_options, mp_context)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+class ScanPool:
+    """
+    Warm scanners for files that arrive over time (see watch.py): submit()
+    each path as it comes in and collect finished results with ready().
+    workers <= 1 scans in this process; otherwise the process pool is
+    started up front, its workers each keeping one DocxScanner, and up to
+    workers * PENDING_PER_WORKER files can be in flight. As in scan_files,
+    a worker crash becomes a skipped result for the file that caused it.
+    """
+
+    def __init__(self, workers=1, scanner_options=None, mp_context=None):
+        self.workers = workers
+        self.scanner_options = scanner_options or {}
+        self.mp_context = mp_context
+        self.max_pending = max(workers, 1) * PENDING_PER_WORKER
+        self.pending = {}  # future -> file_path
+        self.finished = []
+        self.scanner = None
+        self.executor = None
+        if workers <= 1:
+            self.scanner = DocxScanner(**self.scanner_options)
+        else:
+            self.executor = self._start()
+
+    def _start(self):
+        executor = _new_pool(self.workers, self.scanner_options, self.mp_context)
+        # Start every worker now rather than on the first files
+        for _ in range(self.workers):
+            executor.submit(_warm_up)
+        return executor
+
+    def has_room(self):
+        return len(self.pending) < self.max_pending
+
+    def busy(self):
+        return bool(self.pending or self.finished)
+
+    def submit(self, file_path):
+        if self.executor is None:
+            self.finished.append(self.scanner.scan_file(file_path))
+        else:
+            self.pending[self.executor.submit(_scan_in_worker, file_path)] = file_path
+
+    def ready(self):
+        """Returns the results finished since the last call, in completion order."""
+        from concurrent.futures.process import BrokenProcessPool
+
+        results, self.finished = self.finished, []
+        broken = False
+        for future in [f for f in self.pending if f.done()]:
+            file_path = self.pending.pop(future)
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                broken = True
+                self.pending[future] = file_path
+            except Exception as e:
+                print(f"Error processing {file_path}: {e}")
+                results.append(ScanResult(file_path, False, [], skipped=True))
+        if broken:
+            # Retry everything in flight one by one, then start a new pool
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            retry = list(self.pending.values())
+            self.pending.clear()
+            for file_path in retry:
+                result = _scan_isolated(file_path, self.scanner_options, self.mp_context)
+                results.append(result if result is not None else ScanResult(file_path, False, [], skipped=True))
+            self.executor = self._start()
+        return results
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+def _warm_up():
+    pass
+
+def _lookup(cache, file_path, stats=None):
+    """(cached result, content hash, stat data) from ScanCache.lookup, or Nones without a cache."""
+    st = stats.pop(file_path, None) if stats else None
+    # Non-.docx files are skipped by the scanner without being read
+    if cache is None or not file_path.lower().endswith('.docx'):
+        return None, None, None
+    return cache.lookup(file_path, st=st)
+
+def _finish(cache, file_path, st, key, outcome):
+    """Stores a scan in the cache; outcome is a ScanResult, or (result, digest, hit) from _hash_and_scan."""
+    if isinstance(outcome, ScanResult):
+        _store(cache, key, outcome)
+        return outcome
+    result, digest, hit = outcome
+    if digest is None:
+        cache.misses += 1
+    else:
+        cache.record(file_path, st, digest, hit)
+        if not hit:
+            _store(cache, digest, result)
+    return result
+
+def _store(cache, key, result):
+    if cache is not None:
+        cache.store(key, result)
+
+def _new_pool(workers, scanner_options, mp_context, cache_spec=None):
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                               initializer=_init_worker, initargs=(scanner_options, cache_spec))
+
+def _scan_isolated(file_path, scanner_options, mp_context, scan=_scan_in_worker):
+    """Scans one file (or scan_many item) in its own process; returns None if that process fails."""
+    executor = _new_pool(1, scanner_options, mp_context)
+    try:
+        return executor.submit(scan, file_path).result()
+    except Exception as e:
+        print(f"Error processing {_item_name(file_path)}: worker failed ({e})")
+        return None
+    finally:
+        executor.shutdown(wait=True)
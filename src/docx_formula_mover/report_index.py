@@ -0,0 +1,203 @@
+import json
+import ntpath
+import os
+import sqlite3
+import threading
+from collections import Counter
+
+from .utils import read_report_entries
+
+INDEX_NAME = "report.sqlite"
+# Sort keys accepted by query(), mapped to columns (seq = report order)
+SORT_COLUMNS = {"order": "seq", "name": "filename", "path": "input_path", "label": "label",
+                "matches": "match_count"}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+COMMIT_EVERY = 200
+# Serialises open_index(), so only one request builds a missing index
+_BUILD_LOCK = threading.Lock()
+
+class ReportIndex:
+    """
+    SQLite index over the entries of a report, for paginated, filtered and
+    sorted queries that do not load the whole report. Entries keep their
+    report order (seq); the source parts of their matches are indexed
+    separately so a source filter does not have to decode every entry.
+    The summary counts are kept up to date in their own table as entries
+    are added, so they are read without a pass over the entries.
+    report.json and report.csv remain the exported form of the report.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = 0
+        # Count increments of the entries added since the last commit
+        self._counts = Counter()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " seq INTEGER PRIMARY KEY, input_path TEXT, filename TEXT, label TEXT,"
+            " match_count INTEGER, entry TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entry_sources (seq INTEGER, source TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_label ON entries (label)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_filename ON entries (filename)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_match_count ON entries (match_count)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entry_sources_source ON entry_sources (source, seq)")
+        has_counts = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'counts'").fetchone()
+        if not has_counts:
+            # kind: 'label' or 'source'
+            self.conn.execute("CREATE TABLE counts (kind TEXT, key TEXT, count INTEGER, PRIMARY KEY (kind, key))")
+            # Indexes written before the counts were stored
+            self.conn.execute("INSERT INTO counts SELECT 'label', label, COUNT(*) FROM entries GROUP BY label")
+            self.conn.execute("INSERT INTO counts SELECT 'source', source, COUNT(DISTINCT seq)"
+                              " FROM entry_sources GROUP BY source")
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute("DELETE FROM entries")
+        self.conn.execute("DELETE FROM entry_sources")
+        self.conn.execute("DELETE FROM counts")
+        self.conn.commit()
+        self._counts.clear()
+
+    def add(self, entry):
+        """Indexes one report entry (as written by ReportWriter); commits in batches."""
+        # Uploaded names may carry either separator
+        filename = ntpath.basename(entry["input_path"])
+        cur = self.conn.execute(
+            "INSERT INTO entries (input_path, filename, label, match_count, entry) VALUES (?, ?, ?, ?, ?)",
+            (entry["input_path"], filename, entry["label"], len(entry["matches"]), json.dumps(entry)))
+        sources = sorted({m.get("source") for m in entry["matches"]} - {None, ""})
+        self.conn.executemany("INSERT INTO entry_sources (seq, source) VALUES (?, ?)",
+                              [(cur.lastrowid, source) for source in sources])
+        self._counts["label", entry["label"]] += 1
+        self._counts.update(("source", source) for source in sources)
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def add_report(self, output_root):
+        """Indexes every entry of the report in output_root."""
+        for entry in read_report_entries(output_root):
+            self.add(entry)
+        self.commit()
+
+    def commit(self):
+        # The counts are committed in the same transaction as their entries
+        self.conn.executemany(
+            "INSERT INTO counts (kind, key, count) VALUES (?, ?, ?)"
+            " ON CONFLICT (kind, key) DO UPDATE SET count = count + excluded.count",
+            [(kind, key, count) for (kind, key), count in self._counts.items()])
+        self.conn.commit()
+        self._counts.clear()
+        self._pending = 0
+
+    def query(self, label=None, source=None, name=None, sort="order", descending=False,
+              offset=0, limit=DEFAULT_PAGE_SIZE, after=None):
+        """
+        Returns (total, entries, cursor): the number of entries matching the
+        filters, one page of them and the cursor of the next page (None after
+        the last one). label and source match exactly, name is a
+        case-insensitive substring of the file name.
+
+        Pass the cursor back as after to get the next page: it resumes from
+        the last entry returned (keyset pagination), so deep pages cost the
+        same as the first. offset skips entries instead, for jumping to a
+        page. Raises ValueError for an unknown sort key or a bad cursor.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort key: {sort!r} (expected one of {', '.join(SORT_COLUMNS)})")
+        column = SORT_COLUMNS[sort]
+        clause, params = _filters(label, source, name)
+        total = self._stored_total(label, source, name)
+        if total is None:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM entries{clause}", params).fetchone()[0]
+        direction = "DESC" if descending else "ASC"
+        page_clause, page_params = clause, list(params)
+        if after is not None:
+            page_clause += " AND " if clause else " WHERE "
+            page_clause += f"({column}, seq) {'<' if descending else '>'} (?, ?)"
+            page_params += _parse_cursor(after)
+            offset = 0
+        limit = min(limit, MAX_PAGE_SIZE)
+        # seq breaks ties so pages are stable
+        rows = self.conn.execute(
+            f"SELECT {column}, seq, entry FROM entries{page_clause} ORDER BY {column} {direction}, seq {direction}"
+            " LIMIT ? OFFSET ?", page_params + [limit, offset]).fetchall()
+        cursor = json.dumps(list(rows[-1][:2])) if len(rows) == limit else None
+        return total, [json.loads(row[2]) for row in rows], cursor
+
+    def _stored_total(self, label, source, name):
+        """The match count of a query from the stored counts, or None if it needs counting."""
+        if name or (label and source):
+            return None
+        if label:
+            return self._count("label", label)
+        if source:
+            return self._count("source", source)
+        return self.conn.execute("SELECT COALESCE(SUM(count), 0) FROM counts WHERE kind = 'label'").fetchone()[0]
+
+    def _count(self, kind, key):
+        row = self.conn.execute("SELECT count FROM counts WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        return row[0] if row else 0
+
+    def output_paths(self, label=None, source=None, name=None):
+        """Yields the output_path of every matching entry, in report order."""
+        clause, params = _filters(label, source, name)
+        for (entry,) in self.conn.execute(f"SELECT entry FROM entries{clause} ORDER BY seq", params):
+            output_path = json.loads(entry)["output_path"]
+            if output_path:
+                yield output_path
+
+    def summary(self):
+        """Entry counts: total, per label and per match source."""
+        counts = {"label": {}, "source": {}}
+        for kind, key, count in self.conn.execute("SELECT kind, key, count FROM counts WHERE count > 0"):
+            counts[kind][key] = count
+        return {"total": sum(counts["label"].values()), "labels": counts["label"], "sources": counts["source"]}
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+def _filters(label, source, name):
+    """WHERE clause and parameters for the filters of query()."""
+    where, params = [], []
+    if label:
+        where.append("label = ?")
+        params.append(label)
+    if source:
+        where.append("seq IN (SELECT seq FROM entry_sources WHERE source = ?)")
+        params.append(source)
+    if name:
+        where.append("filename LIKE ? ESCAPE '\\'")
+        escaped = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{escaped}%")
+    clause = f" WHERE {' AND '.join(where)}" if where else ""
+    return clause, params
+
+def _parse_cursor(after):
+    """[sort value, seq] from a cursor returned by query()."""
+    try:
+        value, seq = json.loads(after)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid cursor: {after!r}")
+    if not isinstance(seq, int) or not isinstance(value, (str, int)):
+        raise ValueError(f"Invalid cursor: {after!r}")
+    return [value, seq]
+
+def open_index(output_root):
+    """
+    Opens the index of the report in output_root, building it first for
+    reports written without one. Concurrent callers wait for the build
+    rather than reading a half-built index.
+    """
+    path = os.path.join(output_root, INDEX_NAME)
+    with _BUILD_LOCK:
+        exists = os.path.exists(path)
+        index = ReportIndex(path)
+        if not exists:
+            index.add_report(output_root)
+    return index
@@ -1,43 +1,285 @@
+import contextlib
+import io
 import zipfile
-import re
+import time
 import xml.etree.ElementTree as ET
 import os
 
+from .detector import DETECTOR, Match
+
 NAMESPACES = {
     'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
 }
 
+W_P = f"{{{NAMESPACES['w']}}}p"
+W_R = f"{{{NAMESPACES['w']}}}r"
+W_T = f"{{{NAMESPACES['w']}}}t"
+
+ENGINES = ('dom', 'stream')
+
+# Bump whenever detection rules change: cached scan results are keyed by it.
+# 2: ScanResult.truncated is cached (and means "more matches than the cap")
+RULES_VERSION = 2
+
+# A match needs two unescaped "$$" delimiters, i.e. at least four '$' characters.
+MIN_DOLLARS = 4
+PREFILTER_CHUNK_SIZE = 64 * 1024
+
+def may_contain_match(chunks):
+    """
+    Conservative pre-pass over the raw bytes of an XML part.
+    Returns False only when the part provably cannot contain a $$...$$ match,
+    so it can skip XML parsing. Anything that could hide a '$' from a plain
+    byte count (character references, DTD entities, UTF-16) forces a full parse.
+    '$' split across w:r/w:t boundaries is still counted, so such parts are parsed.
+    """
+    dollars = 0
+    tail = b""
+    for i, chunk in enumerate(chunks):
+        if i == 0 and (chunk.startswith(b'\xff\xfe') or chunk.startswith(b'\xfe\xff')):
+            return True
+        if b'\x00' in chunk:
+            return True
+        dollars += chunk.count(b'$')
+        if dollars >= MIN_DOLLARS:
+            return True
+        # The short tail catches markers split across chunk boundaries
+        for marker in (b'&#', b'<!ENTITY'):
+            if marker in chunk or marker in tail + chunk[:8]:
+                return True
+        tail = chunk[-8:]
+    return False
+
+# Opt-in per-file profile (DocxScanner(profile=True)): seconds per stage and counters
+PROFILE_STAGES = ('open_s', 'decompress_s', 'prefilter_s', 'parse_s', 'text_s', 'match_s')
+PROFILE_COUNTERS = ('bytes_decompressed', 'parts_scanned', 'paragraphs', 'runs')
+PROFILE_FIELDS = ('total_s',) + PROFILE_STAGES + PROFILE_COUNTERS
+
+def new_profile():
+    return {field: 0.0 if field.endswith('_s') else 0 for field in PROFILE_FIELDS}
+
+def _timed(profile, stage, func, *args):
+    """Calls func(*args), charging its duration to profile[stage] when profiling."""
+    if profile is None:
+        return func(*args)
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        profile[stage] += time.perf_counter() - start
+
+@contextlib.contextmanager
+def _remainder(profile, stage, others):
+    """Charges the block's duration, less what it charged to `others`, to profile[stage]."""
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    before = sum(profile[other] for other in others)
+    try:
+        yield
+    finally:
+        nested = sum(profile[other] for other in others) - before
+        profile[stage] += time.perf_counter() - start - nested
+
+def _join_runs(run_buffers):
+    return "".join("".join(buf) for buf in run_buffers)
+
+class _TimedReader:
+    """Wraps a zip member stream, charging read() time and bytes to the profile."""
+
+    def __init__(self, stream, profile):
+        self.stream = stream
+        self.profile = profile
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.stream.read(size)
+        self.profile['decompress_s'] += time.perf_counter() - start
+        self.profile['bytes_decompressed'] += len(data)
+        return data
+
+class _BufferReader(io.RawIOBase):
+    """
+    Seekable, read-only file over a buffer (memoryview, bytearray, mmap) for
+    zipfile: the buffer is not copied, read() copies only what it returns.
+    """
+
+    def __init__(self, data):
+        self.view = memoryview(data).cast('B')
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.pos = offset
+        return offset
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.pos + size, len(self.view))
+        data = self.view[self.pos:end].tobytes()
+        self.pos = max(self.pos, end)
+        return data
+
+    def close(self):
+        # Lets the caller close an mmap once the scan is done
+        self.view.release()
+        super().close()
+
 class ScanResult:
-    def __init__(self, file_path, is_error, matches, skipped=False):
+    # Slotted: runs may hold millions of results at once. matches is a tuple
+    # of detector.Match (the shared empty tuple when there are none).
+    __slots__ = ('file_path', 'is_error', 'matches', 'skipped', 'truncated', 'parts_scanned',
+                 'parts_prefiltered', 'profile', 'error')
+
+    def __init__(self, file_path, is_error, matches, skipped=False, parts_scanned=0, parts_prefiltered=0,
+                 truncated=False, profile=None, error=None):
         self.file_path = file_path
         self.is_error = is_error
-        self.matches = matches
+        self.matches = tuple(matches)
         self.skipped = skipped
+        # True when the file has more matches than the cap (max_matches)
+        # allowed; classify-only scans stop at the first match and never set it
+        self.truncated = truncated
+        # XML parts looked at, and how many of those the byte prefilter ruled out
+        self.parts_scanned = parts_scanned
+        self.parts_prefiltered = parts_prefiltered
+        # Stage timings and counters (see PROFILE_FIELDS), only when profiling
+        self.profile = profile
+        # Why a skipped file could not be scanned, when that was an unexpected
+        # (possibly transient) error rather than the file itself; never cached
+        self.error = error
 
 class DocxScanner:
+    def __init__(self, engine='dom', prefilter=True, classify_only=False, max_matches=None, profile=False):
+        # 'dom' parses each part into a full tree (ET.fromstring).
+        # 'stream' reads the zip member incrementally with ET.iterparse and
+        # drops paragraphs once they are scanned, so memory stays flat.
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine!r} (expected one of {', '.join(ENGINES)})")
+        self.engine = engine
+        # Skip XML parsing for parts whose raw bytes cannot hold a match
+        self.prefilter = prefilter
+        # classify_only stops at the first match (document.xml is scanned first);
+        # max_matches caps how many matches are collected per file.
+        if max_matches is not None and max_matches < 1:
+            raise ValueError("max_matches must be at least 1")
+        self.classify_only = classify_only
+        self.max_matches = 1 if classify_only else max_matches
+        # Attach per-stage timings and counters to every ScanResult
+        self.profile = profile
+        self.detector = DETECTOR
+
+    def rules_signature(self):
+        """Identifies everything that affects scan results (engine and prefilter do not)."""
+        signature = f"rules-{RULES_VERSION}"
+        if self.classify_only:
+            signature += "-classify"
+        elif self.max_matches is not None:
+            signature += f"-max{self.max_matches}"
+        return signature
+
     def scan_file(self, file_path):
         if not file_path.lower().endswith('.docx'):
             return ScanResult(file_path, False, [], skipped=True)
+        return self._scan(file_path, file_path)
+
+    def scan_bytes(self, data, name="<bytes>"):
+        """
+        Scans a .docx held in memory (bytes, bytearray, memoryview or mmap)
+        without copying it or writing it to disk. name is reported as the
+        result's file_path; data that is not a zip archive is skipped.
+        """
+        if isinstance(data, bytes):
+            # BytesIO shares an immutable bytes object rather than copying it
+            return self._scan(io.BytesIO(data), name)
+        with _BufferReader(data) as reader:
+            return self._scan(reader, name)
 
+    def scan_fileobj(self, f, name=None):
+        """
+        Scans a .docx from a binary file object, in place when it is
+        seekable; a non-seekable stream (e.g. a socket) is read into memory
+        first, since zip archives are read from the end.
+        """
+        if name is None:
+            name = getattr(f, 'name', "<stream>")
+        if not f.seekable():
+            f = io.BytesIO(f.read())
+        return self._scan(f, name)
+
+    def _scan(self, source, file_path):
+        """Scans a zip archive given as a path or a seekable file object; file_path names the result."""
+        profile = new_profile() if self.profile else None
+        started = time.perf_counter()
         try:
             matches = []
-            with zipfile.ZipFile(file_path, 'r') as zf:
-                xml_files = [f for f in zf.namelist() if f.startswith('word/') and f.endswith('.xml')]
+            parts_prefiltered = 0
+            with zipfile.ZipFile(source, 'r') as zf:
                 # Filter for document, headers, footers, footnotes, endnotes
-                target_files = []
-                for f in xml_files:
-                    if f == 'word/document.xml':
-                        target_files.append(f)
-                    elif re.match(r'word/(header|footer|footnotes|endnotes)\d*\.xml', f):
-                        target_files.append(f)
+                target_files = [f for f in zf.namelist()
+                                if f.startswith('word/') and f.endswith('.xml') and self.detector.is_target_part(f)]
+                if self.classify_only:
+                    # The body is where matches usually are: look there first
+                    target_files.sort(key=lambda f: f != 'word/document.xml')
+                if profile is not None:
+                    profile['open_s'] = time.perf_counter() - started
                 
+                parts_scanned = 0
+                truncated = False
+                # Looking for one match past the cap tells a capped file from
+                # one with exactly max_matches
+                cap = self.max_matches
+                if cap is not None and not self.classify_only:
+                    cap += 1
                 for xml_file in target_files:
-                    xml_content = zf.read(xml_file)
-                    file_matches = self._scan_xml_content(xml_content, xml_file)
+                    if cap is not None and len(matches) >= cap:
+                        break
+                    parts_scanned += 1
+                    limit = None if cap is None else cap - len(matches)
+                    if self.engine == 'stream':
+                        if self.prefilter and not self._stream_may_contain_match(zf, xml_file, profile):
+                            parts_prefiltered += 1
+                            continue
+                        # iterparse interleaves reading, parsing and matching; parse
+                        # time is what is left after the other stages
+                        with zf.open(xml_file) as stream, \
+                                _remainder(profile, 'parse_s', ('decompress_s', 'text_s', 'match_s')):
+                            if profile is not None:
+                                stream = _TimedReader(stream, profile)
+                            file_matches = self._scan_xml_stream(stream, xml_file, limit, profile)
+                    else:
+                        xml_content = _timed(profile, 'decompress_s', zf.read, xml_file)
+                        if profile is not None:
+                            profile['bytes_decompressed'] += len(xml_content)
+                        if self.prefilter and not _timed(profile, 'prefilter_s', may_contain_match, [xml_content]):
+                            parts_prefiltered += 1
+                            continue
+                        file_matches = self._scan_xml_content(xml_content, xml_file, limit, profile)
                     matches.extend(file_matches)
+                if self.max_matches is not None and len(matches) > self.max_matches:
+                    matches = matches[:self.max_matches]
+                    truncated = True
 
+            if profile is not None:
+                profile['parts_scanned'] = parts_scanned
+                profile['total_s'] = time.perf_counter() - started
             is_error = len(matches) > 0
-            return ScanResult(file_path, is_error, matches)
+            return ScanResult(file_path, is_error, matches, parts_scanned=parts_scanned,
+                              parts_prefiltered=parts_prefiltered, truncated=truncated, profile=profile)
 
         except zipfile.BadZipFile:
              # Treat bad zip as skipped or maybe error? Requirement says "Skip non-.docx files", implies valid structure.
@@ -48,119 +290,109 @@ class DocxScanner:
         except Exception as e:
             # General error handling
             print(f"Error processing {file_path}: {e}")
-            return ScanResult(file_path, False, [], skipped=True)
+            return ScanResult(file_path, False, [], skipped=True, error=str(e))
+
+    def _stream_may_contain_match(self, zf, xml_file, profile=None):
+        # Chunked so the stream engine keeps its flat memory profile;
+        # the member is only decompressed a second time when it must be parsed.
+        with zf.open(xml_file) as stream, _remainder(profile, 'prefilter_s', ('decompress_s',)):
+            if profile is not None:
+                stream = _TimedReader(stream, profile)
+            return may_contain_match(iter(lambda: stream.read(PREFILTER_CHUNK_SIZE), b""))
 
-    def _scan_xml_content(self, xml_content, source_name):
-        root = ET.fromstring(xml_content)
+    def _scan_xml_content(self, xml_content, source_name, limit=None, profile=None):
+        root = _timed(profile, 'parse_s', ET.fromstring, xml_content)
         matches = []
         
         # Iterate over paragraphs
         # We need to find <w:p> elements.
         
-        for i, p in enumerate(root.iter(f"{{{NAMESPACES['w']}}}p")):
-            text = ""
-            # Iterate runs <w:r>
-            for r in p.iter(f"{{{NAMESPACES['w']}}}r"):
-                # Iterate text <w:t>
-                for t in r.iter(f"{{{NAMESPACES['w']}}}t"):
-                    if t.text:
-                        text += t.text
+        for i, p in enumerate(root.iter(W_P)):
+            if profile is not None:
+                profile['paragraphs'] += 1
+                profile['runs'] += sum(1 for _ in p.iter(W_R))
+                text_started = time.perf_counter()
+            # Text of every <w:t> of every run <w:r>, in document order
+            text = "".join([t.text for r in p.iter(W_R) for t in r.iter(W_T) if t.text])
+            if profile is not None:
+                profile['text_s'] += time.perf_counter() - text_started
             
             if not text:
                 continue
 
-            # Detect $$...$$
-            # "Detect $$...$$ display math only when: two consecutive $ characters start and end a span (non-greedy), and the $$ delimiter is not escaped"
-            
-            # Pattern looking for $$...$$
-            # Negative lookbehind (?<!\\) ensures first $$ is not escaped.
-            # We also need to check if the second $$ is not escaped.
-            # We search for unescaped $$ first.
-            
-            # Strategy: Find all occurrences of $$ in the string.
-            # Filter out those preceded by \
-            
-            # Regex for finding candidates:
-            # (?<!\\)\$\$
-            
-            dollar_indices = [m.start() for m in re.finditer(r'(?<!\\)\$\$', text)]
-            
-            if len(dollar_indices) < 2:
-                continue
-                
-            # Now we need to pair them up. "non-greedy" means closest pairs?
-            # Requirement: "two consecutive $ characters start and end a span (non-greedy)"
-            # Usually means first $$ pairs with second $$, third with fourth.
-            # What about `$$ a $$ b $$`? -> `$$ a $$` is one, `b` is outside, trailing `$$` is unmatched?
-            # Or does it mean `$$` starts, next `$$` ends.
-            
-            # Additional constraint: "not inside code/template patterns like $VAR, ${var}, {{ $x }}."
-            # The tool looks for DISPLAY math `$$...$$`.
-            # Typically code templates use single `$`. If they use `$$` it might be valid math or escaped.
-            # The prompt says: "detect $$...$$ ... not inside code/template patterns".
-            # If we see `{{ $$x }}` it might be template.
-            # Be simple: If we find `$$...$$`, check if the Start `$$` is preceded by `{{` or similar?
-            # Prompt says "not inside code/template patterns like $VAR, ${var}, {{ $x }}".
-            # Note the examples use single $.
-            
-            # Detecting if we are inside `{{...}}` or `${...}` is context dependent.
-            # Given "Run-safe detection", we use the full paragraph text.
-            
-            # Approach:
-            # 1. Find potential `$$...$$` ranges.
-            # 2. For each range, validate it.
-            
-            idx = 0
-            while idx < len(dollar_indices) - 1:
-                start_pos = dollar_indices[idx]
-                end_pos = dollar_indices[idx+1]
-                
-                # Check for validity
-                # Content between them:
-                content = text[start_pos+2 : end_pos]
-                
-                # Check if this `$$` is actually part of `${` or `{{` context.
-                # A heuristic: check surroundings.
-                # If start_pos is preceded by `{`, it might be `${`.
-                # But `${` usually usually uses single `$`.
-                # If we have `$$`, maybe it's `${$`.
-                
-                # Prompt specific example: "not inside code/template patterns like $VAR, ${var}, {{ $x }}."
-                # These examples don't feature `$$`.
-                # If the text is `{{ $$ x }}`, is it math? LaTeX inside template?
-                # "Unescaped display-math delimiters $$...$$ in visible text (i.e., raw text that LaTeX would see)."
-                # If I have `{{ $$ math $$ }}`, LaTeX probably WOULD see it if the template engine renders it.
-                # But if the template engine consumes it?
-                # The user says "detect... ONLY WHEN ... not inside code/template patterns".
-                # It implies we should ignore `$$` if it looks like variable interpolation.
-                # But `$$` is rarely used for variable interpolation.
-                # I will assume that if I find `$$...$$`, it is a match, UNLESS it is specifically invalid.
-                # The "not inside code/template patterns" clause might be a warning to not confuse `$$` with `$var`.
-                # Since `$$` != `$`, `$$` is less ambiguous.
-                
-                # One edge case: `$$` inside `{{...}}`.
-                # I will check if the range is enclosed in `{{` and `}}`.
-                # This requires parsing balanced braces?
-                # Simple check: Is there a `{{` closely preceding and `}}` closely following?
-                # Or simply: Is it "visible text"?
-                
-                # Let's trust the "unescaped" rule primarily.
-                # And check if `$$` is part of `${...}` which would be `${` followed by `...`.
-                # `$$` matches `${`? No.
-                
-                # What if the text is `var = "$$text"`. Code string?
-                # The requirement says "visible text". Word doc text usually is visible.
-                
-                snippet = text[start_pos : end_pos + 2]
-                match_info = {
-                    "text": snippet,
-                    "paragraph_index": i,
-                    "offset": start_pos,
-                    "source": source_name
-                }
-                matches.append(match_info)
-                
-                # Consume these two
-                idx += 2
+            matches.extend(_timed(profile, 'match_s', self._find_matches, text, i, source_name))
+            if limit is not None and len(matches) >= limit:
+                return matches[:limit]
         
         return matches
+
+    def _scan_xml_stream(self, stream, source_name, limit=None, profile=None):
+        """
+        Streaming counterpart of _scan_xml_content.
+        Produces the same matches while only keeping the paragraph being
+        scanned in memory: finished elements are cleared and detached.
+        Parsing stops as soon as `limit` matches are found.
+        """
+        matches = []
+        elements = []     # open elements (parse stack)
+        paragraphs = []   # open <w:p>: [paragraph_index, run_buffers, found]
+        runs = []         # open <w:r>: buffers of every paragraph they belong to
+        pending = []      # found lists of nested paragraphs, in start order
+        p_count = 0
+
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                elements.append(elem)
+                if elem.tag == W_P:
+                    # Matches are reported in paragraph start order, like the
+                    # DOM path, even though nested paragraphs end first.
+                    found = []
+                    pending.append(found)
+                    paragraphs.append([p_count, [], found])
+                    p_count += 1
+                    if profile is not None:
+                        profile['paragraphs'] += 1
+                elif elem.tag == W_R and paragraphs:
+                    if profile is not None:
+                        profile['runs'] += 1
+                    # Same text as p.iter(r) / r.iter(t) in the DOM path: a run
+                    # contributes to every enclosing paragraph, in run order.
+                    buffers = []
+                    for p in paragraphs:
+                        buf = []
+                        p[1].append(buf)
+                        buffers.append(buf)
+                    runs.append(buffers)
+                continue
+
+            elements.pop()
+            if elem.tag == W_T:
+                if elem.text and runs:
+                    for buffers in runs:
+                        for buf in buffers:
+                            buf.append(elem.text)
+            elif elem.tag == W_R and paragraphs:
+                runs.pop()
+            elif elem.tag == W_P:
+                index, run_buffers, found = paragraphs.pop()
+                text = _timed(profile, 'text_s', _join_runs, run_buffers)
+                if text:
+                    found.extend(_timed(profile, 'match_s', self._find_matches, text, index, source_name))
+                if not paragraphs:
+                    for found in pending:
+                        matches.extend(found)
+                    pending = []
+                    if limit is not None and len(matches) >= limit:
+                        return matches[:limit]
+
+            if not paragraphs:
+                # Nothing open needs this subtree any more
+                elem.clear()
+                if elements:
+                    del elements[-1][-1]
+
+        return matches
+
+    def _find_matches(self, text, paragraph_index, source_name):
+        # Detection rules live in detector.FormulaDetector
+        return self.detector.find_matches(text, paragraph_index, source_name)
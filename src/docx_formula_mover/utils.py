@@ -1,29 +1,229 @@
+import errno
 import os
 import shutil
+import sys
 import json
 import csv
+import heapq
+import time
+
+from .scanner import PROFILE_FIELDS, Match
+from .discovery import walk_order_key
 
 def ensure_directory(path):
     if not os.path.exists(path):
         os.makedirs(path)
 
+# File placement strategies, see place_file
+PLACEMENTS = ('copy', 'move', 'hardlink', 'reflink')
+# Linux ioctl that clones a file's extents (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
 def move_file(src_path, dest_folder, dry_run=False):
     """
     Copies file to dest_folder.
     If dry_run is True, detects where it WOULD go but doesn't copy.
     Returns the destination path.
     """
+    dest_path, _ = place_file(src_path, dest_folder, 'copy', dry_run=dry_run)
+    return dest_path
+
+def place_file(src_path, dest_folder, strategy='copy', dry_run=False):
+    """
+    Places src_path into dest_folder using one of PLACEMENTS:
+      copy     - full copy (the default)
+      move     - rename; copy + delete across filesystems
+      hardlink - second link to the same data; copy across filesystems
+      reflink  - copy-on-write clone where the filesystem supports it, else copy
+    Returns (dest_path, strategy actually used); the strategy is "" for a dry run.
+    """
+    if strategy not in PLACEMENTS:
+        raise ValueError(f"Unknown placement: {strategy!r} (expected one of {', '.join(PLACEMENTS)})")
     filename = os.path.basename(src_path)
     dest_path = os.path.join(dest_folder, filename)
-    
-    if not dry_run:
-        ensure_directory(dest_folder)
-        # Handle collision? Overwrite?
-        # Requirement doesn't specify. Standard mv overwrites or fails.
-        # Python shutil.copy2 overwrites if dest is file.
-        shutil.copy2(src_path, dest_path)
-        
-    return dest_path
+    if dry_run:
+        return dest_path, ""
+
+    ensure_directory(dest_folder)
+    # Handle collision? Overwrite?
+    # Requirement doesn't specify. Standard mv overwrites or fails.
+    # Existing files are replaced, as shutil.copy2 does.
+    if strategy == 'move':
+        try:
+            os.replace(src_path, dest_path)
+        except OSError:
+            # Different filesystem: copy, then drop the source
+            _copy(src_path, dest_path, shutil.copy2)
+            os.remove(src_path)
+        return dest_path, 'move'
+
+    if strategy == 'hardlink':
+        try:
+            _copy(src_path, dest_path, os.link)
+            return dest_path, 'hardlink'
+        except OSError:
+            pass
+    elif strategy == 'reflink':
+        try:
+            _copy(src_path, dest_path, _reflink)
+            return dest_path, 'reflink'
+        except OSError:
+            pass
+
+    _copy(src_path, dest_path, shutil.copy2)
+    return dest_path, 'copy'
+
+def _copy(src_path, dest_path, copy_function):
+    # Place under a temporary name first so an interrupted copy never
+    # leaves a truncated document under the final name.
+    tmp_path = dest_path + ".part"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        copy_function(src_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+    except OSError:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _reflink(src_path, dest_path):
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with open(src_path, 'rb') as src, open(dest_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    elif sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src_path), os.fsencode(dest_path), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), src_path)
+    else:
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported on this platform", src_path)
+    shutil.copystat(src_path, dest_path)
+
+REPORT_FIELDS = ["input_path", "output_path", "label", "matches", "skipped"]
+# Fields added later, with the value used for entries written before them
+OPTIONAL_FIELDS = {"placement": ""}
+CSV_HEADER = ["input_path", "output_path", "label", "skipped", "match_count", "placement", "truncated"]
+# Extra CSV columns of a profiled run (ReportWriter(profile=True)), see scanner.PROFILE_FIELDS
+PROFILE_CSV_HEADER = [f"profile_{field}" for field in PROFILE_FIELDS]
+# Report streams are flushed every FLUSH_EVERY entries or FLUSH_INTERVAL seconds
+FLUSH_EVERY = 100
+FLUSH_INTERVAL = 5.0
+
+def report_entry(item):
+    """
+    Normalizes a result dict to the report shape (see generate_reports).
+    This is where matches become dicts: results keep them as compact
+    Match tuples until they are serialized.
+    """
+    entry = {key: item[key] for key in REPORT_FIELDS}
+    entry["matches"] = [m.to_dict() if isinstance(m, Match) else m for m in entry["matches"]]
+    for key, default in OPTIONAL_FIELDS.items():
+        entry[key] = item.get(key, default)
+    # Only files with more matches than --max-matches allowed carry the flag
+    if item.get("truncated"):
+        entry["truncated"] = True
+    # Stage timings, only for scans run with profiling on (JSON reports only)
+    if item.get("profile") is not None:
+        entry["profile"] = item["profile"]
+    return entry
+
+def read_report_entries(output_root):
+    """
+    Yields the entries of the report in output_root, one at a time.
+    Reads report.jsonl when present, else falls back to report.json.
+    A truncated last line (interrupted write) is ignored.
+    """
+    jsonl_path = os.path.join(output_root, "report.jsonl")
+    json_path = os.path.join(output_root, "report.json")
+    if os.path.exists(jsonl_path):
+        yield from _read_jsonl(jsonl_path)
+    elif os.path.exists(json_path):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+
+def _read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
+
+class ReportWriter:
+    """
+    Writes report entries as they are produced instead of collecting them:
+    each entry is appended to report.jsonl and report.csv, and both are
+    flushed periodically so a long run can be tailed and a crash loses at
+    most the last few entries. close() finalizes report.json from the
+    JSON Lines stream without loading it into memory.
+    """
+
+    def __init__(self, output_root, append=False, profile=False):
+        ensure_directory(output_root)
+        self.output_root = output_root
+        self.jsonl_path = os.path.join(output_root, "report.jsonl")
+        self.csv_path = os.path.join(output_root, "report.csv")
+        mode = 'a' if append else 'w'
+        write_header = not (append and os.path.exists(self.csv_path))
+        self.jsonl_file = open(self.jsonl_path, mode, encoding='utf-8')
+        self.csv_file = open(self.csv_path, mode, newline='', encoding='utf-8')
+        self.csv_writer = csv.writer(self.csv_file)
+        # Profiled runs get one column per stage/counter; blank for cache hits
+        self.profile = profile
+        if write_header:
+            self.csv_writer.writerow(CSV_HEADER + (PROFILE_CSV_HEADER if profile else []))
+        self.count = 0
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, item):
+        entry = report_entry(item)
+        self.jsonl_file.write(json.dumps(entry) + "\n")
+        row = [
+            entry["input_path"],
+            entry["output_path"],
+            entry["label"],
+            entry["skipped"],
+            len(entry["matches"]),
+            entry["placement"],
+            entry.get("truncated", False)
+        ]
+        if self.profile:
+            profile = entry.get("profile") or {}
+            row.extend(profile.get(field, "") for field in PROFILE_FIELDS)
+        self.csv_writer.writerow(row)
+        self.count += 1
+        self._unflushed += 1
+        if self._unflushed >= FLUSH_EVERY or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.jsonl_file.flush()
+        self.csv_file.flush()
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.jsonl_file.close()
+        self.csv_file.close()
+        finalize_json_report(self.output_root)
+        print(f"Reports generated at {self.output_root}")
+
+def finalize_json_report(output_root):
+    """Rebuilds report.json from report.jsonl, one entry at a time."""
+    json_path = os.path.join(output_root, "report.json")
+    tmp_path = json_path + ".part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        # Same layout as json.dump(entries, f, indent=2)
+        first = True
+        for entry in _read_jsonl(os.path.join(output_root, "report.jsonl")):
+            f.write("[\n  " if first else ",\n  ")
+            f.write(json.dumps(entry, indent=2).replace("\n", "\n  "))
+            first = False
+        f.write("[]" if first else "\n]")
+    os.replace(tmp_path, json_path)
 
 def generate_reports(scan_results, output_root):
     """
@@ -34,41 +234,202 @@ def generate_reports(scan_results, output_root):
         "input_path": str,
         "output_path": str,
         "label": "formula_error" | "no_error" | "skipped",
-        "matches": list,
-        "skipped": bool
+        "matches": list of Match (converted to dicts here),
+        "skipped": bool,
+        "placement": "copy" | "move" | "hardlink" | "reflink" | ""  (optional)
     }
     """
+    writer = ReportWriter(output_root)
+    for item in scan_results:
+        writer.write(item)
+    writer.close()
+
+def open_report_merge(output_root, replaced_paths, profile=False, deleted_paths=()):
+    """
+    Starts rewriting the report in output_root for an incremental run.
+    Existing entries are streamed into a new ReportWriter, except those whose
+    input_path is in replaced_paths (re-scanned or deleted inputs); the caller
+    then writes the new entries and closes the writer.
+    The copies placed for deleted_paths are removed as well, unless a kept
+    entry still points at the same file (inputs with the same file name).
+    """
+    stale = []
+    kept_outputs = set()
+
+    def keep(entry):
+        if entry["input_path"] not in replaced_paths:
+            kept_outputs.add(entry["output_path"])
+            return True
+        if entry["input_path"] in deleted_paths and not entry["skipped"] and entry["output_path"]:
+            stale.append(entry["output_path"])
+        return False
+
+    writer = _rewrite_report(output_root, keep, profile)
+    for output_path in stale:
+        if output_path not in kept_outputs and os.path.isfile(output_path):
+            os.remove(output_path)
+            print(f"Removed {output_path} (input deleted)")
+    return writer
+
+def open_report_resume(output_root, input_paths, dry_run=False, profile=False):
+    """
+    Picks up the partial report of an interrupted run in output_root.
+    Keeps the entries for input_paths whose work is complete: classified and,
+    unless dry_run, copied to their output_path. Returns (writer, done_paths);
+    the caller scans the remaining inputs and appends them to the writer.
+    """
+    done_paths = set()
+
+    def keep(entry):
+        if entry["input_path"] in done_paths:
+            return False
+        # Inputs placed with 'move' are no longer found by the walk
+        if entry["input_path"] not in input_paths and entry.get("placement") != 'move':
+            return False
+        placed = dry_run or entry["skipped"] or os.path.exists(entry["output_path"])
+        if placed:
+            done_paths.add(entry["input_path"])
+        return placed
+
+    writer = _rewrite_report(output_root, keep, profile)
+    return writer, done_paths
+
+def moved_inputs(output_root, input_paths):
+    """
+    Returns the input_paths that a previous run in output_root moved into
+    place (placement 'move') and whose output_path still exists. Such inputs
+    are gone from the walk but their report entries are still valid.
+    """
+    input_paths = set(input_paths)
+    moved = set()
+    if not input_paths:
+        return moved
+    for entry in read_report_entries(output_root):
+        if (entry["input_path"] in input_paths and entry.get("placement") == 'move'
+                and os.path.exists(entry["output_path"])):
+            moved.add(entry["input_path"])
+    return moved
+
+def _rewrite_report(output_root, keep, profile=False):
+    """Streams the current report into a new ReportWriter, keeping entries for which keep(entry) is true."""
     ensure_directory(output_root)
-    
-    report_data = []
-    
+    jsonl_path = os.path.join(output_root, "report.jsonl")
+    prev_path = jsonl_path + ".prev"
+    if not os.path.exists(prev_path):
+        if os.path.exists(jsonl_path):
+            os.replace(jsonl_path, prev_path)
+        else:
+            # Reports written before report.jsonl existed (or no report yet)
+            with open(prev_path, 'w', encoding='utf-8') as f:
+                for entry in read_report_entries(output_root):
+                    f.write(json.dumps(entry) + "\n")
+    # If .prev already exists an earlier rewrite was interrupted; it is still
+    # the complete previous report, so start over from it.
+
+    writer = ReportWriter(output_root, profile=profile)
+    for entry in _read_jsonl(prev_path):
+        if keep(entry):
+            writer.write(entry)
+    writer.flush()
+    os.remove(prev_path)
+    return writer
+
+def merge_reports(scan_results, output_root, removed_paths=()):
+    """
+    Merges scan_results into the existing report.json/report.csv in output_root.
+    Entries for removed_paths, and older entries for re-scanned inputs, are
+    dropped; untouched entries keep their order and new ones are appended.
+    """
+    replaced = set(removed_paths)
+    replaced.update(item["input_path"] for item in scan_results)
+    writer = open_report_merge(output_root, replaced)
     for item in scan_results:
-        report_data.append({
-            "input_path": item["input_path"],
-            "output_path": item["output_path"],
-            "label": item["label"],
-            "matches": item["matches"],
-            "skipped": item["skipped"]
-        })
-        
-    # JSON
-    json_path = os.path.join(output_root, "report.json")
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(report_data, f, indent=2)
-        
-    # CSV
+        writer.write(item)
+    writer.close()
+
+SUMMARY_NAME = "summary.json"
+# Written by scan --shard: the root the shard's paths are relative to
+SHARD_NAME = "shard.json"
+
+def save_shard_info(output_root, input_root, shard):
+    os.makedirs(output_root, exist_ok=True)
+    with open(os.path.join(output_root, SHARD_NAME), 'w', encoding='utf-8') as f:
+        json.dump({"input_root": input_root, "shard": list(shard)}, f)
+
+def load_shard_root(output_root):
+    """The input root recorded by a shard run in output_root, or None."""
+    try:
+        with open(os.path.join(output_root, SHARD_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)["input_root"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def same_path(path, *others):
+    """True if path names the same location as any of others (which need not exist)."""
+    def normalized(p):
+        return os.path.normcase(os.path.realpath(p))
+    return normalized(path) in {normalized(other) for other in others}
+
+def merge_shard_reports(shard_roots, output_root):
+    """
+    Combines the reports of shard runs (scan --shard K/N, one output root
+    each) into a single report in output_root. Each shard report is read as
+    a stream and merged with heapq.merge, so memory does not grow with the
+    shards; entries come out in the order an unsharded run would have
+    written them, by their path under the shard's input root (so shards
+    may have scanned the input under different mount points). Output paths
+    keep pointing into the shard roots. output_root must not be one of
+    them (ValueError). Writes summary.json with the counts and returns them.
+    """
+    if same_path(output_root, *shard_roots):
+        raise ValueError(f"Output root {output_root} is one of the shard roots")
+    profile = any(_has_profile_columns(root) for root in shard_roots)
+    counts = {}
+    summary = {"total": 0, "labels": counts, "shards": {}}
+    streams = [_ordered_entries(root, summary["shards"]) for root in shard_roots]
+    writer = ReportWriter(output_root, profile=profile)
+    last_key = None
+    for key, entry in heapq.merge(*streams, key=lambda item: item[0]):
+        # The same input reported twice (a shard passed twice) is kept once
+        if key == last_key:
+            continue
+        last_key = key
+        writer.write(entry)
+        summary["total"] += 1
+        counts[entry["label"]] = counts.get(entry["label"], 0) + 1
+    writer.close()
+    with open(os.path.join(output_root, SUMMARY_NAME), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def _ordered_entries(output_root, shard_counts):
+    """Yields (walk order key, entry) for a shard report, warning if it is not in walk order."""
+    input_root = load_shard_root(output_root)
+    if input_root is None:
+        print(f"Warning: {output_root} has no {SHARD_NAME}; ordering its entries by absolute path")
+    count = 0
+    previous = None
+    warned = False
+    for entry in read_report_entries(output_root):
+        path = entry["input_path"]
+        if input_root is not None:
+            path = os.path.relpath(path, input_root)
+        key = walk_order_key(path)
+        if not warned and previous is not None and key < previous:
+            # e.g. an incremental shard run, which appends changed files at
+            # the end; every entry is still merged, in approximate order
+            print(f"Warning: {output_root} is not in scan order; merged order may differ from an unsharded run")
+            warned = True
+        previous = key
+        count += 1
+        shard_counts[output_root] = count
+        yield key, entry
+    shard_counts.setdefault(output_root, count)
+
+def _has_profile_columns(output_root):
     csv_path = os.path.join(output_root, "report.csv")
-    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        # Header
-        writer.writerow(["input_path", "output_path", "label", "skipped", "match_count"])
-        for item in report_data:
-            writer.writerow([
-                item["input_path"],
-                item["output_path"],
-                item["label"],
-                item["skipped"],
-                len(item["matches"])
-            ])
-            
-    print(f"Reports generated at {output_root}")
+    if not os.path.exists(csv_path):
+        return False
+    with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        header = next(csv.reader(f), [])
+    return PROFILE_CSV_HEADER[0] in header
@@ -0,0 +1,273 @@
+import os
+import struct
+import sys
+import time
+from collections import deque
+
+from . import discovery
+from . import parallel
+from .manifest import stat_key
+
+# A file is scanned once its size and mtime have not changed for this long
+SETTLE_SECONDS = 0.3
+POLL_INTERVAL = 0.5
+# Wake-up interval while files are settling or being scanned
+TICK = 0.05
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+READ_SIZE = 64 * 1024
+
+class PollingWatcher:
+    """Finds new and modified files by walking root every interval seconds and comparing stat data."""
+
+    kind = "polling"
+
+    def __init__(self, root, recursive, filters, interval=POLL_INTERVAL):
+        self.root = root
+        self.recursive = recursive
+        self.filters = filters
+        self.interval = interval
+        self.snapshot = {}
+        self.next_poll = 0.0
+
+    def rescan(self):
+        """Every matching file under root, stat data included."""
+        snapshot = {path: st for path, st in discovery.discover(self.root, self.recursive, **self.filters)}
+        self.snapshot = {path: stat_key(path, st) for path, st in snapshot.items()}
+        self.next_poll = time.monotonic() + self.interval
+        return list(snapshot.items())
+
+    def changes(self, timeout=None):
+        """Waits up to timeout seconds (None: until the next poll) and returns the changed files."""
+        wait = self.next_poll - time.monotonic()
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        previous = self.snapshot
+        return [(path, st) for path, st in self.rescan() if previous.get(path) != self.snapshot[path]]
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """
+    Linux inotify through ctypes: one watch per directory, reporting files
+    when they are created, closed after writing or moved in. Directories
+    created later are watched as they appear. If the kernel queue overflows
+    the whole tree is rescanned.
+    """
+
+    kind = "inotify"
+
+    def __init__(self, root, recursive, filters):
+        import ctypes
+
+        self.root = root
+        self.recursive = recursive
+        self.filters = filters
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self._raise_errno("inotify_init1")
+        self.dirs = {}  # watch descriptor -> directory
+        try:
+            self._watch_tree(root)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _raise_errno(self, what, path=None):
+        import ctypes
+        err = ctypes.get_errno()
+        raise OSError(err, f"{what}: {os.strerror(err)}", path)
+
+    def _watch_tree(self, top):
+        """Watches top and, if recursive, every wanted directory below it; returns the files found there."""
+        found = []
+        pending = [top]
+        while pending:
+            directory = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                self._raise_errno("inotify_add_watch", directory)
+            self.dirs[wd] = directory
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError as e:
+                print(f"Error reading {directory}: {e}")
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    if self.recursive and self._wanted(entry.path, directory=True):
+                        pending.append(entry.path)
+                elif self._wanted(entry.path):
+                    found.append((entry.path, None))
+        return found
+
+    def _wanted(self, path, directory=False):
+        include = None if directory else self.filters["include"]
+        return discovery.path_matches(self.root, path, include=include, exclude=self.filters["exclude"],
+                                      skip_hidden=self.filters["skip_hidden"])
+
+    def rescan(self):
+        return list(discovery.discover(self.root, self.recursive, **self.filters))
+
+    def changes(self, timeout=None):
+        """Waits up to timeout seconds (None: indefinitely) and returns the files events were seen for."""
+        import select
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+        data = b"".join(chunks)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                print("Watch: event queue overflowed, rescanning")
+                return self.rescan()
+            if mask & IN_IGNORED:
+                # The directory is gone
+                self.dirs.pop(wd, None)
+                continue
+            directory = self.dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                # A new directory may already hold files
+                if self.recursive and self._wanted(path, directory=True):
+                    try:
+                        changed.extend(self._watch_tree(path))
+                    except OSError as e:
+                        print(f"Error watching {path}: {e}")
+            elif self._wanted(path):
+                changed.append((path, None))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def open_watcher(root, recursive, filters, poll=False, poll_interval=POLL_INTERVAL):
+    """An InotifyWatcher where the platform supports it, else (or with poll) a PollingWatcher."""
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root, recursive, filters)
+        except (OSError, AttributeError) as e:
+            # AttributeError: a libc without inotify
+            print(f"Watch: inotify unavailable ({e}), polling instead")
+    return PollingWatcher(root, recursive, filters, poll_interval)
+
+class Debouncer:
+    """
+    Holds changed files until they have settled: a file is ready once its
+    size and mtime are the same as settle seconds earlier, so documents
+    still being copied in are not scanned half-written.
+    """
+
+    def __init__(self, settle=SETTLE_SECONDS):
+        self.settle = settle
+        self.pending = {}  # path -> (stat key, due)
+
+    def touch(self, path, st=None, now=None):
+        now = time.monotonic() if now is None else now
+        try:
+            key = stat_key(path, st)
+        except OSError:
+            # Already gone again
+            self.pending.pop(path, None)
+            return
+        self.pending[path] = (key, now + self.settle)
+
+    def ready(self, now=None):
+        """Returns (path, stat key) of the files that have settled."""
+        now = time.monotonic() if now is None else now
+        settled = []
+        for path, (key, due) in list(self.pending.items()):
+            if due > now:
+                continue
+            try:
+                current = stat_key(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if current == key:
+                del self.pending[path]
+                settled.append((path, key))
+            else:
+                self.pending[path] = (current, now + self.settle)
+        return settled
+
+def watch(root, recursive=True, workers=1, scanner_options=None, settle=SETTLE_SECONDS, poll=False,
+          poll_interval=POLL_INTERVAL, scanned=None, include=None, exclude=(), min_size=None, max_size=None,
+          skip_hidden=True, mp_context=None):
+    """
+    Watches root and yields a ScanResult for every new or modified file
+    once it has settled, for as long as the caller keeps iterating. Files
+    already there when the watch starts are scanned first. scanned maps
+    paths to the stat key (manifest.stat_key) they were last scanned with,
+    e.g. from an earlier watch: files whose size and mtime still match are
+    not scanned again. The watch records every file it submits in it.
+    Scans run on a ScanPool that stays warm for the whole watch; filters
+    are those of discover().
+    """
+    filters = {"include": include or discovery.DEFAULT_INCLUDE, "exclude": exclude, "min_size": min_size,
+               "max_size": max_size, "skip_hidden": skip_hidden}
+    watcher = open_watcher(root, recursive, filters, poll, poll_interval)
+    pool = parallel.ScanPool(workers, scanner_options, mp_context)
+    debouncer = Debouncer(settle)
+    queue = deque()  # settled files waiting for room on the pool
+    scanned = {} if scanned is None else scanned
+    print(f"Watching {root} ({watcher.kind})")
+    try:
+        # The watcher is set up before this walk, so nothing falls in between
+        for path, st in watcher.rescan():
+            debouncer.touch(path, st)
+        while True:
+            busy = debouncer.pending or queue or pool.busy()
+            for path, st in watcher.changes(TICK if busy else None):
+                debouncer.touch(path, st)
+            for path, key in debouncer.ready():
+                # Unchanged since its last scan (e.g. reported again after an
+                # overflow, or already there in an earlier watch)
+                if scanned.get(path) == key:
+                    continue
+                if (min_size is not None and key[0] < min_size) or (max_size is not None and key[0] > max_size):
+                    continue
+                queue.append((path, key))
+            while queue and pool.has_room():
+                path, key = queue.popleft()
+                scanned[path] = key
+                pool.submit(path)
+            yield from pool.ready()
+    finally:
+        watcher.close()
+        pool.close()
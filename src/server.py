@@ -3,186 +3,558 @@ import json
 import flask
 from flask import Flask, jsonify, request
 from flask_cors import CORS
+import argparse
+import itertools
+import queue
 import threading
-import webbrowser
+import time
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+# Configuration, overridable from the environment (DOCX_*)
+# Output root where the jobs, blobs and scan cache live; by default the
+# manual_output folder next to src/
+OUTPUT_ROOT = os.path.abspath(os.environ.get(
+    "DOCX_OUTPUT_ROOT", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "manual_output")))
+# Scan jobs run concurrently on this many threads; more submissions wait in
+# a queue of at most MAX_QUEUED_JOBS
+JOB_WORKERS = env_int("DOCX_JOB_WORKERS", 2)
+MAX_QUEUED_JOBS = env_int("DOCX_MAX_QUEUED_JOBS", 64)
+# A pipelined upload that sends nothing for this many seconds is abandoned:
+# its job fails and frees its worker
+UPLOAD_IDLE_TIMEOUT = env_int("DOCX_UPLOAD_IDLE_TIMEOUT", 600)
+MAX_UPLOAD_BYTES = env_int("DOCX_MAX_UPLOAD_BYTES", 4 * 1024 * 1024 * 1024) # 4 GB
+# Production server (waitress): address and request threads. Uploads only
+# store files, scanning runs on the job workers, so threads bound the number
+# of concurrent uploaders rather than scans.
+HOST = os.environ.get("DOCX_HOST", "127.0.0.1")
+PORT = env_int("DOCX_PORT", 5000)
+SERVER_THREADS = env_int("DOCX_SERVER_THREADS", 16)
+# waitress holds request bodies up to this size in memory and spools larger
+# ones to a temporary file before the app sees them; bounded by the number
+# of requests being received at once
+UPLOAD_MEMORY_BUFFER = env_int("DOCX_UPLOAD_MEMORY_BUFFER", 8 * 1024 * 1024)
+
+class UploadRequest(flask.Request):
+    """
+    Multipart file parts are parsed in fixed-size buffers and written, as
+    they arrive, to a temporary file inside the blob store (Werkzeug would
+    keep parts under 500 KB in memory). upload_chunk turns it into a blob
+    by renaming it, so an uploaded file is written to disk once and
+    concurrent uploads do not grow the process. Parts no handler stored are
+    removed when the request ends.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._blob_parts = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        f = get_blobs().temp_file()
+        self._blob_parts.append(f.name)
+        return f
+
+    def close(self):
+        super().close()
+        for path in self._blob_parts:
+            if os.path.exists(path):
+                os.remove(path)
 
-# Initialize Flask app
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = UploadRequest
 # Configure limits immediately
-app.config['MAX_CONTENT_LENGTH'] = 4 * 1024 * 1024 * 1024 # 4 GB
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 app.config['DATA_UPLOAD_MAX_NUMBER_FILES'] = 100000 # Unlimited logic might be flaky?
 app.config['DATA_UPLOAD_MAX_NUMBER_FIELDS'] = 100000 # Unlimited logic might be flaky?
-print(f"DEBUG STARTUP: MAX_CONTENT_LENGTH={app.config['MAX_CONTENT_LENGTH']}")
-print(f"DEBUG STARTUP: DATA_UPLOAD_MAX_NUMBER_FILES={app.config['DATA_UPLOAD_MAX_NUMBER_FILES']}")
 
 
 CORS(app) # Enable CORS for development (Vite runs on 5173, Flask on 5000)
 
-# Configuration
-# output root where report.json lives. 
-# Based on previous context: d:/thinksolv/tast1_fr/manual_output
-OUTPUT_ROOT = os.path.abspath(r"D:\thinksolv\tast1_fr\manual_output")
-REPORT_PATH = os.path.join(OUTPUT_ROOT, "report.json")
+# Only the job and upload plumbing is imported up front. The scanner, report
+# and archive modules are imported by the handlers that use them, so the
+# server starts (and a container becomes ready) without loading them.
+from docx_formula_mover.jobs import JobManager, QueueFull
+from docx_formula_mover.blobs import BlobStore, DIGEST_RE
 
-import sys
-# Add src directory to path so we can import docx_formula_mover as a package
-# Current file is in d:/thinksolv/tast1_fr/src/server.py
-# We want to import from d:/thinksolv/tast1_fr/src/docx_formula_mover
-# So we add d:/thinksolv/tast1_fr/src to sys.path
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Every upload session is a job with its own directory under OUTPUT_ROOT/jobs:
+# uploads/, formula_error/, no_error/ and its report files
+_JOBS = None
+_JOBS_LOCK = threading.Lock()
 
-import shutil
-# Import directly from the package
-from docx_formula_mover.scanner import DocxScanner
-from docx_formula_mover.utils import generate_reports
+def get_jobs():
+    """The job manager, started on first use (after OUTPUT_ROOT is final)."""
+    global _JOBS
+    with _JOBS_LOCK:
+        if _JOBS is None:
+            _JOBS = JobManager(os.path.join(OUTPUT_ROOT, "jobs"), run_scan_job, workers=JOB_WORKERS,
+                               max_queued=MAX_QUEUED_JOBS, feed_timeout=UPLOAD_IDLE_TIMEOUT)
+            _JOBS.start()
+        return _JOBS
 
-@app.route('/api/report', methods=['GET'])
-def get_report():
-    if not os.path.exists(REPORT_PATH):
-        # Return empty list instead of 404 if no report yet, or specific status
-        return jsonify([]) 
-        
-    try:
-        with open(REPORT_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify(data)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+def get_blobs():
+    """
+    Uploads are stored once per content under OUTPUT_ROOT/blobs and linked
+    into each job, so a file already on the server is never sent again.
+    """
+    return BlobStore(os.path.join(OUTPUT_ROOT, "blobs"))
 
-# State for async processing
-SCAN_STATE = {
-    "status": "idle", # idle, processing, completed, error
-    "progress": 0,
-    "total": 0,
-    "message": ""
-}
-SCAN_LOCK = threading.Lock()
-
-def update_state(status, progress=0, total=0, message=""):
-    with SCAN_LOCK:
-        SCAN_STATE["status"] = status
-        SCAN_STATE["progress"] = progress
-        if total > 0: SCAN_STATE["total"] = total
-        SCAN_STATE["message"] = message
-
-def run_scan_async(scan_files, error_dir, no_error_dir):
-    try:
-        scanner = DocxScanner()
-        scan_results = []
-        
-        # Import move_file from utils
-        from docx_formula_mover.utils import move_file
+def find_job(job_id):
+    return get_jobs().get(job_id) if job_id else None
+
+def job_required(job_id):
+    """
+    Looks up the job an endpoint acts on. Returns (job, None), or (None, error
+    response) when the ID is missing or unknown: endpoints that write, scan,
+    download or delete never fall back to another user's session.
+    """
+    if not job_id:
+        return None, (jsonify({"error": "Missing job ID, start a session first"}), 400)
+    job = find_job(job_id)
+    if job is None:
+        return None, (jsonify({"error": "Unknown job"}), 404)
+    return job, None
+
+def upload_path(upload_dir, name):
+    """
+    Where an upload called name is stored: inside upload_dir, subfolders
+    allowed. None for names that would land anywhere else (absolute paths,
+    .. components, symlinked folders pointing out).
+    """
+    if not name or "\0" in name:
+        return None
+    root = os.path.realpath(upload_dir)
+    real_path = os.path.realpath(os.path.join(root, name))
+    if real_path == root or os.path.commonpath([root, real_path]) != root:
+        return None
+    # Under upload_dir as given, like the paths list_uploads() finds
+    return os.path.normpath(os.path.join(upload_dir, name))
+
+def abandon_feed(job):
+    """
+    Called when storing an upload of a pipelined job failed: the upload is
+    marked complete so the scan finishes with the files it already has
+    instead of holding its worker until the feed times out.
+    """
+    if job is not None and job["options"].get("pipeline") and get_jobs().accepts_uploads(job):
+        get_jobs().close_feed(job["id"])
+
+def job_status(job):
+    return {"job_id": job["id"], "status": job["status"], "progress": job["progress"],
+            "total": job["total"], "message": job["message"], "uploaded": job.get("uploaded", 0)}
 
-        total = len(scan_files)
-        update_state("processing", 0, total, "Scanning...")
+def list_uploads(upload_dir, stats=None):
+    """Every uploaded file, whatever its name (non-.docx files are reported as skipped)."""
+    from docx_formula_mover.discovery import discover, keep_stats
+    candidates = discover(upload_dir, include=None, skip_hidden=False)
+    return list(keep_stats(candidates, {} if stats is None else stats))
 
-        for i, file_path in enumerate(scan_files):
-            # Update progress every file? Or every N?
-            update_state("processing", i, total, f"Scanning {i+1}/{total}")
+def unique_paths(paths, seen):
+    for path in paths:
+        if path not in seen:
+            seen.add(path)
+            yield path
+
+def run_scan_job(job, jobs):
+    """Scans a job's uploads into its directory; runs on a JobManager worker."""
+    from docx_formula_mover.scanner import DocxScanner
+    from docx_formula_mover.utils import ReportWriter, open_report_resume, place_file, report_entry
+    from docx_formula_mover.cache import ScanCache, DEFAULT_CACHE_NAME
+    from docx_formula_mover.report_index import ReportIndex, INDEX_NAME
+    from docx_formula_mover import parallel
+
+    job_id = job["id"]
+    job_dir = jobs.job_dir(job_id)
+    placement = job["options"].get("placement", "copy")
+    error_dir = os.path.join(job_dir, "formula_error")
+    no_error_dir = os.path.join(job_dir, "no_error")
+    # Pipelined jobs are scanned while they upload: files arrive through the
+    # job's feed, so on a first attempt none are taken from disk
+    pipelined = job_id in jobs.feeds
+    # Stat data from the listing, reused by the cache
+    stats = {}
+    if pipelined and job["attempts"] == 1:
+        scan_files = []
+    else:
+        scan_files = list_uploads(os.path.join(job_dir, "uploads"), stats)
+
+    if job["attempts"] > 1:
+        # Interrupted by a restart: keep the entries the last attempt finished
+        writer, done_paths = open_report_resume(job_dir, set(scan_files))
+        scan_files = [f for f in scan_files if f not in done_paths]
+        done = len(done_paths)
+    else:
+        writer = ReportWriter(job_dir)
+        done_paths = set()
+        done = 0
+    total = done + len(scan_files)
+    if pipelined:
+        # Files stored after a restart are on disk and may be fed as well
+        total = max(total, job["options"].get("total", 0))
+        scan_files = unique_paths(itertools.chain(scan_files, jobs.iter_feed(job_id)), done_paths)
+    jobs.update(job_id, progress=done, total=total, message="Scanning...")
+
+    # Queryable copy of the report for /api/report/<job>
+    index = ReportIndex(os.path.join(job_dir, INDEX_NAME))
+    index.clear()
+    if done:
+        index.add_report(job_dir)
+
+    # Re-uploaded documents are recognised by content hash and not scanned again
+    cache = ScanCache(os.path.join(OUTPUT_ROOT, DEFAULT_CACHE_NAME), DocxScanner().rules_signature())
+    scanned = done
+    try:
+        # Results go to the report as they are produced
+        for i, result in enumerate(parallel.scan_files(scan_files, cache=cache, stats=stats), done):
+            file_path = result.file_path
+            scanned = i + 1
+            # Throttled: no shared state is touched for most files
+            total = max(total, scanned)
+            jobs.progress(job_id, i, f"Scanning {i+1}/{total}")
             
             try:
-                result = scanner.scan_file(file_path)
                 # result is a ScanResult object, not a dict
                 dest_folder = error_dir if result.is_error else no_error_dir
                 
                 output_path = ""
+                used_placement = ""
                 if not result.skipped:
-                    output_path = move_file(file_path, dest_folder, dry_run=False)
+                    output_path, used_placement = place_file(file_path, dest_folder, placement)
                 else:
                     output_path = file_path 
                     
-                scan_results.append({
+                entry = report_entry({
                     "input_path": file_path,
                     "output_path": output_path,
                     "label": "formula_error" if result.is_error else ("skipped" if result.skipped else "no_error"),
                     "matches": result.matches,
-                    "skipped": result.skipped
+                    "skipped": result.skipped,
+                    "placement": used_placement,
+                    "truncated": result.truncated
                 })
+                writer.write(entry)
+                index.add(entry)
+                jobs.publish(job_id, "file", entry)
             except Exception as e:
                 print(f"Error scanning {file_path}: {e}")
                 # We should probably record error but continue?
                 # For now just continue
                 pass
+    finally:
+        cache.close()
+        writer.close()
+        index.close()
+    print(cache.summary())
+    jobs.update(job_id, progress=scanned, total=scanned, message=f"Done. {cache.summary()}")
 
-        generate_reports(scan_results, OUTPUT_ROOT)
-        update_state("completed", total, total, "Done")
-        
-    except Exception as e:
-        print(f"Scan failed: {e}")
-        update_state("error", 0, 0, str(e))
+# Query parameters of the report API; without any, the full report is returned
+REPORT_QUERY_PARAMS = ("page", "per_page", "after", "label", "source", "q", "sort", "order")
+
+def read_report(job_dir):
+    if not any(param in request.args for param in REPORT_QUERY_PARAMS):
+        # Full report, as before: sent from disk without parsing it
+        report_path = os.path.join(job_dir, "report.json")
+        if not os.path.exists(report_path):
+            # Return empty list instead of 404 if no report yet, or specific status
+            return jsonify([])
+        return flask.send_file(report_path, mimetype='application/json')
+    from docx_formula_mover.report_index import DEFAULT_PAGE_SIZE, open_index
+
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+        per_page = max(1, int(request.args.get("per_page", DEFAULT_PAGE_SIZE)))
+    except ValueError:
+        return jsonify({"error": "page and per_page must be integers"}), 400
+    index = open_index(job_dir)
+    try:
+        total, entries, cursor = index.query(
+            label=request.args.get("label"), source=request.args.get("source"),
+            name=request.args.get("q"), sort=request.args.get("sort", "order"),
+            descending=request.args.get("order") == "desc",
+            offset=(page - 1) * per_page, limit=per_page, after=request.args.get("after") or None)
+        summary = index.summary()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        index.close()
+    return jsonify({"total": total, "page": page, "per_page": per_page, "entries": entries,
+                    "next": cursor, "summary": summary})
+
+@app.route('/api/report', methods=['GET'])
+def get_report():
+    # Read-only legacy endpoint: the latest job, as before job IDs existed
+    job = get_jobs().latest()
+    if job is None:
+        return jsonify([])
+    return read_report(get_jobs().job_dir(job["id"]))
+
+@app.route('/api/report/<job_id>', methods=['GET'])
+def get_job_report(job_id):
+    """
+    Full report, or with any of page, per_page, label, source, q (file name
+    substring), sort (order, name, path, label, matches) and order (asc,
+    desc): one page of matching entries plus summary counts. "next" is the
+    cursor of the following page: pass it as after (with the same filters
+    and sort) to page through without the cost of skipping entries.
+    """
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return read_report(get_jobs().job_dir(job["id"]))
+
+@app.route('/api/report/<job_id>/summary', methods=['GET'])
+def get_job_summary(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    from docx_formula_mover.report_index import open_index
+    index = open_index(get_jobs().job_dir(job["id"]))
+    try:
+        return jsonify(index.summary())
+    finally:
+        index.close()
+
+@app.route('/api/report/<job_id>/export/<fmt>', methods=['GET'])
+def export_job_report(job_id, fmt):
+    # fmt: 'json' or 'csv'
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if fmt not in ("json", "csv"):
+        return jsonify({"error": "Invalid format. Use 'json' or 'csv'"}), 400
+    report_path = os.path.join(get_jobs().job_dir(job["id"]), f"report.{fmt}")
+    if not os.path.exists(report_path):
+        return jsonify({"error": "No report yet"}), 404
+    return flask.send_file(report_path, as_attachment=True, download_name=f"report_{job['id']}.{fmt}")
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    with SCAN_LOCK:
-        return jsonify(SCAN_STATE)
+    # Read-only legacy endpoint: the latest job, as before job IDs existed
+    job = get_jobs().latest()
+    if job is None:
+        return jsonify({"status": "idle", "progress": 0, "total": 0, "message": ""})
+    return jsonify(job_status(job))
+
+@app.route('/api/status/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job_status(job))
+
+# Seconds between keep-alive comments on an idle event stream
+EVENTS_KEEPALIVE = 15
+# Every event stream holds a request thread, so streams are bounded: one
+# ends after EVENTS_MAX_AGE seconds and the browser reconnects after
+# EVENTS_RETRY_MS (resuming from the job's current status), and at most
+# MAX_EVENT_STREAMS are open at once; further clients get a 503 and poll
+# /api/status instead
+EVENTS_MAX_AGE = env_int("DOCX_EVENTS_MAX_AGE", 300)
+EVENTS_RETRY_MS = 2000
+MAX_EVENT_STREAMS = env_int("DOCX_MAX_EVENT_STREAMS", max(1, SERVER_THREADS // 4))
+_EVENT_STREAMS = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+@app.route('/api/events/<job_id>', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-Sent Events for a job: "status" events (same fields as
+    /api/status/<job>) on every state change, throttled during a scan, and
+    a "file" event with the report entry of each classified file. The
+    stream ends after the job completes or fails, or after EVENTS_MAX_AGE
+    seconds, when the browser reconnects.
+    """
+    jobs = get_jobs()
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if not _EVENT_STREAMS.acquire(blocking=False):
+        return jsonify({"error": "Too many event streams, poll /api/status instead"}), 503
+    events = jobs.subscribe(job_id)
+
+    def stream():
+        deadline = time.monotonic() + EVENTS_MAX_AGE
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event, data = events.get(timeout=min(EVENTS_KEEPALIVE, remaining))
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event == "status":
+                data = job_status(data)
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            if event == "status" and data["status"] in ("completed", "error"):
+                return
+
+    def close():
+        # Also runs for a client that disconnects before the first event
+        jobs.unsubscribe(job_id, events)
+        _EVENT_STREAMS.release()
+
+    response = flask.Response(stream(), mimetype='text/event-stream',
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(close)
+    return response
 
 @app.route('/api/session/start', methods=['POST'])
 def start_session():
-    # Clear temp uploads for new session
-    print("DEBUG: Session Start - Clearing temp_uploads")
-    temp_dir = os.path.join(OUTPUT_ROOT, "temp_uploads")
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
-    os.makedirs(temp_dir)
-    return jsonify({"message": "Session started"})
+    # Each session gets its own job and upload directory.
+    # Optional JSON body: {"pipeline": true, "total": <file count>, "placement": ...}
+    # starts scanning while the files are still being uploaded.
+    options = request.get_json(silent=True) or {}
+    placement = options.get("placement", "copy")
+    from docx_formula_mover.utils import PLACEMENTS
+    if placement not in PLACEMENTS:
+        return jsonify({"error": f"Invalid placement. Use one of {', '.join(PLACEMENTS)}"}), 400
+    jobs = get_jobs()
+    if not options.get("pipeline"):
+        job = jobs.create()
+        print(f"DEBUG: Session Start - job {job['id']}")
+        return jsonify({"message": "Session started", "job_id": job["id"]})
+
+    try:
+        total = max(0, int(options.get("total", 0)))
+    except (TypeError, ValueError):
+        return jsonify({"error": "total must be an integer"}), 400
+    job = jobs.create(pipeline=True, total=total)
+    try:
+        jobs.submit(job["id"], placement=placement)
+    except QueueFull as e:
+        return jsonify({"error": str(e), "job_id": job["id"]}), 503
+    print(f"DEBUG: Session Start - pipelined job {job['id']}")
+    return jsonify({"message": "Session started, scanning as files arrive", "job_id": job["id"]})
 
 @app.route('/api/upload_chunk', methods=['POST'])
 def upload_chunk():
+    job = None
     try:
+        job, error = job_required(request.form.get("job"))
+        if error:
+            return error
+        jobs = get_jobs()
+        if not jobs.accepts_uploads(job):
+            return jsonify({"error": f"Job is {job['status']}"}), 409
+        pipelined = job["options"].get("pipeline")
         files = request.files.getlist("files")
         print(f"DEBUG: Chunk Received - {len(files)} files")
-        temp_dir = os.path.join(OUTPUT_ROOT, "temp_uploads")
+        temp_dir = os.path.join(get_jobs().job_dir(job["id"]), "uploads")
         if not os.path.exists(temp_dir):
              os.makedirs(temp_dir)
              
-        saved_count = 0
+        # Names come from the client: all are checked before any is stored
+        targets = []
         for file in files:
             if file.filename:
-                # Use secure_filename if possible, but keep simple for now
-                filename = file.filename
-                save_path = os.path.join(temp_dir, filename)
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                file.save(save_path)
-                saved_count += 1
+                save_path = upload_path(temp_dir, file.filename)
+                if save_path is None:
+                    return jsonify({"error": f"Invalid file name: {file.filename!r}"}), 400
+                targets.append((file, save_path))
+
+        blobs = get_blobs()
+        saved_count = 0
+        for file, save_path in targets:
+            blobs.link(blobs.put_file(file.stream), save_path)
+            saved_count += 1
+            if pipelined:
+                # Scanned as soon as it is on disk
+                jobs.feed(job["id"], save_path)
+        jobs.count_uploads(job["id"], saved_count)
         print(f"DEBUG: Chunk Saved - {saved_count} files saved")
-        return jsonify({"message": f"Chunk saved {saved_count} files", "count": saved_count})
+        return jsonify({"message": f"Chunk saved {saved_count} files", "count": saved_count, "job_id": job["id"]})
     except Exception as e:
         print(f"Chunk upload error: {e}")
+        abandon_feed(job)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/upload_check', methods=['POST'])
+def upload_check():
+    """
+    Takes {"job": ..., "files": [{"name": ..., "sha256": ...}, ...]} before a
+    chunk is sent. Files whose content the server already holds are added to
+    the job under their name without being transferred (their cached scan
+    result is reused too); the client only uploads the names in "missing".
+    """
+    job = None
+    try:
+        data = request.get_json(silent=True) or {}
+        job, error = job_required(data.get("job"))
+        if error:
+            return error
+        jobs = get_jobs()
+        if not jobs.accepts_uploads(job):
+            return jsonify({"error": f"Job is {job['status']}"}), 409
+        files = data.get("files")
+        if not isinstance(files, list):
+            return jsonify({"error": "Expected a list of files"}), 400
+        temp_dir = os.path.join(jobs.job_dir(job["id"]), "uploads")
+        entries = []
+        for item in files:
+            name = item.get("name") if isinstance(item, dict) else None
+            digest = str(item.get("sha256", "")).lower() if isinstance(name, str) else ""
+            save_path = upload_path(temp_dir, name) if digest else None
+            if not DIGEST_RE.match(digest) or save_path is None:
+                return jsonify({"error": f"Invalid file entry: {item!r}"}), 400
+            entries.append((name, digest, save_path))
+
+        blobs = get_blobs()
+        stored, missing = [], []
+        for name, digest, save_path in entries:
+            if not blobs.has(digest):
+                missing.append(name)
+                continue
+            blobs.link(digest, save_path)
+            stored.append(name)
+            if job["options"].get("pipeline"):
+                jobs.feed(job["id"], save_path)
+        jobs.count_uploads(job["id"], len(stored))
+        return jsonify({"stored": stored, "missing": missing, "job_id": job["id"]})
+    except Exception as e:
+        print(f"Upload check error: {e}")
+        abandon_feed(job)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/scan_start', methods=['POST'])
 def start_scan():
     print("DEBUG: Scan Start Request Received")
-    # Check if busy?
-    with SCAN_LOCK:
-        if SCAN_STATE["status"] == "processing":
-            return jsonify({"error": "Scan in progress"}), 409
-
-    temp_dir = os.path.join(OUTPUT_ROOT, "temp_uploads")
-    if not os.path.exists(temp_dir):
-        print("DEBUG: temp_uploads not found")
+    # JSON body: {"job": "<job id>", optional "placement": "copy" | "move" | "hardlink" | "reflink"}
+    options = request.get_json(silent=True) or {}
+    placement = options.get("placement", "copy")
+    from docx_formula_mover.utils import PLACEMENTS
+    if placement not in PLACEMENTS:
+        return jsonify({"error": f"Invalid placement. Use one of {', '.join(PLACEMENTS)}"}), 400
+    job, error = job_required(options.get("job"))
+    if error:
+        return error
+
+    jobs = get_jobs()
+    if job["options"].get("pipeline") and not job.get("upload_done"):
+        # Pipelined jobs are already scanning: this marks the upload complete
+        jobs.close_feed(job["id"])
+        if job["status"] != "uploading":
+            return jsonify({"message": "Upload complete, scan finishing.", "count": job.get("uploaded", 0),
+                            "job_id": job["id"]})
+        # Not submitted yet (the queue was full at session start): queue it now
+
+    upload_dir = os.path.join(jobs.job_dir(job["id"]), "uploads")
+    if not os.path.exists(upload_dir):
+        print("DEBUG: uploads not found")
         return jsonify({"error": "No files found to scan"}), 400
+    count = len(list_uploads(upload_dir))
+    print(f"DEBUG: Scan Start - Found {count} files for job {job['id']}")
 
-    # Ensure dest folders exist
-    error_dir = os.path.join(OUTPUT_ROOT, "formula_error")
-    no_error_dir = os.path.join(OUTPUT_ROOT, "no_error")
-    os.makedirs(error_dir, exist_ok=True)
-    os.makedirs(no_error_dir, exist_ok=True)
-            
-    # Prepare file list for scanner
-    scan_files = []
-    for root, dirs, files_in_dir in os.walk(temp_dir):
-        for name in files_in_dir:
-            scan_files.append(os.path.join(root, name))
-            
-    print(f"DEBUG: Scan Start - Found {len(scan_files)} files in temp_uploads")
-    
-    # Spawn Thread
-    thread = threading.Thread(target=run_scan_async, args=(scan_files, error_dir, no_error_dir))
-    thread.start()
+    try:
+        jobs.submit(job["id"], placement=placement)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
     
-    return jsonify({"message": f"Scanning {len(scan_files)} files started.", "count": len(scan_files)})
+    return jsonify({"message": f"Scanning {count} files queued.", "count": count, "job_id": job["id"]})
 
 
 # Deprecated legacy upload (kept for compatibility or removal)
@@ -215,28 +587,44 @@ def handle_exception(e):
 
 @app.route('/api/download/<type>', methods=['GET'])
 def download_zip(type):
-    # type: 'error' or 'clean'
+    """
+    Streams a zip of a job's files as it is built. type: 'error' or 'clean';
+    ?job=<id>. Optional source (match part, e.g. word/footnotes.xml) and q
+    (file name substring) narrow it to the matching report entries.
+    """
+    from docx_formula_mover.archive import stream_zip, folder_members
+    from docx_formula_mover.report_index import open_index
+    job, error = job_required(request.args.get("job"))
+    if error:
+        return error
+    job_dir = get_jobs().job_dir(job["id"])
     if type == 'error':
-        source_dir = os.path.join(OUTPUT_ROOT, "formula_error")
+        source_dir = os.path.join(job_dir, "formula_error")
+        label = "formula_error"
         filename = "formula_errors"
     elif type == 'clean':
-        source_dir = os.path.join(OUTPUT_ROOT, "no_error")
+        source_dir = os.path.join(job_dir, "no_error")
+        label = "no_error"
         filename = "clean_files"
     else:
         return jsonify({"error": "Invalid type"}), 400
-        
-    if not os.path.exists(source_dir):
-        os.makedirs(source_dir) # Ensure it exists so we return empty zip if needed? Or error?
-        # Better to return empty zip or handle gracefully.
-        
-    # Create zip in memory or temp
-    shutil.make_archive(os.path.join(OUTPUT_ROOT, filename), 'zip', source_dir)
-    zip_path = os.path.join(OUTPUT_ROOT, f"{filename}.zip")
-    
-    try:
-        return flask.send_file(zip_path, as_attachment=True)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+
+    source = request.args.get("source")
+    name = request.args.get("q")
+    if source or name:
+        index = open_index(job_dir)
+        try:
+            paths = list(index.output_paths(label=label, source=source, name=name))
+        finally:
+            index.close()
+        # Only files still in the folder (not cleared since)
+        members = [(os.path.basename(p), p) for p in paths
+                   if os.path.dirname(p) == source_dir and os.path.isfile(p)]
+    else:
+        members = list(folder_members(source_dir))
+
+    return flask.Response(stream_zip(members), mimetype='application/zip',
+                          headers={"Content-Disposition": f'attachment; filename="{filename}.zip"'})
 
 @app.route('/api/clear', methods=['POST'])
 def clear_files():
@@ -244,12 +632,16 @@ def clear_files():
     if not data:
         return jsonify({"error": "Invalid JSON"}), 400
     clear_type = data.get('type') # 'error' or 'clean'
+    job, error = job_required(data.get('job'))
+    if error:
+        return error
+    job_dir = get_jobs().job_dir(job["id"])
     
     target_folder = ""
     if clear_type == 'error':
-        target_folder = os.path.join(OUTPUT_ROOT, "formula_error")
+        target_folder = os.path.join(job_dir, "formula_error")
     elif clear_type == 'clean':
-        target_folder = os.path.join(OUTPUT_ROOT, "no_error")
+        target_folder = os.path.join(job_dir, "no_error")
     else:
         return jsonify({"error": "Invalid type. Use 'error' or 'clean'"}), 400
         
@@ -267,6 +659,35 @@ def clear_files():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def serve(dev=False, host=HOST, port=PORT, threads=SERVER_THREADS):
+    """
+    Runs the server. Production uses waitress: a single process (the job
+    queue and event subscribers live in it) with a pool of request threads,
+    request bodies buffered to disk past UPLOAD_MEMORY_BUFFER and at most
+    MAX_UPLOAD_BYTES per request. dev runs the Werkzeug debug server.
+    """
+    print(f"Serving jobs from: {os.path.join(OUTPUT_ROOT, 'jobs')}")
+    if dev:
+        app.run(host=host, port=port, debug=True)
+        return
+    try:
+        import waitress
+    except ImportError:
+        raise SystemExit("Production mode needs waitress (pip install waitress); use --dev for the debug server")
+    get_jobs()
+    waitress.serve(app, host=host, port=port, threads=threads,
+                   max_request_body_size=MAX_UPLOAD_BYTES, inbuf_overflow=UPLOAD_MEMORY_BUFFER,
+                   channel_timeout=300)
+
+def main():
+    parser = argparse.ArgumentParser(description="Web server for the DOCX formula scanner.")
+    parser.add_argument("--dev", action="store_true", help="Run the Werkzeug debug server instead of waitress")
+    parser.add_argument("--host", default=HOST, help="Address to listen on (DOCX_HOST)")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on (DOCX_PORT)")
+    parser.add_argument("--threads", type=int, default=SERVER_THREADS,
+                        help="Request threads in production mode (DOCX_SERVER_THREADS)")
+    args = parser.parse_args()
+    serve(dev=args.dev, host=args.host, port=args.port, threads=args.threads)
+
 if __name__ == '__main__':
-    print(f"Serving report from: {REPORT_PATH}")
-    app.run(port=5000, debug=True)
+    main()
@@ -3,7 +3,7 @@ echo Starting Docx Formula Mover...
 
 :: Start Backend
 echo Starting Backend Server...
-start "Docx Backend" cmd /k "python src/server.py"
+start "Docx Backend" cmd /k "python src/server.py --dev"
 
 :: Start Frontend
 echo Starting Frontend...
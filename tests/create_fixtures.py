@@ -1,5 +1,6 @@
 import docx
 import os
+import sys
 
 def create_fixtures(output_dir):
     if not os.path.exists(output_dir):
@@ -44,4 +45,5 @@ def create_fixtures(output_dir):
         f.write("I am not a docx")
 
 if __name__ == "__main__":
-    create_fixtures("d:/thinksolv/tast1_fr/fixtures")
+    # Optional output directory; defaults to the original fixtures location
+    create_fixtures(sys.argv[1] if len(sys.argv) > 1 else "d:/thinksolv/tast1_fr/fixtures")
@@ -1,13 +1,46 @@
+import argparse
+import csv
 import unittest
+import io
+import json
+import mmap
+import multiprocessing
 import os
+import pickle
+import random
+import re
 import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
 import tempfile
-from src.docx_formula_mover.scanner import DocxScanner, ScanResult
-from src.docx_formula_mover import cli
+import threading
+import time
+import zipfile
+from src.docx_formula_mover.scanner import DocxScanner, ScanResult, ENGINES, PROFILE_FIELDS, may_contain_match
+from src.docx_formula_mover import archive, cli, discovery, parallel, utils, watch
+from src.docx_formula_mover.blobs import BlobStore
+from src.docx_formula_mover.detector import DETECTOR, Match
+from src.docx_formula_mover.cache import file_digest
+from src.docx_formula_mover.cache import ScanCache
+from src.docx_formula_mover.jobs import JobManager, QueueFull
+from src.docx_formula_mover.report_index import open_index
 from unittest.mock import patch, MagicMock
+from benchmarks import corpus
 
-# We will run tests against the fixtures generated in d:/thinksolv/tast1_fr/fixtures
-FIXTURES_DIR = "d:/thinksolv/tast1_fr/fixtures"
+from tests.create_fixtures import create_fixtures
+
+# Fixtures are generated into a temporary directory for the test run
+FIXTURES_DIR = None
+
+def setUpModule():
+    global FIXTURES_DIR
+    FIXTURES_DIR = tempfile.mkdtemp()
+    create_fixtures(FIXTURES_DIR)
+
+def tearDownModule():
+    shutil.rmtree(FIXTURES_DIR)
 
 class TestDocxScanner(unittest.TestCase):
     def setUp(self):
@@ -50,7 +83,615 @@ class TestDocxScanner(unittest.TestCase):
         res = self.scanner.scan_file(os.path.join(FIXTURES_DIR, "not_a_docx.txt"))
         self.assertTrue(res.skipped)
 
+    def test_stream_engine_matches_dom(self):
+        stream_scanner = DocxScanner(engine='stream')
+        for name in ["has_display_math.docx", "escaped_dollar.docx", "inline_math_only.docx",
+                     "split_runs_display.docx", "no_math.docx"]:
+            path = os.path.join(FIXTURES_DIR, name)
+            dom_res = self.scanner.scan_file(path)
+            stream_res = stream_scanner.scan_file(path)
+            self.assertEqual(stream_res.is_error, dom_res.is_error)
+            self.assertEqual(stream_res.matches, dom_res.matches)
+
+    def test_stream_engine_nested_paragraphs(self):
+        # Text box paragraphs nested inside a run, as Word writes them
+        xml = (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+            '<w:p><w:r><w:t>$$a</w:t><w:txbxContent><w:p><w:r><w:t>$$x$$</w:t></w:r></w:p></w:txbxContent>'
+            '<w:t>b$$</w:t></w:r></w:p>'
+            '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>$</w:t></w:r><w:r><w:t>$1$$</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+            '</w:body></w:document>'
+        ).encode('utf-8')
+        dom_matches = self.scanner._scan_xml_content(xml, "word/document.xml")
+        stream_matches = DocxScanner(engine='stream')._scan_xml_stream(io.BytesIO(xml), "word/document.xml")
+        self.assertTrue(dom_matches)
+        self.assertEqual(stream_matches, dom_matches)
+
+    def test_prefilter_counts(self):
+        res = self.scanner.scan_file(os.path.join(FIXTURES_DIR, "no_math.docx"))
+        self.assertGreater(res.parts_scanned, 0)
+        self.assertEqual(res.parts_prefiltered, res.parts_scanned)
+        # $ split across runs must still be parsed
+        res = self.scanner.scan_file(os.path.join(FIXTURES_DIR, "split_runs_display.docx"))
+        self.assertTrue(res.is_error)
+        self.assertLess(res.parts_prefiltered, res.parts_scanned)
+
+    def test_may_contain_match(self):
+        self.assertFalse(may_contain_match([b'<w:t>costs $5 or $6</w:t>']))
+        self.assertTrue(may_contain_match([b'<w:r><w:t>$</w:t></w:r><w:r><w:t>$</w:t></w:r>', b'<w:t>$$</w:t>']))
+        # Character references and UTF-16 parts cannot be ruled out from bytes
+        self.assertTrue(may_contain_match([b'<w:t>&#36;&#36;x&#36;&#36;</w:t>']))
+        self.assertTrue(may_contain_match([b'<w:t>&', b'#x24;</w:t>']))
+        self.assertTrue(may_contain_match(['<w:t>x</w:t>'.encode('utf-16')]))
+
+    def test_classify_only_stops_at_first_match(self):
+        xml = ('<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+               + '<w:p><w:r><w:t>$$a$$ $$b$$</w:t></w:r></w:p>' * 3
+               + '</w:body></w:document>').encode('utf-8')
+        self.assertEqual(len(self.scanner._scan_xml_content(xml, "word/document.xml")), 6)
+        self.assertEqual(len(self.scanner._scan_xml_content(xml, "word/document.xml", limit=3)), 3)
+        self.assertEqual(len(self.scanner._scan_xml_stream(io.BytesIO(xml), "word/document.xml", limit=1)), 1)
+
+        for engine in ENGINES:
+            res = DocxScanner(engine=engine, classify_only=True).scan_file(
+                os.path.join(FIXTURES_DIR, "split_runs_display.docx"))
+            self.assertTrue(res.is_error)
+            # Classify-only does not look past the first match
+            self.assertFalse(res.truncated)
+            self.assertEqual(len(res.matches), 1)
+            self.assertEqual(res.matches[0]["source"], "word/document.xml")
+
+        res = DocxScanner(classify_only=True).scan_file(os.path.join(FIXTURES_DIR, "no_math.docx"))
+        self.assertFalse(res.is_error)
+        self.assertFalse(res.truncated)
+
+    def test_truncated_only_past_the_cap(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as zf:
+            zf.writestr("word/document.xml",
+                        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+                        + '<w:p><w:r><w:t>$$a$$</w:t></w:r></w:p>' * 3 + '</w:body></w:document>')
+        for engine in ENGINES:
+            exact = DocxScanner(engine=engine, max_matches=3).scan_bytes(buf.getvalue(), "a.docx")
+            self.assertEqual((len(exact.matches), exact.truncated), (3, False))
+            capped = DocxScanner(engine=engine, max_matches=2).scan_bytes(buf.getvalue(), "a.docx")
+            self.assertEqual((len(capped.matches), capped.truncated), (2, True))
+
+        tmp = tempfile.mkdtemp()
+        try:
+            cache = ScanCache(os.path.join(tmp, "cache.sqlite"), "rules-1")
+            cache.store("0" * 64, capped)
+            self.assertTrue(cache.get("0" * 64, "a.docx").truncated)
+            cache.close()
+        finally:
+            shutil.rmtree(tmp)
+        item = {"input_path": "a.docx", "output_path": "", "label": "formula_error", "matches": capped.matches,
+                "skipped": False, "truncated": capped.truncated}
+        self.assertTrue(utils.report_entry(item)["truncated"])
+        self.assertNotIn("truncated", utils.report_entry(dict(item, truncated=False)))
+
+    def test_rules_signature_tracks_match_cap(self):
+        signatures = {DocxScanner().rules_signature(), DocxScanner(classify_only=True).rules_signature(),
+                      DocxScanner(max_matches=5).rules_signature()}
+        self.assertEqual(len(signatures), 3)
+        self.assertEqual(DocxScanner(engine='stream', prefilter=False).rules_signature(),
+                         DocxScanner().rules_signature())
+
+    def test_profile(self):
+        path = os.path.join(FIXTURES_DIR, "split_runs_display.docx")
+        self.assertIsNone(self.scanner.scan_file(path).profile)
+        for engine in ENGINES:
+            res = DocxScanner(engine=engine, profile=True).scan_file(path)
+            self.assertEqual(set(res.profile), set(PROFILE_FIELDS))
+            self.assertTrue(res.is_error)
+            self.assertEqual(res.profile["parts_scanned"], res.parts_scanned)
+            self.assertGreater(res.profile["paragraphs"], 0)
+            self.assertGreater(res.profile["runs"], 0)
+            self.assertGreater(res.profile["bytes_decompressed"], 0)
+            self.assertGreaterEqual(res.profile["total_s"], res.profile["match_s"])
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            DocxScanner(engine='sax')
+
+def _crash_on_split_runs(self, file_path):
+    if "split_runs" in file_path:
+        os._exit(1)
+    return _original_scan_file(self, file_path)
+
+_original_scan_file = DocxScanner.scan_file
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.paths = [os.path.join(FIXTURES_DIR, name) for name in
+                      ["has_display_math.docx", "no_math.docx", "split_runs_display.docx",
+                       "not_a_docx.txt", "escaped_dollar.docx", "inline_math_only.docx"]]
+
+    def test_parallel_matches_sequential_order(self):
+        sequential = list(parallel.scan_files(self.paths, workers=1))
+        pooled = list(parallel.scan_files(self.paths, workers=2))
+        self.assertEqual([r.file_path for r in pooled], self.paths)
+        self.assertEqual([(r.is_error, r.skipped, r.matches) for r in pooled],
+                         [(r.is_error, r.skipped, r.matches) for r in sequential])
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), "needs fork to patch workers")
+    def test_worker_crash_skips_only_that_file(self):
+        with patch.object(DocxScanner, 'scan_file', _crash_on_split_runs):
+            results = list(parallel.scan_files(self.paths, workers=2,
+                                               mp_context=multiprocessing.get_context('fork')))
+        self.assertEqual([r.file_path for r in results], self.paths)
+        by_name = {os.path.basename(r.file_path): r for r in results}
+        self.assertTrue(by_name["split_runs_display.docx"].skipped)
+        self.assertTrue(by_name["has_display_math.docx"].is_error)
+        self.assertFalse(by_name["no_math.docx"].skipped)
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), "needs fork to inherit handlers")
+    def test_workers_do_not_inherit_signal_handlers(self):
+        # As installed by the watch command before its pool starts
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: None)
+        try:
+            executor = parallel._new_pool(1, {}, multiprocessing.get_context('fork'))
+            try:
+                handlers = executor.submit(_signal_handlers).result()
+            finally:
+                executor.shutdown()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        self.assertEqual(handlers, (signal.SIG_DFL, signal.SIG_IGN))
+
+def _signal_handlers():
+    return signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+
+class TestInMemoryScan(unittest.TestCase):
+    NAMES = ["has_display_math.docx", "escaped_dollar.docx", "split_runs_display.docx", "no_math.docx"]
+
+    def test_scan_bytes_and_fileobj(self):
+        scanner = DocxScanner()
+        for name in self.NAMES:
+            path = os.path.join(FIXTURES_DIR, name)
+            expected = scanner.scan_file(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    results = [scanner.scan_bytes(data, name), scanner.scan_bytes(bytearray(data), name),
+                               scanner.scan_bytes(memoryview(data), name), scanner.scan_bytes(mapped, name)]
+                f.seek(0)
+                results.append(scanner.scan_fileobj(f, name))
+            # Non-seekable streams are read into memory
+            stream = io.BufferedReader(io.BytesIO(data))
+            stream.seekable = lambda: False
+            results.append(scanner.scan_fileobj(stream, name))
+            for result in results:
+                self.assertEqual((result.file_path, result.is_error, result.matches), (name, expected.is_error, expected.matches))
+        self.assertTrue(scanner.scan_bytes(b"not a zip").skipped)
+
+    def test_scan_many_yields_every_item(self):
+        items = [os.path.join(FIXTURES_DIR, name) for name in self.NAMES]
+        with open(items[0], 'rb') as f:
+            items += [("in-memory.docx", f.read()), ("broken.docx", memoryview(b"PK not really"))]
+        expected = {"has_display_math.docx": True, "escaped_dollar.docx": False, "split_runs_display.docx": True,
+                    "no_math.docx": False, "in-memory.docx": True}
+        for workers in (1, 2):
+            results = list(parallel.scan_many(iter(items), workers=workers))
+            self.assertEqual(len(results), len(items))
+            by_name = {os.path.basename(r.file_path): r for r in results}
+            self.assertTrue(by_name.pop("broken.docx").skipped)
+            self.assertEqual({name: r.is_error for name, r in by_name.items()}, expected)
+
+class TestScanCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.doc = os.path.join(self.tmp, "has_display_math.docx")
+        shutil.copy2(os.path.join(FIXTURES_DIR, "has_display_math.docx"), self.doc)
+        self.cache_path = os.path.join(self.tmp, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def scan(self, rules="rules-1", **kwargs):
+        cache = ScanCache(self.cache_path, rules, **kwargs)
+        results = list(parallel.scan_files([self.doc], cache=cache))
+        cache.close()
+        return cache, results[0]
+
+    def test_warm_scan_hits(self):
+        cache, cold = self.scan()
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        cache, warm = self.scan()
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(warm.file_path, self.doc)
+        self.assertEqual(warm.matches, cold.matches)
+        self.assertTrue(warm.is_error)
+
+    def test_touched_file_hits_by_hash(self):
+        self.scan()
+        st = os.stat(self.doc)
+        os.utime(self.doc, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        cache, _ = self.scan()
+        self.assertEqual(cache.hits, 1)
+
+    def test_workers_hash_and_hit_by_content(self):
+        copy = os.path.join(self.tmp, "copy.docx")
+        shutil.copy2(self.doc, copy)
+        cache = ScanCache(self.cache_path, "rules-1")
+        list(parallel.scan_files([self.doc], workers=2, cache=cache))
+        cache.close()
+        # A copy has no stat record: the worker hashes it and finds the content cached
+        cache = ScanCache(self.cache_path, "rules-1")
+        results = list(parallel.scan_files([self.doc, copy], workers=2, cache=cache))
+        cache.close()
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+        self.assertEqual([r.file_path for r in results], [self.doc, copy])
+        self.assertEqual(results[1].matches, results[0].matches)
+
+    def test_failed_scans_are_not_cached(self):
+        cache = ScanCache(self.cache_path, "rules-1")
+        with patch.object(DocxScanner, '_scan_xml_content', side_effect=MemoryError("transient")):
+            failed = list(parallel.scan_files([self.doc], cache=cache))[0]
+        self.assertTrue(failed.skipped)
+        self.assertEqual(failed.error, "transient")
+        result = list(parallel.scan_files([self.doc], cache=cache))[0]
+        cache.close()
+        self.assertTrue(result.is_error)
+        self.assertEqual(cache.hits, 0)
+
+    def test_concurrent_instances_share_the_file(self):
+        result = ScanResult("x.docx", True, [Match("$$a$$", 0, 0, "word/document.xml")])
+        first = ScanCache(self.cache_path, "rules-1")
+        second = ScanCache(self.cache_path, "rules-1")
+        # Buffered writes hold no lock, so neither instance blocks the other
+        first.store("1" * 64, result)
+        second.store("2" * 64, result)
+        second.flush()
+        first.flush()
+        self.assertIsNotNone(second.get("1" * 64, "x.docx"))
+
+        with patch("src.docx_formula_mover.cache.LOCK_TIMEOUT", 0.1):
+            third = ScanCache(self.cache_path, "rules-1")
+        blocker = sqlite3.connect(self.cache_path)
+        blocker.execute("BEGIN IMMEDIATE")
+        try:
+            # A locked database costs the cache writes, not the scan
+            third.store("3" * 64, result)
+            third.flush()
+            self.assertIsNotNone(third.get("2" * 64, "x.docx"))
+        finally:
+            blocker.rollback()
+            blocker.close()
+        self.assertIsNone(third.get("3" * 64, "x.docx"))
+        for cache in (first, second, third):
+            cache.close()
+
+    def test_rules_change_invalidates(self):
+        self.scan()
+        cache, _ = self.scan(rules="rules-2")
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_eviction(self):
+        cache = ScanCache(self.cache_path, "rules-1", max_bytes=200)
+        for i in range(10):
+            cache.store(f"{i:064x}", ScanResult("x.docx", True, [{"text": "$$a$$", "paragraph_index": i, "offset": 0, "source": "word/document.xml"}]))
+        cache.evict()
+        self.assertIsNone(cache.get(f"{0:064x}", "x.docx"))
+        self.assertIsNotNone(cache.get(f"{9:064x}", "x.docx"))
+        cache.close()
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.ran = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_job(self, job, manager):
+        self.ran.append((job["id"], job["attempts"], job["options"]))
+
+    def test_queued_jobs_survive_restart(self):
+        # Never started: stands in for a server stopped before its workers ran
+        first = JobManager(self.tmp, self.run_job)
+        a = first.create()["id"]
+        b = first.create()["id"]
+        first.submit(a, placement="move")
+        first.submit(b)
+        with self.assertRaises(ValueError):
+            first.submit(a)
+
+        second = JobManager(self.tmp, self.run_job, workers=1)
+        second.start()
+        second.stop()
+        self.assertEqual(self.ran, [(a, 1, {"placement": "move"}), (b, 1, {})])
+        self.assertEqual(JobManager(self.tmp, self.run_job)._load(a)["status"], "completed")
+
+    def test_failed_job_and_full_queue(self):
+        manager = JobManager(self.tmp, lambda job, manager: 1 / 0, max_queued=1)
+        a = manager.create()["id"]
+        b = manager.create()["id"]
+        manager.submit(a)
+        with self.assertRaises(QueueFull):
+            manager.submit(b)
+        self.assertEqual(manager.get(b)["status"], "uploading")
+        manager.start()
+        manager.stop()
+        self.assertEqual(manager.get(a)["status"], "error")
+        self.assertEqual(manager.latest()["id"], b)
+
+    def test_pipelined_job_scans_fed_files(self):
+        seen = []
+        manager = JobManager(self.tmp, lambda job, m: seen.extend(m.iter_feed(job["id"])), workers=1)
+        job_id = manager.create(pipeline=True)["id"]
+        manager.submit(job_id)
+        manager.start()
+        manager.feed(job_id, "a.docx")
+        self.assertTrue(manager.accepts_uploads(manager.get(job_id)))
+        manager.feed(job_id, "b.docx")
+        manager.close_feed(job_id)
+        manager.stop()
+        self.assertEqual(seen, ["a.docx", "b.docx"])
+        job = manager.get(job_id)
+        self.assertEqual(job["status"], "completed")
+        self.assertFalse(manager.accepts_uploads(job))
+
+    def test_abandoned_pipelined_job_frees_its_worker(self):
+        seen = []
+        manager = JobManager(self.tmp, lambda job, m: seen.extend(m.iter_feed(job["id"])), workers=1,
+                             feed_timeout=0.1)
+        abandoned = manager.create(pipeline=True)["id"]
+        manager.submit(abandoned)
+        manager.feed(abandoned, "a.docx")
+        manager.start()
+        # Queued behind the abandoned upload on the only worker
+        other = manager.create(pipeline=True)["id"]
+        manager.submit(other)
+        manager.close_feed(other)
+        manager.stop()
+        job = manager.get(abandoned)
+        self.assertEqual(job["status"], "error")
+        self.assertIn("abandoned", job["message"])
+        self.assertFalse(manager.accepts_uploads(job))
+        manager.feed(abandoned, "b.docx")
+        self.assertEqual(seen, ["a.docx"])
+        self.assertEqual(manager.get(other)["status"], "completed")
+
+    def test_subscribers_get_throttled_progress_and_files(self):
+        manager = JobManager(self.tmp, self.run_job)
+        job_id = manager.create()["id"]
+        events = manager.subscribe(job_id)
+        for i in range(100):
+            manager.progress(job_id, i)
+        manager.publish(job_id, "file", {"input_path": "a.docx"})
+        manager.unsubscribe(job_id, events)
+        manager.publish(job_id, "file", {"input_path": "b.docx"})
+
+        received = []
+        while not events.empty():
+            received.append(events.get_nowait())
+        self.assertEqual([event for event, _ in received], ["status", "status", "file"])
+        self.assertEqual(received[1][1]["progress"], 0)
+        self.assertEqual(manager.subscribers, {})
+
+    def test_full_subscriber_queue_still_gets_the_final_status(self):
+        manager = JobManager(self.tmp, self.run_job)
+        job_id = manager.create()["id"]
+        with patch("src.docx_formula_mover.jobs.SUBSCRIBER_BUFFER", 3):
+            events = manager.subscribe(job_id)
+        for i in range(5):
+            manager.publish(job_id, "file", {"input_path": f"{i}.docx"})
+        manager.update(job_id, status="completed")
+
+        received = []
+        while not events.empty():
+            received.append(events.get_nowait())
+        self.assertEqual([event for event, _ in received], ["file", "file", "status"])
+        self.assertEqual(received[-1][1]["status"], "completed")
+
+class TestServerRoutes(unittest.TestCase):
+    """The web API through Flask's test client, with OUTPUT_ROOT in a temporary directory."""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            import flask  # noqa: F401
+        except ImportError:
+            raise unittest.SkipTest("flask is not installed")
+        src_dir = os.path.join(REPO_ROOT, "src")
+        if src_dir not in sys.path:
+            sys.path.insert(0, src_dir)
+        import server
+        cls.server = server
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for name, value in (("OUTPUT_ROOT", self.tmp), ("_JOBS", None)):
+            patcher = patch.object(self.server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = self.server.app.test_client()
+        self.docs = sorted(f for f in os.listdir(FIXTURES_DIR) if f.endswith(".docx"))
+
+    def tearDown(self):
+        if self.server._JOBS is not None:
+            self.server._JOBS.stop()
+        shutil.rmtree(self.tmp)
+
+    def start_session(self, **options):
+        response = self.client.post('/api/session/start', json=options)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()["job_id"]
+
+    def upload(self, job_id, names):
+        files = []
+        for name in names:
+            with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+                files.append((io.BytesIO(f.read()), name))
+        return self.client.post('/api/upload_chunk', data={"job": job_id, "files": files},
+                                content_type='multipart/form-data')
+
+    def wait(self, job_id, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = self.client.get(f'/api/status/{job_id}').get_json()
+            if status["status"] in ("completed", "error"):
+                return status
+            time.sleep(0.05)
+        self.fail(f"Job {job_id} did not finish")
+
+    def test_concurrent_jobs_share_the_cache(self):
+        job_ids = [self.start_session() for _ in range(2)]
+        for job_id in job_ids:
+            self.assertEqual(self.upload(job_id, self.docs).get_json()["count"], len(self.docs))
+        for job_id in job_ids:
+            self.assertEqual(self.client.post('/api/scan_start', json={"job": job_id}).status_code, 200)
+        for job_id in job_ids:
+            self.assertEqual(self.wait(job_id)["status"], "completed")
+            report = self.client.get(f'/api/report/{job_id}').get_json()
+            self.assertEqual(sorted(os.path.basename(e["input_path"]) for e in report), self.docs)
+        # Both scans stored into the same cache; a third job only reads it
+        third = self.start_session()
+        self.upload(third, self.docs)
+        self.client.post('/api/scan_start', json={"job": third})
+        self.assertIn(f"{len(self.docs)} hits", self.wait(third)["message"])
+
+    def test_report_pages(self):
+        job_id = self.start_session()
+        self.upload(job_id, self.docs)
+        self.client.post('/api/scan_start', json={"job": job_id})
+        self.wait(job_id)
+        url = f'/api/report/{job_id}'
+        first = self.client.get(url, query_string={"per_page": 2, "sort": "name"}).get_json()
+        self.assertEqual(first["total"], len(self.docs))
+        self.assertEqual(first["summary"]["total"], len(self.docs))
+        by_offset = self.client.get(url, query_string={"page": 2, "per_page": 2, "sort": "name"}).get_json()
+        by_cursor = self.client.get(url, query_string={"per_page": 2, "sort": "name",
+                                                       "after": first["next"]}).get_json()
+        self.assertEqual(by_cursor["entries"], by_offset["entries"])
+        self.assertEqual([os.path.basename(e["input_path"]) for e in first["entries"] + by_cursor["entries"]],
+                         self.docs[:4])
+        self.assertEqual(self.client.get(url, query_string={"after": "x"}).status_code, 400)
+
+    def test_download_streams_the_placed_files(self):
+        job_id = self.start_session()
+        self.upload(job_id, self.docs)
+        self.client.post('/api/scan_start', json={"job": job_id})
+        self.wait(job_id)
+        report = self.client.get(f'/api/report/{job_id}').get_json()
+        errors = sorted(os.path.basename(e["output_path"]) for e in report if e["label"] == "formula_error")
+        self.assertTrue(errors)
+
+        response = self.client.get('/api/download/error', query_string={"job": job_id})
+        self.assertEqual(response.mimetype, 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(response.get_data())) as zf:
+            self.assertEqual(sorted(zf.namelist()), errors)
+        # Narrowed to the entries the report filter matches
+        response = self.client.get('/api/download/error', query_string={"job": job_id, "q": errors[0]})
+        with zipfile.ZipFile(io.BytesIO(response.get_data())) as zf:
+            self.assertEqual(zf.namelist(), [errors[0]])
+        self.assertEqual(self.client.get('/api/download/other', query_string={"job": job_id}).status_code, 400)
+        self.assertEqual(self.client.get('/api/download/error').status_code, 400)
+
+    def test_pipelined_upload(self):
+        job_id = self.start_session(pipeline=True, total=len(self.docs))
+        self.upload(job_id, self.docs[:2])
+        self.upload(job_id, self.docs[2:])
+        response = self.client.post('/api/scan_start', json={"job": job_id})
+        self.assertIn("scan finishing", response.get_json()["message"])
+        self.assertEqual(self.wait(job_id)["status"], "completed")
+        report = self.client.get(f'/api/report/{job_id}').get_json()
+        self.assertEqual(sorted(os.path.basename(e["input_path"]) for e in report), self.docs)
+        self.assertEqual(self.upload(job_id, self.docs[:1]).status_code, 409)
+
+    def test_failed_upload_finishes_the_pipelined_scan(self):
+        job_id = self.start_session(pipeline=True)
+        self.upload(job_id, self.docs[:1])
+        with patch.object(self.server.BlobStore, "put_file", side_effect=OSError("No space left on device")):
+            self.assertEqual(self.upload(job_id, self.docs[1:]).status_code, 500)
+        # Scanned with what was stored, without waiting for the feed to time out
+        self.assertEqual(self.wait(job_id, timeout=10)["status"], "completed")
+        self.assertEqual(len(self.client.get(f'/api/report/{job_id}').get_json()), 1)
+
+    def test_upload_names_stay_in_the_job(self):
+        job_id = self.start_session()
+        uploads = os.path.join(self.tmp, "jobs", job_id, "uploads")
+        with open(os.path.join(FIXTURES_DIR, self.docs[0]), 'rb') as f:
+            data = f.read()
+
+        def post(name):
+            return self.client.post('/api/upload_chunk', data={"job": job_id, "files": [(io.BytesIO(data), name)]},
+                                    content_type='multipart/form-data')
+
+        for name in ("../../escape.docx", "/tmp/escape.docx", "sub/../../escape.docx"):
+            self.assertEqual(post(name).status_code, 400, name)
+        self.assertEqual(post("sub/a.docx").get_json()["count"], 1)
+        self.assertTrue(os.path.isfile(os.path.join(uploads, "sub", "a.docx")))
+
+        # Known content is linked in by name, under the same rules
+        digest = file_digest(os.path.join(FIXTURES_DIR, self.docs[0]))
+        response = self.client.post('/api/upload_check', json={"job": job_id, "files": [
+            {"name": "b.docx", "sha256": digest}, {"name": "../escape.docx", "sha256": digest}]})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/upload_check', json={"job": job_id, "files": [
+            {"name": "b.docx", "sha256": digest}, {"name": "c.docx", "sha256": "0" * 64}]})
+        self.assertEqual(response.get_json()["stored"], ["b.docx"])
+        self.assertEqual(response.get_json()["missing"], ["c.docx"])
+        self.assertEqual(sorted(os.listdir(uploads)), ["b.docx", "sub"])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp, "jobs", job_id))), ["job.json", "uploads"])
+        # Rejected parts are not left in the blob store
+        self.assertFalse([n for n in os.listdir(os.path.join(self.tmp, "blobs")) if n.endswith(".part")])
+
+    def test_event_stream_ends_with_the_job(self):
+        job_id = self.start_session()
+        self.upload(job_id, self.docs)
+        # Subscribed when the request is handled; the body is read once the scan runs
+        response = self.client.get(f'/api/events/{job_id}')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.client.post('/api/scan_start', json={"job": job_id})
+        events = [block.split("\n") for block in response.get_data(as_text=True).strip().split("\n\n")]
+        names = [lines[0] for lines in events]
+        self.assertEqual(names.count("event: file"), len(self.docs))
+        self.assertEqual(names[-1], "event: status")
+        self.assertEqual(json.loads(events[-1][1][len("data: "):])["status"], "completed")
+
+    def test_event_streams_are_bounded(self):
+        job_id = self.start_session()
+        with patch.object(self.server, "_EVENT_STREAMS", threading.BoundedSemaphore(1)), \
+                patch.object(self.server, "EVENTS_MAX_AGE", 0.2):
+            first = self.client.get(f'/api/events/{job_id}')
+            self.assertEqual(self.client.get(f'/api/events/{job_id}').status_code, 503)
+            # Ends while the job is still uploading; the client reconnects after the retry delay
+            body = first.get_data(as_text=True)
+            self.assertTrue(body.startswith("retry: "))
+            self.assertIn('"status": "uploading"', body)
+            first.close()
+            again = self.client.get(f'/api/events/{job_id}')
+            self.assertEqual(again.status_code, 200)
+            # Closed before the first event is read
+            again.close()
+        self.assertEqual(self.server.get_jobs().subscribers, {})
+
+class TestSyntheticCorpus(unittest.TestCase):
+    def test_corpus_is_reproducible_and_labelled(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            params = dict(files=20, paragraphs=30, match_density=0.02, seed=7)
+            info = corpus.generate_corpus(os.path.join(tmp, "a"), **params)
+            corpus.generate_corpus(os.path.join(tmp, "b"), **params)
+            names = sorted(f for f in os.listdir(os.path.join(tmp, "a")) if f.endswith(".docx"))
+            self.assertEqual(len(names), 20)
+            for name in names:
+                with open(os.path.join(tmp, "a", name), 'rb') as fa, open(os.path.join(tmp, "b", name), 'rb') as fb:
+                    self.assertEqual(fa.read(), fb.read())
+            scanner = DocxScanner()
+            errors = sum(scanner.scan_file(os.path.join(tmp, "a", name)).is_error for name in names)
+            self.assertEqual(errors, info["error_files"])
+
 class TestCLI(unittest.TestCase):
+    def test_max_matches_must_be_positive(self):
+        argv = ['docx-formula-mover', 'scan', FIXTURES_DIR, '--out', FIXTURES_DIR, '--max-matches', '0']
+        with patch('sys.argv', argv), patch('sys.stderr', io.StringIO()), \
+                patch.object(cli, 'run_scan') as run_scan:
+            with self.assertRaises(SystemExit):
+                cli.main()
+        run_scan.assert_not_called()
+
     def test_dry_run_scan(self):
         # Run CLI with dry-run on fixtures dir
         # We need to capture stdout or just verify no errors
@@ -66,7 +707,26 @@ class TestCLI(unittest.TestCase):
         test_args.out = output_dir
         test_args.recursive = True
         test_args.dry_run = True
+        test_args.placement = 'copy'
         test_args.verbose = False
+        test_args.engine = 'dom'
+        test_args.prefilter = True
+        test_args.classify_only = False
+        test_args.max_matches = None
+        test_args.workers = 1
+        test_args.incremental = False
+        test_args.resume = False
+        test_args.profile = None
+        test_args.include = None
+        test_args.exclude = []
+        test_args.min_size = None
+        test_args.max_size = None
+        test_args.skip_hidden = True
+        test_args.prefetch = 0
+        test_args.shard = None
+        test_args.cache = True
+        test_args.cache_path = None
+        test_args.cache_size_mb = 512
         test_args.command = 'scan'
         
         cli.run_scan(test_args)
@@ -74,5 +734,490 @@ class TestCLI(unittest.TestCase):
         self.assertTrue(os.path.exists(os.path.join(output_dir, "report.json")))
         self.assertTrue(os.path.exists(os.path.join(output_dir, "report.csv")))
 
+class TestPlacement(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "doc.docx")
+        with open(self.src, 'wb') as f:
+            f.write(b"PK fake docx bytes")
+        self.dest_folder = os.path.join(self.tmp, "formula_error")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_copy(self):
+        dest, used = utils.place_file(self.src, self.dest_folder, 'copy')
+        self.assertEqual(used, 'copy')
+        self.assertTrue(os.path.exists(self.src))
+        self.assertFalse(os.path.exists(dest + ".part"))
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), b"PK fake docx bytes")
+
+    def test_move(self):
+        dest, used = utils.place_file(self.src, self.dest_folder, 'move')
+        self.assertEqual(used, 'move')
+        self.assertFalse(os.path.exists(self.src))
+        self.assertTrue(os.path.exists(dest))
+
+    def test_hardlink(self):
+        dest, used = utils.place_file(self.src, self.dest_folder, 'hardlink')
+        if used == 'hardlink':
+            self.assertTrue(os.path.samefile(self.src, dest))
+        else:
+            self.assertEqual(used, 'copy')
+
+    def test_reflink_falls_back_to_copy(self):
+        dest, used = utils.place_file(self.src, self.dest_folder, 'reflink')
+        self.assertIn(used, ('reflink', 'copy'))
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), b"PK fake docx bytes")
+
+    def test_dry_run(self):
+        dest, used = utils.place_file(self.src, self.dest_folder, 'move', dry_run=True)
+        self.assertEqual((dest, used), (os.path.join(self.dest_folder, "doc.docx"), ""))
+        self.assertTrue(os.path.exists(self.src))
+        self.assertFalse(os.path.exists(self.dest_folder))
+
+class TestFormulaDetector(unittest.TestCase):
+    def test_matches_regex_pairing(self):
+        # Reference: the finditer-and-pair implementation the detector replaced
+        def reference(text):
+            starts = [m.start() for m in re.finditer(r'(?<!\\)\$\$', text)]
+            return [(starts[i], starts[i + 1] + 2) for i in range(0, len(starts) - 1, 2)]
+        rng = random.Random(20)
+        for _ in range(5000):
+            text = "".join(rng.choice("$$$\\ a") for _ in range(rng.randint(0, 16)))
+            self.assertEqual(list(DETECTOR.spans(text)), reference(text), text)
+        self.assertEqual(DETECTOR.find_matches("x \\$$ $$$a$$", 3, "word/document.xml"),
+                         [Match("$$$a$$", 3, 6, "word/document.xml")])
+
+    def test_target_parts(self):
+        for name in ("word/document.xml", "word/header1.xml", "word/footnotes.xml", "word/endnotes.xml"):
+            self.assertTrue(DETECTOR.is_target_part(name))
+        for name in ("word/styles.xml", "word/comments.xml", "word/_rels/document.xml.rels"):
+            self.assertFalse(DETECTOR.is_target_part(name))
+
+    def test_compact_results(self):
+        source = "".join(["word/", "document.xml"])
+        result = ScanResult("a.docx", True, [Match("$$x$$", 0, 0, source)])
+        self.assertFalse(hasattr(result, "__dict__"))
+        # Part names are interned again when results come back from workers
+        copy = pickle.loads(pickle.dumps(result))
+        self.assertIs(copy.matches[0].source, sys.intern("word/document.xml"))
+        self.assertEqual(copy.matches[0]["text"], "$$x$$")
+        entry = utils.report_entry({"input_path": "a.docx", "output_path": None, "label": "formula_error",
+                                    "matches": copy.matches, "skipped": False, "placement": None})
+        self.assertEqual(json.loads(json.dumps(entry))["matches"],
+                         [{"text": "$$x$$", "paragraph_index": 0, "offset": 0, "source": "word/document.xml"}])
+
+class TestDiscovery(unittest.TestCase):
+    def test_walk_order_and_filters(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for rel, size in [("b.docx", 10), ("A.DOCX", 10), ("~$a.docx", 1), (".hidden.docx", 1),
+                              ("notes.txt", 1), ("big.docx", 5000), ("sub/z.docx", 10), ("sub/deep/y.docx", 10),
+                              ("sub2/x.docx", 10), (".git/c.docx", 10), ("old/w.docx", 10)]:
+                path = os.path.join(tmp, rel)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(b"x" * size)
+
+            def found(**kwargs):
+                return [os.path.relpath(p, tmp).replace(os.sep, "/") for p, st in discovery.discover(tmp, **kwargs)]
+
+            # Same order as a sorted os.walk
+            self.assertEqual(found(), ["A.DOCX", "b.docx", "big.docx", "old/w.docx", "sub/z.docx",
+                                       "sub/deep/y.docx", "sub2/x.docx"])
+            self.assertEqual(found(recursive=False, max_size=100), ["A.DOCX", "b.docx"])
+            self.assertEqual(found(exclude=["old", "sub/*"], min_size=10, max_size=100), ["A.DOCX", "b.docx", "sub2/x.docx"])
+            self.assertIn(".git/c.docx", found(skip_hidden=False))
+            self.assertEqual(found(include=["*.txt"]), ["notes.txt"])
+
+            paths = [p for p, st in discovery.discover(tmp)]
+            self.assertEqual(list(discovery.prefetch(iter(paths), threads=2)), paths)
+            stats = {}
+            self.assertEqual(list(discovery.keep_stats(discovery.discover(tmp), stats)), paths)
+            self.assertEqual(stats[paths[0]].st_size, 10)
+
+class TestArchive(unittest.TestCase):
+    def test_stream_zip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            notes = os.path.join(tmp, "notes.txt")
+            with open(notes, 'w') as f:
+                f.write("plain text " * 1000)
+            doc = os.path.join(FIXTURES_DIR, "has_display_math.docx")
+            with patch.object(archive, 'CHUNK_SIZE', 1024):
+                chunks = list(archive.stream_zip([("a/has_display_math.docx", doc), ("notes.txt", notes)]))
+        self.assertGreater(len(chunks), 2)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+            self.assertIsNone(zf.testzip())
+            types = {info.filename: info.compress_type for info in zf.infolist()}
+            self.assertEqual(types, {"a/has_display_math.docx": zipfile.ZIP_STORED, "notes.txt": zipfile.ZIP_DEFLATED})
+            with open(doc, 'rb') as f:
+                self.assertEqual(zf.read("a/has_display_math.docx"), f.read())
+
+class TestBlobStore(unittest.TestCase):
+    def test_stored_once_linked_by_name(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = BlobStore(os.path.join(tmp, "blobs"))
+            doc = os.path.join(FIXTURES_DIR, "has_display_math.docx")
+            with open(doc, 'rb') as f:
+                digest = store.put_stream(f)
+            with open(doc, 'rb') as f:
+                self.assertEqual(store.put_stream(f), digest)
+            self.assertEqual(digest, file_digest(doc))
+            self.assertTrue(store.has(digest))
+            self.assertFalse(store.has("0" * 64))
+            self.assertFalse(store.has("../" + digest))
+            self.assertEqual([os.path.basename(p) for p in os.listdir(os.path.join(tmp, "blobs", digest[:2]))], [digest])
+            # Written in place and renamed into the store
+            with store.temp_file() as f, open(doc, 'rb') as g:
+                f.write(g.read())
+            self.assertEqual(store.put_file(f), digest)
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp, "blobs"))), [digest[:2]])
+            for name in ("a.docx", "sub/b.docx"):
+                store.link(digest, os.path.join(tmp, "uploads", name))
+                with open(os.path.join(tmp, "uploads", name), 'rb') as f, open(doc, 'rb') as g:
+                    self.assertEqual(f.read(), g.read())
+
+class TestReportWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.entries = [
+            {"input_path": "a.docx", "output_path": "out/formula_error/a.docx", "label": "formula_error",
+             "matches": [{"text": "$$x$$", "paragraph_index": 0, "offset": 3, "source": "word/document.xml"}],
+             "skipped": False, "placement": "copy"},
+            {"input_path": "b.docx", "output_path": "out/no_error/b.docx", "label": "no_error",
+             "matches": [], "skipped": False, "placement": "hardlink"},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_entries_visible_before_close(self):
+        writer = utils.ReportWriter(self.tmp)
+        writer.write(self.entries[0])
+        writer.flush()
+        self.assertEqual(list(utils.read_report_entries(self.tmp)), self.entries[:1])
+        writer.write(self.entries[1])
+        writer.close()
+        with open(os.path.join(self.tmp, "report.json"), encoding='utf-8') as f:
+            self.assertEqual(f.read(), json.dumps(self.entries, indent=2))
+
+    def test_merge_replaces_and_removes(self):
+        utils.generate_reports(self.entries, self.tmp)
+        updated = dict(self.entries[0], label="no_error", matches=[])
+        new = dict(self.entries[1], input_path="c.docx")
+        utils.merge_reports([updated, new], self.tmp, removed_paths=["b.docx"])
+        with open(os.path.join(self.tmp, "report.json"), encoding='utf-8') as f:
+            self.assertEqual(json.load(f), [updated, new])
+
+    def test_profile_columns(self):
+        profile = dict.fromkeys(PROFILE_FIELDS, 1)
+        writer = utils.ReportWriter(self.tmp, profile=True)
+        writer.write(dict(self.entries[0], profile=profile))
+        writer.write(self.entries[1])  # e.g. a cache hit
+        writer.close()
+        with open(os.path.join(self.tmp, "report.csv"), newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], utils.CSV_HEADER + utils.PROFILE_CSV_HEADER)
+        self.assertEqual(rows[1][len(utils.CSV_HEADER):], ["1"] * len(PROFILE_FIELDS))
+        self.assertEqual(rows[2][len(utils.CSV_HEADER):], [""] * len(PROFILE_FIELDS))
+
+    def test_index_queries(self):
+        entries = self.entries + [dict(self.entries[1], input_path="sub\\c_50%.docx", label="skipped")]
+        utils.generate_reports(entries, self.tmp)
+        index = open_index(self.tmp)  # built from the existing report
+        self.assertEqual(index.summary(), {"total": 3, "sources": {"word/document.xml": 1},
+                                           "labels": {"formula_error": 1, "no_error": 1, "skipped": 1}})
+        self.assertEqual(index.query(label="no_error"), (1, [entries[1]], None))
+        self.assertEqual(index.query(source="word/document.xml"), (1, [entries[0]], None))
+        self.assertEqual(index.query(name="C_50%"), (1, [entries[2]], None))
+        self.assertEqual(index.query(name="c%"), (0, [], None))
+        total, page, _ = index.query(sort="name", descending=True, offset=1, limit=1)
+        self.assertEqual((total, page), (3, [entries[1]]))
+        with self.assertRaises(ValueError):
+            index.query(sort="size")
+        with self.assertRaises(ValueError):
+            index.query(after="[1]")
+
+        # Keyset pages: each resumes after the last entry of the one before
+        for sort, descending in (("name", True), ("label", False), ("order", False)):
+            pages, cursor = [], None
+            while True:
+                _, page, cursor = index.query(sort=sort, descending=descending, limit=2, after=cursor)
+                pages.append(page)
+                if cursor is None:
+                    break
+            self.assertEqual(pages, [index.query(sort=sort, descending=descending, limit=2)[1],
+                                     index.query(sort=sort, descending=descending, offset=2, limit=2)[1]])
+
+        # The summary counts are kept as entries are added and cleared
+        index.add(entries[0])
+        index.commit()
+        self.assertEqual(index.summary()["labels"]["formula_error"], 2)
+        self.assertEqual(index.query(label="formula_error")[0], 2)
+        index.clear()
+        self.assertEqual(index.summary(), {"total": 0, "labels": {}, "sources": {}})
+        index.close()
+
+class TestIncrementalScan(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmp, "input")
+        self.output_dir = os.path.join(self.tmp, "output")
+        os.makedirs(self.input_dir)
+        for name in ["has_display_math.docx", "no_math.docx"]:
+            shutil.copy2(os.path.join(FIXTURES_DIR, name), self.input_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_scan(self, incremental=True, resume=False, placement='copy'):
+        args = argparse.Namespace(
+            command='scan', input_path=self.input_dir, out=self.output_dir, recursive=True,
+            dry_run=False, verbose=False, placement=placement, engine='dom', prefilter=True, workers=1,
+            classify_only=False, max_matches=None,
+            cache=False, cache_path=None, cache_size_mb=512, incremental=incremental, resume=resume,
+            profile=None, include=None, exclude=[], min_size=None, max_size=None, skip_hidden=True, prefetch=0,
+            shard=None)
+        with patch.object(DocxScanner, 'scan_file', autospec=True, side_effect=_original_scan_file) as scan_file:
+            cli.run_scan(args)
+        with open(os.path.join(self.output_dir, "report.json"), encoding='utf-8') as f:
+            report = json.load(f)
+        return scan_file.call_count, {os.path.basename(item["input_path"]): item["label"] for item in report}
+
+    def test_only_changed_files_are_scanned(self):
+        scanned, labels = self.run_scan()
+        self.assertEqual(scanned, 2)
+        self.assertEqual(labels, {"has_display_math.docx": "formula_error", "no_math.docx": "no_error"})
+
+        scanned, labels = self.run_scan()
+        self.assertEqual(scanned, 0)
+        self.assertEqual(len(labels), 2)
+
+        shutil.copy2(os.path.join(FIXTURES_DIR, "split_runs_display.docx"), self.input_dir)
+        os.remove(os.path.join(self.input_dir, "no_math.docx"))
+        scanned, labels = self.run_scan()
+        self.assertEqual(scanned, 1)
+        self.assertEqual(labels, {"has_display_math.docx": "formula_error",
+                                  "split_runs_display.docx": "formula_error"})
+        # The deleted input's copy goes with its entry
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "no_error", "no_math.docx")))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "formula_error", "has_display_math.docx")))
+
+    def test_moved_inputs_keep_their_entries(self):
+        self.run_scan(placement='move')
+        self.assertEqual(os.listdir(self.input_dir), [])
+        shutil.copy2(os.path.join(FIXTURES_DIR, "split_runs_display.docx"), self.input_dir)
+        scanned, labels = self.run_scan(placement='move')
+        self.assertEqual(scanned, 1)
+        self.assertEqual(labels, {"has_display_math.docx": "formula_error", "no_math.docx": "no_error",
+                                  "split_runs_display.docx": "formula_error"})
+        scanned, labels = self.run_scan(placement='move')
+        self.assertEqual((scanned, len(labels)), (0, 3))
+
+    def test_resume_continues_interrupted_run(self):
+        shutil.copy2(os.path.join(FIXTURES_DIR, "split_runs_display.docx"), self.input_dir)
+        self.run_scan(incremental=False)
+        # Simulate a kill: one finished entry, one whose copy never landed, a torn line
+        jsonl_path = os.path.join(self.output_dir, "report.jsonl")
+        with open(jsonl_path, encoding='utf-8') as f:
+            lines = f.readlines()
+        with open(jsonl_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines[:2])
+            f.write(lines[2][:10])
+        os.remove(json.loads(lines[1])["output_path"])
+
+        scanned, labels = self.run_scan(incremental=False, resume=True)
+        self.assertEqual(scanned, 2)
+        self.assertEqual(labels, {"has_display_math.docx": "formula_error", "no_math.docx": "no_error",
+                                  "split_runs_display.docx": "formula_error"})
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestShardedScan(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmp, "input")
+        names = ["has_display_math.docx", "escaped_dollar.docx", "no_math.docx", "split_runs_display.docx"]
+        for sub in ["", "a", "a/deep", "b"]:
+            os.makedirs(os.path.join(self.input_dir, sub), exist_ok=True)
+            for name in names:
+                shutil.copy2(os.path.join(FIXTURES_DIR, name), os.path.join(self.input_dir, sub, f"{len(sub)}_{name}"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def cli(self, *argv):
+        subprocess.run([sys.executable, "-m", "src.docx_formula_mover"] + list(argv), cwd=REPO_ROOT,
+                       check=True, stdout=subprocess.DEVNULL)
+
+    def read_report(self, name):
+        with open(os.path.join(self.tmp, name, "report.json"), encoding='utf-8') as f:
+            return [(e["input_path"], e["label"], len(e["matches"])) for e in json.load(f)]
+
+    def test_shards_merge_into_unsharded_report(self):
+        shards = 3
+        procs = [subprocess.Popen([sys.executable, "-m", "src.docx_formula_mover", "scan", self.input_dir,
+                                   "--out", os.path.join(self.tmp, f"shard{k}"), "--shard", f"{k}/{shards}",
+                                   "--dry-run", "--no-cache", "--workers", "1"],
+                                  cwd=REPO_ROOT, stdout=subprocess.DEVNULL)
+                 for k in range(1, shards + 1)]
+        self.assertEqual([p.wait() for p in procs], [0] * shards)
+        self.cli("scan", self.input_dir, "--out", os.path.join(self.tmp, "whole"), "--dry-run", "--no-cache",
+                 "--workers", "1")
+        self.cli("merge-reports", *[os.path.join(self.tmp, f"shard{k}") for k in range(1, shards + 1)],
+                 "--out", os.path.join(self.tmp, "merged"))
+
+        sizes = [len(self.read_report(f"shard{k}")) for k in range(1, shards + 1)]
+        self.assertEqual(sum(sizes), 16)
+        self.assertEqual(self.read_report("merged"), self.read_report("whole"))
+        with open(os.path.join(self.tmp, "merged", "summary.json"), encoding='utf-8') as f:
+            summary = json.load(f)
+        self.assertEqual(summary["total"], 16)
+        self.assertEqual(summary["labels"], {"formula_error": 8, "no_error": 8})
+        self.assertEqual(sorted(summary["shards"].values()), sorted(sizes))
+
+    def test_shards_scanned_under_different_roots(self):
+        mirror = os.path.join(self.tmp, "mirror")
+        shutil.copytree(self.input_dir, mirror)
+        for k, root in ((1, self.input_dir), (2, mirror)):
+            self.cli("scan", root, "--out", os.path.join(self.tmp, f"shard{k}"), "--shard", f"{k}/2",
+                     "--dry-run", "--no-cache", "--workers", "1")
+        self.cli("scan", self.input_dir, "--out", os.path.join(self.tmp, "whole"), "--dry-run", "--no-cache",
+                 "--workers", "1")
+        shard_roots = [os.path.join(self.tmp, "shard1"), os.path.join(self.tmp, "shard2")]
+        self.cli("merge-reports", *shard_roots, "--out", os.path.join(self.tmp, "merged"))
+
+        def relative(name):
+            return [(os.path.relpath(path, mirror if path.startswith(mirror + os.sep) else self.input_dir), label)
+                    for path, label, _ in self.read_report(name)]
+        self.assertEqual(relative("merged"), relative("whole"))
+
+        # Merging into a shard root would overwrite the report being read
+        shard1 = self.read_report("shard1")
+        proc = subprocess.run([sys.executable, "-m", "src.docx_formula_mover", "merge-reports", *shard_roots,
+                               "--out", shard_roots[0] + os.sep], cwd=REPO_ROOT, stdout=subprocess.DEVNULL)
+        self.assertEqual(proc.returncode, 1)
+        self.assertEqual(self.read_report("shard1"), shard1)
+
+    def test_shard_spec(self):
+        self.assertEqual(cli.shard_spec("2/4"), (2, 4))
+        for value in ("0/4", "5/4", "2", "a/b"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                cli.shard_spec(value)
+        counts = [discovery.shard_of(f"dir/{i}.docx", 4) for i in range(400)]
+        self.assertEqual(sorted(set(counts)), [1, 2, 3, 4])
+        self.assertEqual(counts, [discovery.shard_of(f"dir/{i}.docx", 4) for i in range(400)])
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.drop = os.path.join(self.tmp, "drop")
+        os.makedirs(self.drop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_debouncer_waits_for_writes_to_settle(self):
+        path = os.path.join(self.drop, "a.docx")
+        with open(path, 'wb') as f:
+            f.write(b"PK")
+        debouncer = watch.Debouncer(settle=1.0)
+        debouncer.touch(path, now=0.0)
+        self.assertEqual(debouncer.ready(now=0.5), [])
+        with open(path, 'ab') as f:
+            f.write(b"more")
+        # Still growing when due: it gets another settle period
+        self.assertEqual(debouncer.ready(now=1.0), [])
+        self.assertEqual([p for p, _ in debouncer.ready(now=2.0)], [path])
+        self.assertEqual(debouncer.pending, {})
+
+    def test_path_matches(self):
+        root = self.drop
+        self.assertTrue(discovery.path_matches(root, os.path.join(root, "a", "Doc.DOCX")))
+        self.assertFalse(discovery.path_matches(root, os.path.join(root, ".git", "a.docx")))
+        self.assertFalse(discovery.path_matches(root, os.path.join(root, "~$a.docx")))
+        self.assertFalse(discovery.path_matches(root, os.path.join(root, "out", "a.docx"), exclude=["out"]))
+        self.assertFalse(discovery.path_matches(root, os.path.join(self.tmp, "a.docx")))
+
+    def test_watch_classifies_new_files(self):
+        for mode in ([], ["--poll", "--poll-interval", "0.1"]):
+            # Inside the watched directory: placed copies must not be picked up
+            out = os.path.join(self.drop, "out")
+            shutil.copy2(os.path.join(FIXTURES_DIR, "no_math.docx"), os.path.join(self.drop, "existing.docx"))
+            proc = subprocess.Popen([sys.executable, "-m", "src.docx_formula_mover", "watch", self.drop,
+                                     "--out", out, "--workers", "1", "--settle", "0.1"] + mode,
+                                    cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True)
+            try:
+                labels = []
+                def classified():
+                    while True:
+                        line = proc.stdout.readline()
+                        self.assertTrue(line, "watch exited early")
+                        if line.startswith(("formula_error:", "no_error:", "skipped:")):
+                            return line.split(":")[0]
+                labels.append(classified())
+                # A new directory is picked up together with its contents
+                os.makedirs(os.path.join(self.drop, "sub"), exist_ok=True)
+                shutil.copy2(os.path.join(FIXTURES_DIR, "has_display_math.docx"),
+                             os.path.join(self.drop, "sub", "new.docx"))
+                labels.append(classified())
+            finally:
+                proc.terminate()
+                self.assertEqual(proc.wait(timeout=10), 0)
+                proc.stdout.close()
+            self.assertEqual(labels, ["no_error", "formula_error"])
+            with open(os.path.join(out, "report.json"), encoding='utf-8') as f:
+                report = json.load(f)
+            self.assertEqual([(e["input_path"], e["label"]) for e in report],
+                             [(os.path.join(self.drop, "existing.docx"), "no_error"),
+                              (os.path.join(self.drop, "sub", "new.docx"), "formula_error")])
+            self.assertTrue(os.path.exists(os.path.join(out, "formula_error", "new.docx")))
+            os.remove(os.path.join(self.drop, "sub", "new.docx"))
+            shutil.rmtree(out)
+
+    def start_watch(self, out):
+        proc = subprocess.Popen([sys.executable, "-m", "src.docx_formula_mover", "watch", self.drop,
+                                 "--out", out, "--workers", "1", "--settle", "0.1"],
+                                cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True)
+        self.addCleanup(proc.stdout.close)
+        # A watch that never reports ends the test instead of hanging it
+        timer = threading.Timer(60, proc.kill)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        return proc
+
+    def classified(self, proc):
+        while True:
+            line = proc.stdout.readline()
+            self.assertTrue(line, "watch exited early")
+            if line.startswith(("formula_error:", "no_error:", "skipped:")):
+                return line.strip()
+
+    def test_restart_rescans_files_changed_meanwhile(self):
+        out = os.path.join(self.tmp, "out")
+        for name in ("a.docx", "b.docx"):
+            shutil.copy2(os.path.join(FIXTURES_DIR, "no_math.docx"), os.path.join(self.drop, name))
+        proc = self.start_watch(out)
+        try:
+            first = sorted(self.classified(proc) for _ in range(2))
+        finally:
+            proc.terminate()
+            self.assertEqual(proc.wait(timeout=10), 0)
+        self.assertEqual(first, [f"no_error: {os.path.join(self.drop, name)}" for name in ("a.docx", "b.docx")])
+
+        # Modified while no watch was running; a.docx is unchanged
+        shutil.copy2(os.path.join(FIXTURES_DIR, "has_display_math.docx"), os.path.join(self.drop, "b.docx"))
+        proc = self.start_watch(out)
+        try:
+            self.assertEqual(self.classified(proc), f"formula_error: {os.path.join(self.drop, 'b.docx')}")
+        finally:
+            proc.terminate()
+            self.assertEqual(proc.wait(timeout=10), 0)
+        with open(os.path.join(out, "report.json"), encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertEqual([os.path.basename(e["input_path"]) for e in report], ["a.docx", "b.docx", "b.docx"])
+
 if __name__ == '__main__':
     unittest.main()